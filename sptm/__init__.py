@@ -1,6 +1,16 @@
 from .model import Model, ModelVanilla
 from .postprocess import TopicDistanceMap
-from .preprocess import Corpus
+from .preprocess import Corpus, TokenFilter
 from .utils import force_unicode
 from .conditional import ConditionalMatrix
 from .inference import Inferencer
+from .cache import TokenCache
+from .tokenstore import TokenStore, SentenceStore
+from .dedup import Deduplicator
+from .hashing import HashedDictionary
+from .coherence import CooccurrenceCache
+from .distributed import LdaCluster
+from .gibbs import GibbsLda
+from .telemetry import Telemetry, JsonLinesSink, PrometheusTextSink
+from .bundle import ModelBundle
+from .doctopics import load_doctopics, iter_doctopics
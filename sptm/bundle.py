@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Memory-mappable bundle of a trained topic model
+"""
+
+#######################################
+
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+
+import numpy as np
+import gensim.utils as utils
+
+from sptm.utils import force_unicode
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+class ModelBundle:
+    """Trained topic model saved as a directory of plain arrays
+
+    A bundle is a directory holding:
+
+        manifest.json: format, format version, sizes, model class, creation
+            time and the sha256 checksum of every other file
+        params.json: parameters the model was trained with
+        topic_word.npy: float32 topic word distributions (num_topics x
+            num_terms)
+        doc_topic.npy: float32 topic distribution of every training
+            document (num_docs x num_topics)
+        dictionary: gensim Dictionary (or sptm.hashing.HashedDictionary) of
+            the corpus, saved by gensim
+
+    Opening a bundle reads the two json files only: the arrays are memory
+    mapped, so processes serving the same bundle share their pages through
+    the page cache, and the dictionary is unpickled on first use. The
+    bundle answers the topic methods of gensim models (get_topics(),
+    show_topic(), show_topics(), print_topics()), which Model.topics() and
+    ModelVanilla.topics() call.
+
+    Attributes:
+        path: Directory of the bundle, None until saved or loaded
+        manifest: Dictionary read from manifest.json
+        params: Dictionary of the training parameters
+        topic_word: numpy array of the topic word distributions
+        doc_topic: numpy array of the document topic distributions
+        num_topics: Number of topics
+        num_terms: Size of the vocabulary
+    """
+
+    def __init__(self, topic_word, doc_topic, id2word, params=None, \
+                                                                model=None):
+        """Inits ModelBundle from the arrays of a trained model
+
+        Args:
+            topic_word: Topic word distributions (num_topics x num_terms)
+            doc_topic: Document topic distributions (num_docs x num_topics)
+            id2word: Dictionary of the corpus
+            params: Dictionary of the training parameters
+            model: Name of the model class
+        """
+        self.path = None
+        self.topic_word = topic_word
+        self.doc_topic = doc_topic
+        self._id2word = id2word
+        self.params = dict(params or {})
+        self.num_topics, self.num_terms = np.shape(topic_word)
+        self.manifest = {'format': 'sptm-model', 'version': FORMAT_VERSION, \
+            'model': model, 'num_topics': int(self.num_topics), \
+            'num_terms': int(self.num_terms), \
+                                    'num_docs': int(np.shape(doc_topic)[0])}
+
+    @property
+    def id2word(self):
+        """Dictionary of the corpus, read from the bundle on first use"""
+        if self._id2word is None and self.path is not None:
+            self._id2word = utils.SaveLoad.load(os.path.join(self.path, \
+                                                                'dictionary'))
+        return self._id2word
+
+    def save(self, path):
+        """Save the bundle in a new directory
+
+        The bundle is written next to path (<path>.partial) and renamed at
+        once, so readers never open a partial bundle. A partial bundle left
+        by a save that crashed is replaced.
+
+        Args:
+            path: Directory to create
+
+        Raises:
+            IOError: Error with path / File already exists
+        """
+        if os.path.exists(path):
+            raise IOError('Error with output path / File already exists')
+        partial = path.rstrip(os.sep) + '.partial'
+        shutil.rmtree(partial, ignore_errors=True)
+        try:
+            os.makedirs(partial)
+            np.save(os.path.join(partial, 'topic_word.npy'), \
+                            np.ascontiguousarray(self.topic_word, np.float32))
+            np.save(os.path.join(partial, 'doc_topic.npy'), \
+                            np.ascontiguousarray(self.doc_topic, np.float32))
+            self.id2word.save(os.path.join(partial, 'dictionary'))
+            _write_json(os.path.join(partial, 'params.json'), self.params)
+
+            manifest = dict(self.manifest)
+            manifest['created'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', \
+                                                                time.gmtime())
+            manifest['files'] = dict((name, {'sha256': _sha256(os.path.join(\
+                partial, name)), 'bytes': os.path.getsize(os.path.join( \
+                partial, name))}) for name in sorted(os.listdir(partial)))
+            _write_json(os.path.join(partial, 'manifest.json'), manifest)
+            os.rename(partial, path)
+        except (IOError, OSError):
+            shutil.rmtree(partial, ignore_errors=True)
+            raise IOError('Error with output path / File already exists')
+        self.manifest = manifest
+        self.path = path
+        logger.info('saved model bundle %s: %d topics, %d terms, %d ' \
+            'documents', path, self.num_topics, self.num_terms, \
+                                                    manifest['num_docs'])
+
+    @classmethod
+    def load(cls, path, mmap=True, verify=False):
+        """Open a bundle saved with ModelBundle.save()
+
+        Args:
+            path: Directory of the bundle
+            mmap: Memory-map the arrays instead of reading them
+            verify: Check the checksums of the files first, which reads
+                them all
+
+        Returns:
+            ModelBundle object
+
+        Raises:
+            IOError: Not a bundle / unsupported version / corrupted
+        """
+        mode = 'r' if mmap else None
+        try:
+            manifest = _read_json(os.path.join(path, 'manifest.json'))
+            if manifest.get('format') != 'sptm-model' or \
+                                    manifest['version'] != FORMAT_VERSION:
+                raise IOError('Unsupported model bundle version')
+            bundle = cls.__new__(cls)
+            bundle.path = path
+            bundle.manifest = manifest
+            bundle._id2word = None
+            bundle.params = _read_json(os.path.join(path, 'params.json'))
+            bundle.topic_word = np.load(os.path.join(path, \
+                                            'topic_word.npy'), mmap_mode=mode)
+            bundle.doc_topic = np.load(os.path.join(path, 'doc_topic.npy'), \
+                                                            mmap_mode=mode)
+        except (IOError, OSError, ValueError, KeyError):
+            raise IOError('Model bundle not found or corrupted')
+        bundle.num_topics, bundle.num_terms = bundle.topic_word.shape
+        if verify:
+            bundle.verify()
+        return bundle
+
+    @staticmethod
+    def is_bundle(path):
+        """Check whether a path is a directory saved with ModelBundle.save()
+
+        Args:
+            path: Location to check
+
+        Returns:
+            Boolean
+        """
+        return os.path.isfile(os.path.join(path, 'manifest.json'))
+
+    def verify(self):
+        """Check the files of the bundle against the manifest
+
+        Raises:
+            IOError: A file is missing or does not match its checksum
+        """
+        for name, entry in sorted(self.manifest['files'].items()):
+            location = os.path.join(self.path, name)
+            if not os.path.isfile(location) or \
+                                        _sha256(location) != entry['sha256']:
+                raise IOError('Model bundle file %s corrupted' % name)
+
+    def get_topics(self):
+        """Topic word distributions
+
+        Returns:
+            numpy array of shape (num_topics, num_terms)
+        """
+        return self.topic_word
+
+    def show_topic(self, topicid, topn=10):
+        """Top words of a topic
+
+        Args:
+            topicid: Topic number
+            topn: Number of words
+
+        Returns:
+            List of (word, probability)
+        """
+        topic = np.asarray(self.topic_word[topicid])
+        best = np.argsort(-topic, kind='stable')[:topn]
+        return [(self.id2word[i], float(topic[i])) for i in best]
+
+    def show_topics(self, num_topics=10, num_words=10, log=False, \
+                                                            formatted=True):
+        """Top words of the first num_topics topics
+
+        Args:
+            num_topics: Number of topics, -1 for all
+            num_words: Number of words of every topic
+            log: Log the topics too
+            formatted: Format the words as gensim does
+
+        Returns:
+            List of (topic number, top words)
+        """
+        if num_topics < 0 or num_topics > self.num_topics:
+            num_topics = self.num_topics
+        shown = []
+        for i in range(num_topics):
+            topic = self.show_topic(i, num_words)
+            if formatted:
+                topic = ' + '.join('%.3f*"%s"' % (p, w) for w, p in topic)
+            shown.append((i, topic))
+            if log:
+                logger.info('topic #%i: %s', i, topic)
+        return shown
+
+    def print_topics(self, num_topics=20, num_words=10):
+        """Top words of the first num_topics topics, logged
+
+        Args:
+            num_topics: Number of topics, -1 for all
+            num_words: Number of words of every topic
+
+        Returns:
+            List of (topic number, top words)
+        """
+        return self.show_topics(num_topics, num_words, log=True)
+
+    def doc_topics(self):
+        """Topic distribution of every training document
+
+        Returns:
+            numpy array of shape (num_docs, num_topics)
+        """
+        return self.doc_topic
+
+def _sha256(path):
+    """Checksum of a file, read in blocks
+
+    Args:
+        path: Location of the file
+
+    Returns:
+        Hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as F:
+        for block in iter(lambda: F.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _write_json(path, value):
+    """Write a value as json
+
+    Args:
+        path: Location of the file
+        value: Value to write
+    """
+    with io.open(path, 'w', encoding='utf8') as F:
+        F.write(force_unicode(json.dumps(value, sort_keys=True)))
+
+def _read_json(path):
+    """Read a json file
+
+    Args:
+        path: Location of the file
+
+    Returns:
+        Value read
+    """
+    with io.open(path, 'r', encoding='utf8') as F:
+        return json.load(F)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Persistent cache of tokenized sentences
+"""
+
+#######################################
+
+import json
+import hashlib
+import logging
+import sqlite3
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+class TokenCache:
+    """On disk cache of tokenized sentences backed by sqlite
+
+    Entries are addressed by a hash of the sentence text and of the
+    tokenizer configuration (spacy model, version, pipeline, filter), so a
+    change in any of them simply misses the cache. Once the cache holds more
+    than max_entries sentences, the least recently used ones are evicted.
+
+    Attributes:
+        path: Location of the sqlite file
+        max_entries: Maximum number of sentences kept in the cache
+        hits: Number of lookups found in the cache
+        misses: Number of lookups not found in the cache
+    """
+
+    def __init__(self, path, max_entries=10000000):
+        """Inits TokenCache, creating the sqlite file if needed
+
+        Args:
+            path: Location of the sqlite file
+            max_entries: Maximum number of sentences kept in the cache
+
+        Raises:
+            IOError: Cache file could not be opened
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        try:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS tokens (key ' \
+                    'BLOB PRIMARY KEY, tokens TEXT, used INTEGER)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS tokens_used ' \
+                                                            'ON tokens (used)')
+            self._size, clock = self._conn.execute('SELECT COUNT(*), ' \
+                                        'MAX(used) FROM tokens').fetchone()
+        except sqlite3.Error:
+            raise IOError('Could not open cache file')
+        self._clock = (clock or 0) + 1
+
+    @staticmethod
+    def key(text, config):
+        """Content address of a sentence
+
+        Args:
+            text: Sentence
+            config: String describing the tokenizer configuration
+
+        Returns:
+            Bytes digest
+        """
+        return hashlib.sha1((config + u'\0' + text).encode('utf8')).digest()
+
+    def get_many(self, keys):
+        """Look up several sentences at once
+
+        Args:
+            keys: List of keys returned by TokenCache.key()
+
+        Returns:
+            Dictionary of {key: list of tokens} for the keys found
+        """
+        found = dict()
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            rows = self._conn.execute('SELECT key, tokens FROM tokens ' \
+                'WHERE key IN (%s)' % ','.join('?' * len(part)), \
+                                        [sqlite3.Binary(k) for k in part])
+            for key, tokens in rows:
+                found[bytes(key)] = json.loads(tokens)
+        self._conn.executemany('UPDATE tokens SET used = ? WHERE key = ?', \
+                    [(self._clock, sqlite3.Binary(k)) for k in found])
+        hits = sum(1 for k in keys if k in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """Store several tokenized sentences at once
+
+        Args:
+            items: List of (key, list of tokens)
+        """
+        cursor = self._conn.executemany('INSERT OR IGNORE INTO tokens ' \
+            'VALUES (?, ?, ?)', [(sqlite3.Binary(k), json.dumps(v), \
+                                            self._clock) for k, v in items])
+        self._size += max(cursor.rowcount, 0)
+
+    def commit(self):
+        """Evict the least recently used entries above max_entries and
+        write everything to disk
+        """
+        if self._size > self.max_entries:
+            excess = self._size - self.max_entries
+            self._conn.execute('DELETE FROM tokens WHERE key IN (SELECT key ' \
+                        'FROM tokens ORDER BY used LIMIT ?)', (excess,))
+            self._size -= excess
+            logger.info('evicted %d sentences from token cache', excess)
+        self._conn.commit()
+        self._clock += 1
+
+    def close(self):
+        """Commit and close the cache file
+        """
+        self.commit()
+        self._conn.close()
+        total = self.hits + self.misses
+        logger.info('token cache %s: %d hits, %d misses (%.1f%% hit rate)', \
+            self.path, self.hits, self.misses, \
+                                100.0 * self.hits / total if total else 0.0)
+
+    def __len__(self):
+        return self._size
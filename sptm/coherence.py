@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Shared co-occurrence statistics for c_v coherence
+"""
+
+#######################################
+
+import logging
+import multiprocessing
+from itertools import islice
+
+import numpy as np
+import scipy.sparse as sparse
+from gensim.models import CoherenceModel
+from gensim.topic_coherence.text_analysis import WindowedTextsAnalyzer
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+# Sliding window gensim uses for c_v
+WINDOW_SIZE = 110
+
+# Whether gensim only slides windows over the texts holding a top word
+_RELEVANT_TEXTS = hasattr(WindowedTextsAnalyzer, 'text_is_relevant')
+
+# Dictionary the cache processes use to map tokens to ids
+_DICTIONARY = None
+
+class CooccurrenceCache:
+    """Boolean sliding window statistics of a corpus, computed once
+
+    gensim's CoherenceModel(coherence='c_v') slides a window over every text
+    containing one of the top words of the model, each time a coherence is
+    computed. The cache slides the windows once, over all the texts, and
+    keeps which token ids every window holds. Coherence of any model is
+    then computed from the windows of its top words only.
+
+    Counts are the same gensim computes: a window of a text holds a token
+    if it is in the dictionary, texts shorter than the window are one
+    window, and the number of windows is the normalizer (only of the texts
+    holding one of the top words, with gensim versions that skip the
+    others).
+
+    Attributes:
+        dictionary: gensim Dictionary (or sptm.hashing.HashedDictionary) of
+            the texts
+        window_size: Number of tokens of a window
+        windows: scipy CSC matrix, windows x token ids, 1 where the window
+            holds the token
+        presence: scipy CSC matrix, texts x token ids, 1 where the text
+            holds the token
+        text_windows: numpy array, number of windows of every text
+    """
+
+    def __init__(self, texts, dictionary, window_size=WINDOW_SIZE, \
+                                        processes=None, chunksize=10000):
+        """Inits CooccurrenceCache, sliding the windows over texts
+
+        Args:
+            texts: Iterable of lists of tokens, e.g. Model.tokens
+            dictionary: gensim Dictionary (or sptm.hashing.HashedDictionary)
+                of the texts
+            window_size: Number of tokens of a window
+            processes: Number of processes sliding the windows, defaults to
+                the number of CPUs
+            chunksize: Number of texts sent to a process at a time
+        """
+        self.dictionary = dictionary
+        self.window_size = window_size
+        processes = processes or multiprocessing.cpu_count()
+
+        chunks = _chunks(texts, chunksize)
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, _init_cache, \
+                                                            (dictionary,))
+            try:
+                parts = pool.map(_slide_chunk, ((c, window_size) for c in \
+                                                        chunks), chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_cache(dictionary)
+            parts = [_slide_chunk((c, window_size)) for c in chunks]
+
+        num_terms = _num_terms(dictionary)
+        self.windows = _stack([p[0] for p in parts], num_terms)
+        self.presence = _stack([p[1] for p in parts], num_terms)
+        self.text_windows = np.concatenate([p[2] for p in parts] + \
+                                                [np.zeros(0, dtype=np.int64)])
+        logger.info('co-occurrence cache: %d texts, %d windows', \
+                                len(self.text_windows), self.windows.shape[0])
+
+    def accumulator(self, ids):
+        """Statistics of a set of token ids
+
+        Args:
+            ids: Iterable of token ids, e.g. the top words of a model
+
+        Returns:
+            Object usable as the accumulator of a gensim CoherenceModel
+        """
+        ids = np.unique(np.asarray(list(ids), dtype=np.int64))
+        sub = self.windows[:, ids]
+        cooccurrences = (sub.T @ sub).toarray()
+        if _RELEVANT_TEXTS:
+            relevant = np.asarray(self.presence[:, ids].sum(axis=1)).ravel()
+            num_docs = self.text_windows[relevant > 0].sum()
+        else:
+            num_docs = self.text_windows.sum()
+        return _Accumulator(ids, cooccurrences, int(num_docs))
+
+    def coherence(self, model, topn=20):
+        """c_v coherence of a trained model
+
+        Args:
+            model: gensim topic model, e.g. LdaModel or LdaMallet
+            topn: Number of top words of each topic
+
+        Returns:
+            Float value
+        """
+        cm = CoherenceModel(model=model, texts=[[]], \
+                dictionary=self.dictionary, coherence='c_v', topn=topn)
+        cm._accumulator = self.accumulator(np.concatenate(cm.topics))
+        return cm.get_coherence()
+
+class _Accumulator:
+    """Occurrence counts of a few token ids, standing in for gensim's
+    WordOccurrenceAccumulator
+
+    Attributes:
+        relevant_ids: Set of the token ids
+        num_docs: Number of windows
+    """
+
+    def __init__(self, ids, cooccurrences, num_docs):
+        self._index = dict((int(w), i) for i, w in enumerate(ids))
+        self._cooccurrences = cooccurrences
+        self.relevant_ids = set(self._index)
+        self.num_docs = num_docs
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self._cooccurrences[self._index[int(key[0])], \
+                                                    self._index[int(key[1])]]
+        i = self._index[int(key)]
+        return self._cooccurrences[i, i]
+
+def _num_terms(dictionary):
+    """Size of the id space of a dictionary
+
+    Args:
+        dictionary: gensim Dictionary or sptm.hashing.HashedDictionary
+
+    Returns:
+        Integer
+    """
+    return 1 + max(dictionary.keys()) if len(dictionary) else 0
+
+def _chunks(texts, size):
+    """Split texts in lists of at most size texts
+
+    Args:
+        texts: Iterable of lists of tokens
+        size: Number of texts per list
+
+    Yields:
+        Lists of lists of tokens
+    """
+    texts = iter(texts)
+    while True:
+        chunk = [list(t) for t in islice(texts, size)]
+        if not chunk:
+            return
+        yield chunk
+
+def _init_cache(dictionary):
+    """Initializer of the cache processes
+
+    Args:
+        dictionary: gensim Dictionary or sptm.hashing.HashedDictionary
+    """
+    global _DICTIONARY
+    _DICTIONARY = dictionary
+
+def _slide_chunk(job):
+    """Slide windows over a chunk of texts
+
+    Args:
+        job: Tuple of list of lists of tokens and window size
+
+    Returns:
+        Tuple of (windows, presence) as (indptr, indices) arrays and the
+        number of windows of every text
+    """
+    texts, window_size = job
+    if hasattr(_DICTIONARY, 'restricted_hash'):
+        lookup = _DICTIONARY.restricted_hash
+    else:
+        token2id = _DICTIONARY.token2id
+        lookup = lambda t: token2id.get(t, -1)
+
+    windows = ([0], [])
+    presence = ([0], [])
+    counts = np.zeros(len(texts), dtype=np.int64)
+    for n, text in enumerate(texts):
+        ids = np.array([lookup(t) for t in text], dtype=np.int64)
+        known = np.unique(ids[ids >= 0])
+        presence[1].append(known)
+        presence[0].append(presence[0][-1] + len(known))
+        if len(ids) <= window_size:
+            counts[n] = 1
+            windows[1].append(known)
+            windows[0].append(windows[0][-1] + len(known))
+            continue
+        counts[n] = len(ids) - window_size + 1
+        # Slide like gensim does: the token leaving the window is dropped
+        # even if it occurs again further in the window
+        current = set(ids[:window_size][ids[:window_size] >= 0].tolist())
+        for start in range(counts[n]):
+            if start:
+                current.discard(ids[start - 1])
+                if ids[start + window_size - 1] >= 0:
+                    current.add(ids[start + window_size - 1])
+            part = np.array(sorted(current), dtype=np.int64)
+            windows[1].append(part)
+            windows[0].append(windows[0][-1] + len(part))
+    return _pack(windows), _pack(presence), counts
+
+def _pack(rows):
+    """Turn row pointers and lists of column arrays into numpy arrays
+
+    Args:
+        rows: Tuple of list of row pointers and list of column arrays
+
+    Returns:
+        Tuple of numpy indptr and indices arrays
+    """
+    indptr, indices = rows
+    return np.asarray(indptr, dtype=np.int64), \
+        np.concatenate(indices + [np.zeros(0, dtype=np.int64)])
+
+def _stack(parts, num_terms):
+    """Stack (indptr, indices) chunks in a binary CSC matrix
+
+    Args:
+        parts: List of (indptr, indices) tuples
+        num_terms: Number of columns
+
+    Returns:
+        scipy CSC matrix
+    """
+    indptr = [np.zeros(1, dtype=np.int64)]
+    offset = 0
+    for ptr, idx in parts:
+        indptr.append(ptr[1:] + offset)
+        offset += len(idx)
+    indices = np.concatenate([idx for ptr, idx in parts] + \
+                                                [np.zeros(0, dtype=np.int64)])
+    indptr = np.concatenate(indptr)
+    return sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), \
+            indices, indptr), shape=(len(indptr) - 1, num_terms)).tocsc()
@@ -6,11 +6,17 @@
 
 #######################################
 
+import os
 import csv
-import ast
 import operator
+import multiprocessing
 import numpy as np
 
+from itertools import islice
+
+from sptm.tokenstore import TokenStore
+from sptm.doctopics import load_doctopics, iter_doctopics
+
 __author__ = "Rochan Avlur Venkat"
 __credits__ = ["Anupam Mediratta"]
 __license__ = "MIT"
@@ -20,6 +26,10 @@ __email__ = "rochan170543@mechyd.ac.in"
 
 #######################################
 
+# Topic probabilities and data index shared with the construction processes
+_DOC_MATRIX = None
+_INDEX = None
+
 class ConditionalMatrix:
     """Compute the conditional matrix of topics
 
@@ -29,10 +39,15 @@ class ConditionalMatrix:
 
     Attributes:
         doc_matrix: Output from training the LDA model provided by Mallet.
-            Contains the topic probabilities of each sentence.
-        data_index: list containing the data index number for each sentence.
-        num_sent: Number of sentences
-        num_topics: Number of topics
+            numpy array of the topic probabilities of each sentence, None
+            when streamed.
+        data_index: list containing the data index number for each sentence,
+            None when streamed.
+        doctopics_path: Location of the document topic file
+        tokens_path: Location of the token file
+        stream: Read the files in chunks in construct_matrix()
+        num_sent: Number of sentences, None until constructed when streamed
+        num_topics: Number of topics, None until constructed when streamed
         topic_freq: Sum of the weights for a topic over the whole dataset
         freq_matrix: Matrix of floats (conditional probabilities)
         labels: List of strings, labels for each topic, has to be manually
@@ -41,7 +56,8 @@ class ConditionalMatrix:
         sorted: freq_matrix with labels and sorted in decending order
     """
 
-    def __init__(self, doctopics_path, tokens_path):
+    def __init__(self, doctopics_path, tokens_path, stream=False, \
+                                                            num_topics=None):
         """Inits ConditionalMatrix with path to document topic file and tokens
         file
 
@@ -49,88 +65,182 @@ class ConditionalMatrix:
         versus another. Open the document topic file, Get the data
         number for every sentence used
 
+        The document topic file is read by sptm.doctopics.load_doctopics(),
+        in Mallet's dense or sparse format, and cached next to it as .npy.
+        With stream, neither file is read whole: construct_matrix() reads
+        them side by side in chunks, so the memory needed does not grow with
+        the dataset.
+
         Args:
-            doctopics_path: Location of the document topic file
-            tokens_path: Path to token file
+            doctopics_path: Location of the document topic file, of its .npy
+                copy or of a sptm.bundle.ModelBundle directory
+            tokens_path: Path to token file or sptm.tokenstore.TokenStore
+                directory
+            stream: Read the files in chunks when constructing the matrix
+            num_topics: Number of topics, a sparse file being widened to
+                it. Found from the file if not given, from its first chunk
+                when streamed, which may miss some topics of a sparse file
         Raises:
             IOError: File not found
             Exception: Error while reading a row (Mostly due to empty row)
         """
-        self.doc_matrix = []
+        self.doctopics_path = doctopics_path
+        self.tokens_path = tokens_path
+        self.stream = stream
+        if stream:
+            self.doc_matrix = None
+            self.data_index = None
+            self.num_sent = None
+            self.num_topics = num_topics
+            if not os.path.exists(doctopics_path):
+                raise IOError('File not found')
+            if not TokenStore.is_store(tokens_path) and \
+                                            not os.path.isfile(tokens_path):
+                raise IOError('Error reading doctopic file')
+            return
+
         try:
-            with open(doctopics_path, 'r') as F:
-                reader = csv.reader(F, delimiter='\t')
-                for row in reader:
-                    # Delete the first two columns in the file
-                    self.doc_matrix.append(row[2:])
+            self.doc_matrix = load_doctopics(doctopics_path, num_topics, \
+                                                            np.float64)
         except IOError:
             raise IOError('File not found')
         except Exception:
             raise Exception('Error reading doctopic file')
 
-        self.data_index = []
-        try:
-            with open(tokens_path, 'rU') as F:
-                reader = csv.reader((line.replace('\0', '') for line in F), \
-                                                                delimiter=',')
-                for row in reader:
-                    try:
-                        if len(row) > 0:
-                            self.data_index.append(int(row[0]))
-                    except Exception:
-                        raise Exception('Some error while reading the row')
-        except IOError:
-             raise IOError('Error reading doctopic file')
-        self.num_sent = len(self.doc_matrix)
-        self.num_topics = len(self.doc_matrix[0])
+        if TokenStore.is_store(tokens_path):
+            self.data_index = TokenStore.load(tokens_path).data_index.tolist()
+        else:
+            self.data_index = list(_read_index(tokens_path))
+        self.num_sent, self.num_topics = self.doc_matrix.shape
 
-    def construct_matrix(self):
+    def construct_matrix(self, chunksize=100000, processes=1):
         """Compute the conditional probabilities
 
         Construct a simple frequency matrix of each topic (current sentence)
         vs topic (next sentence), Identify the topics with high probabilities
         for each sentence
 
+        Pairs of consecutive sentences of the same review are found from
+        data_index at once, and the sentences are processed in blocks of
+        about <chunksize>, each block adding A.T @ B to the frequency
+        matrix, A and B being the topic probabilities of the first and
+        second sentence of its pairs. Blocks end where a review ends, so no
+        pair is split between two blocks. As before, topic_freq[x] is
+        num_topics times the sum of the probabilities of topic x over the
+        first sentences of the pairs, and the conditional probabilities are
+        scaled by 65.
+
+        With processes, the blocks are shared out among a pool of
+        processes, which read the memory-mapped .npy copy of the document
+        topic file (or inherit the matrix). Their partial sums are added up
+        in block order, as done serially, so the result is the same.
+
+        When streamed, chunks of chunksize sentences are read from both
+        files in turn, and the last sentence of a chunk is carried over to
+        the next one so its pair with the first sentence of the next chunk
+        is not lost.
+
+        Args:
+            chunksize: Number of sentences processed (or read) at once
+            processes: Number of processes, None for the number of CPUs
+
         Raises:
-            Exception: Sentence Missing, you can ignore this message
+            Exception: Sentence Missing, you can ignore this message / Cannot
+                stream with processes
         """
+        processes = processes or multiprocessing.cpu_count()
+        if self.stream:
+            if processes > 1:
+                raise Exception('Streamed matrix is constructed by one ' \
+                                                                'process')
+            freq, weight, num_sent = self._stream(chunksize)
+        else:
+            num_sent = min(self.num_sent, len(self.data_index))
+            index = np.asarray(self.data_index[:num_sent])
+
+            # Partial sums of the blocks, added up in order
+            freq = np.zeros((self.num_topics, self.num_topics), dtype=float)
+            weight = np.zeros(self.num_topics, dtype=float)
+            bounds = _blocks(index, chunksize)
+            jobs = list(zip(bounds[:-1], bounds[1:]))
+            if processes > 1 and len(jobs) > 1:
+                # Workers map the .npy file again instead of getting a copy
+                shared = getattr(self.doc_matrix, 'filename', None) or \
+                                                            self.doc_matrix
+                pool = multiprocessing.Pool(min(processes, len(jobs)), \
+                                            _init_matrix, (shared, index))
+                try:
+                    parts = pool.map(_matrix_job, jobs, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                parts = (_pairs(self.doc_matrix, index, lo, hi) for lo, hi \
+                                                                    in jobs)
+            for part_freq, part_weight in parts:
+                freq += part_freq
+                weight += part_weight
 
+        self.freq_matrix = freq
         # Create a dictionary of all the topic frequencies
-        self.topic_freq = dict()
-        for i in range(0, self.num_topics):
-            self.topic_freq[i] = 0
-
-        # Construct an empty matrix
-        self.freq_matrix = np.zeros((self.num_topics, self.num_topics), \
-                                                                dtype=float)
-
-        # Iterate over all the (sentences - 1)
-        for i in range(self.num_sent - 1):
-
-            try:
-                if self.data_index[i] == self.data_index[i + 1]:
-                    topic_dict = [dict(), dict()]
-                    for j in range(0, self.num_topics):
-                        topic_dict[0][j] = \
-                                    ast.literal_eval(self.doc_matrix[i][j])
-                        topic_dict[1][j] = \
-                                ast.literal_eval(self.doc_matrix[i + 1][j])
-
-                    for x in range(self.num_topics):
-                        for y in range(self.num_topics):
-                            self.freq_matrix[x][y] += \
-                                float(topic_dict[1][y])*float(topic_dict[0][x])
-                            self.topic_freq[x] += float(topic_dict[0][x])
-            except Exception:
-                raise Exception('Sentence Missing, can ignore this message')
+        self.topic_freq = dict((i, float(self.num_topics * weight[i])) \
+                                            for i in range(self.num_topics))
+        if num_sent < self.num_sent and self.num_sent > 1:
+            raise Exception('Sentence Missing, can ignore this message')
 
         # Conditional probability
-        for i in range(self.num_topics):
-            for j in range(self.num_topics):
-                if float(self.topic_freq[i]) != 0:
-                    self.freq_matrix[i][j] = \
-                                            (float(self.freq_matrix[i][j]) / \
-                                            float(self.topic_freq[i])) * 65
+        totals = self.num_topics * weight
+        rows = totals != 0
+        self.freq_matrix[rows] = self.freq_matrix[rows] / \
+                                                totals[rows][:, None] * 65
+
+    def _stream(self, chunksize):
+        """Transition counts of the files read in chunks
+
+        Args:
+            chunksize: Number of sentences read at once
+
+        Returns:
+            Tuple of the frequency matrix, the sum of the topic probabilities
+            of the first sentences of the pairs and the number of sentences
+            with a data index number
+
+        Raises:
+            IOError: File not found
+            Exception: Error reading doctopic file
+        """
+        freq = weight = None
+        indices = _IndexReader(self.tokens_path)
+        carried = None
+        self.num_sent = 0
+        num_sent = 0
+        for chunk in iter_doctopics(self.doctopics_path, self.num_topics, \
+                                                    np.float64, chunksize):
+            if freq is None:
+                self.num_topics = chunk.shape[1]
+                freq = np.zeros((self.num_topics, self.num_topics))
+                weight = np.zeros(self.num_topics)
+            self.num_sent += len(chunk)
+            if num_sent < self.num_sent - len(chunk):
+                # Sentences missing, the rest is only counted
+                continue
+            index = indices.take(len(chunk))
+            chunk = chunk[:len(index)]
+            num_sent += len(index)
+            if not len(index):
+                continue
+            if carried is not None:
+                chunk = np.concatenate((carried[0][None], chunk))
+                index = np.concatenate(([carried[1]], index))
+            part_freq, part_weight = _pairs(chunk, index, 0, len(index))
+            freq += part_freq
+            weight += part_weight
+            carried = (chunk[-1].copy(), index[-1])
+        if freq is None:
+            self.num_topics = self.num_topics or 0
+            freq = np.zeros((self.num_topics, self.num_topics))
+            weight = np.zeros(self.num_topics)
+        return freq, weight, num_sent
 
     def sort_and_label(self, labels_path):
         """Sort and label each value in the matrix
@@ -187,3 +297,144 @@ class ConditionalMatrix:
                     writer.writerow(r)
         except IOError:
             raise IOError('Path does not exist')
+
+class _IndexReader:
+    """Data index numbers of a token file, read a few at a time
+
+    Attributes:
+        data_index: Memory-mapped data index of a sptm.tokenstore.TokenStore,
+            None for a token file
+        position: Number of data index numbers read
+    """
+
+    def __init__(self, tokens_path):
+        """Inits _IndexReader
+
+        Args:
+            tokens_path: Path to token file or sptm.tokenstore.TokenStore
+                directory
+        """
+        self.position = 0
+        if TokenStore.is_store(tokens_path):
+            self.data_index = TokenStore.load(tokens_path).data_index
+            self._rows = None
+        else:
+            self.data_index = None
+            self._rows = _read_index(tokens_path)
+
+    def take(self, n):
+        """Read the next data index numbers
+
+        Args:
+            n: Number of data index numbers
+
+        Returns:
+            numpy int64 array of up to n data index numbers
+        """
+        if self.data_index is not None:
+            index = np.asarray(self.data_index[self.position:\
+                                        self.position + n], dtype=np.int64)
+        else:
+            index = np.fromiter(islice(self._rows, n), dtype=np.int64)
+        self.position += len(index)
+        return index
+
+def _read_index(tokens_path):
+    """Data index number of every row of a token file
+
+    Args:
+        tokens_path: Path to token file
+
+    Yields:
+        Data index number of a row
+
+    Raises:
+        IOError: File not found
+        Exception: Error while reading a row (Mostly due to empty row)
+    """
+    try:
+        with open(tokens_path, 'r') as F:
+            reader = csv.reader((line.replace('\0', '') \
+                                    for line in F), delimiter=',')
+            for row in reader:
+                if len(row) > 0:
+                    try:
+                        number = int(row[0])
+                    except Exception:
+                        raise Exception('Some error while reading the row')
+                    yield number
+    except IOError:
+        raise IOError('Error reading doctopic file')
+
+def _init_matrix(doc_matrix, index):
+    """Initializer of the construction processes
+
+    Args:
+        doc_matrix: Topic probabilities of each sentence, or location of
+            their .npy file
+        index: Data index number of each sentence
+    """
+    global _DOC_MATRIX, _INDEX
+    if isinstance(doc_matrix, str):
+        doc_matrix = np.load(doc_matrix, mmap_mode='r')
+    _DOC_MATRIX = doc_matrix
+    _INDEX = index
+
+def _matrix_job(job):
+    """Transition counts of a block in a construction process
+
+    Args:
+        job: Tuple of the first sentence of the block and the sentence after
+            its last one
+
+    Returns:
+        Partial sums of the block, as returned by _pairs()
+    """
+    lo, hi = job
+    return _pairs(_DOC_MATRIX, _INDEX, lo, hi)
+
+def _blocks(index, size):
+    """Split sentences in blocks of about size sentences, ending where a
+    review ends
+
+    Args:
+        index: numpy array, data index number of each sentence
+        size: Number of sentences of a block
+
+    Returns:
+        List of block bounds, from 0 to the number of sentences
+    """
+    num_sent = len(index)
+    starts = np.flatnonzero(index[1:] != index[:-1]) + 1
+    bounds = [0]
+    for target in range(size, num_sent, size):
+        if target <= bounds[-1]:
+            continue
+        # First review starting at or after the target
+        k = np.searchsorted(starts, target)
+        if k == len(starts):
+            break
+        bounds.append(int(starts[k]))
+    if num_sent:
+        bounds.append(num_sent)
+    return bounds
+
+def _pairs(doc_matrix, index, lo, hi):
+    """Transition counts of the consecutive sentences of the same review
+    within a block
+
+    Args:
+        doc_matrix: Topic probabilities of each sentence
+        index: Data index number of each sentence
+        lo: First sentence of the block
+        hi: Sentence after the last one of the block
+
+    Returns:
+        Tuple of the sum of the outer products of the topic probabilities of
+        the pairs (first x second sentence) and the sum of the topic
+        probabilities of their first sentences
+    """
+    first = np.flatnonzero(index[lo:hi - 1] == index[lo + 1:hi]) + lo
+    current = np.asarray(doc_matrix[first], dtype=float)
+    following = np.asarray(doc_matrix[first + 1], dtype=float)
+    return current.T @ following, current.sum(axis=0)
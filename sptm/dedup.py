@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Collapse duplicate sentences before training
+"""
+
+#######################################
+
+import zlib
+import logging
+
+import numpy as np
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime used by the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+# Largest value of a permuted token hash
+_MAX_HASH = (1 << 32) - 1
+
+class Deduplicator:
+    """Collapse repeated tokenized sentences and count their copies
+
+    Sentences with exactly the same tokens are collapsed through a hash
+    table. Optionally, sentences whose token sets are near duplicates
+    (estimated Jaccard similarity of at least <threshold>) are collapsed
+    too, using MinHash signatures and banded locality sensitive hashing.
+    The first sentence of every group is kept as its representative.
+
+    Train sptm.Model on the representatives as they are, and
+    sptm.ModelVanilla on the representatives with fit(weights=weights),
+    which multiplies their term frequencies. expand() maps the results
+    back to every sentence.
+
+    Attributes:
+        near: Whether near duplicates are collapsed
+        threshold: Minimum estimated Jaccard similarity of near duplicates
+        num_perm: Number of MinHash permutations
+        bands: Number of LSH bands, must divide num_perm
+        tokens: Representative rows, data index number followed by tokens
+        weights: numpy array, number of rows collapsed into each
+            representative
+        mapping: numpy array, position in tokens of the representative of
+            every input row
+    """
+
+    def __init__(self, near=False, threshold=0.8, num_perm=64, bands=16, \
+                                                                    seed=1):
+        """Inits Deduplicator
+
+        Args:
+            near: Also collapse near duplicates
+            threshold: Minimum estimated Jaccard similarity of near
+                duplicates
+            num_perm: Number of MinHash permutations
+            bands: Number of LSH bands, must divide num_perm
+            seed: Seed of the MinHash permutations
+
+        Raises:
+            Exception: bands does not divide num_perm
+        """
+        if num_perm % bands != 0:
+            raise Exception('bands must divide num_perm')
+        self.near = near
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        state = np.random.RandomState(seed)
+        self._a = state.randint(1, _PRIME, num_perm, dtype=np.uint64)
+        self._b = state.randint(0, _PRIME, num_perm, dtype=np.uint64)
+
+    def fit(self, tokens):
+        """Collapse the duplicates of a list of token rows
+
+        Args:
+            tokens: List of lists of data index number followed by tokens,
+                like Corpus.tokens
+
+        Returns:
+            self
+        """
+        # Exact duplicates
+        seen = dict()
+        self.mapping = np.empty(len(tokens), dtype=np.int64)
+        self.tokens = []
+        for i, row in enumerate(tokens):
+            key = tuple(row[1:])
+            if key not in seen:
+                seen[key] = len(self.tokens)
+                self.tokens.append(row)
+            self.mapping[i] = seen[key]
+        exact = len(self.tokens)
+
+        if self.near and len(self.tokens) > 1:
+            group = self._near_groups([row[1:] for row in self.tokens])
+            # Renumber the surviving representatives
+            keep = np.flatnonzero(group == np.arange(len(group)))
+            position = np.empty(len(group), dtype=np.int64)
+            position[keep] = np.arange(len(keep))
+            self.mapping = position[group[self.mapping]]
+            self.tokens = [self.tokens[i] for i in keep]
+
+        self.weights = np.bincount(self.mapping, minlength=len(self.tokens))
+        logger.info('collapsed %d sentences into %d (%d exact duplicates, ' \
+            '%d near duplicates)', len(tokens), len(self.tokens), \
+                        len(tokens) - exact, exact - len(self.tokens))
+        return self
+
+    def signatures(self, texts):
+        """MinHash signatures of the token sets of texts
+
+        Args:
+            texts: List of lists of tokens
+
+        Returns:
+            numpy uint64 array of shape (len(texts), num_perm)
+        """
+        sig = np.full((len(texts), self.num_perm), _MAX_HASH + 1, \
+                                                            dtype=np.uint64)
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            h = np.array([zlib.crc32(t.encode('utf8')) for t in set(text)], \
+                                                    dtype=np.uint64)[:, None]
+            # a * h wraps around 2 ** 64, so the permutations are not
+            # monotonous in h, as with datasketch's MinHash
+            sig[i] = (((h * self._a + self._b) % _PRIME) & \
+                                            np.uint64(_MAX_HASH)).min(axis=0)
+        return sig
+
+    def _near_groups(self, texts):
+        """Group near duplicate texts
+
+        Args:
+            texts: List of lists of tokens
+
+        Returns:
+            numpy array, position of the first text of the group of every
+            text
+        """
+        sig = self.signatures(texts)
+        rows = self.num_perm // self.bands
+        parent = np.arange(len(texts))
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        for band in range(self.bands):
+            buckets = dict()
+            part = np.ascontiguousarray(sig[:, band * rows:(band + 1) * rows])
+            for i in range(len(texts)):
+                buckets.setdefault(part[i].tobytes(), []).append(i)
+            for members in buckets.values():
+                first = members[0]
+                for other in members[1:]:
+                    a, b = find(first), find(other)
+                    if a == b:
+                        continue
+                    # Check the candidate pair on the whole signature
+                    if np.mean(sig[first] == sig[other]) >= self.threshold:
+                        parent[max(a, b)] = min(a, b)
+
+        return np.array([find(i) for i in range(len(texts))])
+
+    def expand(self, values):
+        """Map values computed for the representatives back to every input
+        row, e.g. the document topic matrix of a model trained on
+        Deduplicator.tokens
+
+        Args:
+            values: Sequence with one entry per representative
+
+        Returns:
+            numpy array with one entry per input row
+        """
+        return np.asarray(values)[self.mapping]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Local distributed LDA training over corpus shards
+"""
+
+#######################################
+
+import logging
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from gensim.models.ldamodel import LdaState
+from gensim.models.callbacks import Callback
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+class LdaCluster:
+    """Worker processes holding shards of a corpus, training a gensim LDA
+    model in batch mode without Pyro
+
+    Every pass, the workers run the E-step on their shard with the current
+    topics and send back their sufficient statistics, which are summed and
+    blended into the model by its own M-step (gensim's LdaModel.do_mstep()).
+    This is what LdaModel.update() does with update_every=0, the E-step
+    being split between the workers.
+
+    Workers are processes started on this machine and/or servers started
+    on other machines with sptm.distributed.serve(), reached through
+    multiprocessing connections. Models and corpus chunks travel pickled,
+    and unpickling runs code, so servers must only listen on localhost or
+    a private interface and always share an authkey with the clusters:
+
+        python -c "import sptm.distributed as d; \\
+                            d.serve(('10.0.0.2', 6000), b'secret')"
+
+    Attributes:
+        connections: Connections to every worker
+        processes: Local worker processes
+        num_docs: Number of documents held by the workers
+    """
+
+    def __init__(self, workers=None, hosts=(), authkey=None):
+        """Inits LdaCluster, starting the local workers and connecting to
+        the remote ones
+
+        Args:
+            workers: Number of local worker processes, defaults to the number
+                of CPUs
+            hosts: List of (host, port) of servers started with serve()
+            authkey: Bytes shared with the servers, required if there are
+                hosts
+
+        Raises:
+            IOError: Server could not be reached
+            Exception: No workers / hosts without an authkey
+        """
+        if hosts and not authkey:
+            raise Exception('Remote LDA workers need an authkey')
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.connections = []
+        self.processes = []
+        self.num_docs = 0
+
+        for _ in range(workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_serve, args=(child,))
+            process.daemon = True
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        for address in hosts:
+            try:
+                self.connections.append(Client(tuple(address), \
+                                                            authkey=authkey))
+            except (IOError, OSError):
+                self.close()
+                raise IOError('Could not reach LDA worker %s:%s' % \
+                                                            tuple(address))
+        if not self.connections:
+            raise Exception('LdaCluster needs at least one worker')
+        logger.info('LDA cluster of %d local and %d remote workers', \
+                                                workers, len(hosts))
+
+    def scatter(self, corpus, chunksize=2000):
+        """Share a corpus between the workers, replacing their previous
+        shards
+
+        Chunks of documents are dealt to the workers in turn, so the corpus
+        is read once and never held whole in this process.
+
+        Args:
+            corpus: Term Document frequency
+            chunksize: Number of documents sent at a time
+
+        Returns:
+            Number of documents
+        """
+        for conn in self.connections:
+            conn.send(('reset',))
+        self.num_docs = 0
+        chunk = []
+        turn = 0
+        for doc in corpus:
+            chunk.append(doc)
+            if len(chunk) == chunksize:
+                self.connections[turn].send(('docs', chunk))
+                turn = (turn + 1) % len(self.connections)
+                self.num_docs += len(chunk)
+                chunk = []
+        if chunk:
+            self.connections[turn].send(('docs', chunk))
+            self.num_docs += len(chunk)
+        return self.num_docs
+
+    def estep(self, lda):
+        """Run the E-step of every worker on its shard
+
+        Args:
+            lda: gensim LdaModel holding the current topics
+
+        Returns:
+            gensim LdaState with the summed sufficient statistics
+
+        Raises:
+            Exception: A worker failed
+        """
+        for conn in self.connections:
+            conn.send(('estep', lda.alpha, lda.expElogbeta))
+        other = LdaState(lda.eta, lda.state.sstats.shape, lda.dtype)
+        for conn in self.connections:
+            reply = conn.recv()
+            if reply[0] == 'error':
+                raise Exception('LDA worker failed: %s' % reply[1])
+            other.sstats += reply[1]
+            other.numdocs += reply[2]
+        return other
+
+    def train(self, lda, passes=1, callbacks=None):
+        """Train a model on the scattered corpus in batch mode
+
+        Args:
+            lda: gensim LdaModel built without a corpus, its parameters
+                (alpha, eta, iterations, gamma_threshold, chunksize, decay,
+                offset) are used for the training. Priors learnt from the
+                corpus (alpha or eta 'auto') are not supported
+            passes: Number of passes through the corpus
+            callbacks: List of gensim Metric objects computed after every
+                pass, as LdaModel's callbacks are
+
+        Returns:
+            lda, trained
+
+        Raises:
+            Exception: Nothing scattered / a worker failed / alpha or eta
+                'auto'
+        """
+        if lda.optimize_alpha or lda.optimize_eta:
+            raise Exception('LdaCluster supports neither alpha=auto nor ' \
+                                                                'eta=auto')
+        if not self.num_docs:
+            raise Exception('scatter a corpus before training')
+        for conn in self.connections:
+            conn.send(('model', lda))
+        lda.state.numdocs += self.num_docs
+        chunksize = min(self.num_docs, lda.chunksize)
+        if callbacks:
+            callback = Callback(callbacks)
+            callback.set_model(lda)
+
+        for pass_ in range(passes):
+            other = self.estep(lda)
+            logger.info('PROGRESS: pass %d, reduced the statistics of %d ' \
+                            'documents from %d workers', pass_, \
+                                    other.numdocs, len(self.connections))
+            rho = pow(lda.offset + pass_ + (lda.num_updates / \
+                                    float(chunksize)), -lda.decay)
+            lda.do_mstep(rho, other, pass_ > 0)
+            if callbacks:
+                callback.on_epoch_end(pass_)
+        return lda
+
+    def close(self):
+        """Stop the local workers and disconnect from the remote ones
+        """
+        for conn in self.connections:
+            try:
+                conn.send(('stop',))
+                conn.close()
+            except (IOError, OSError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+def serve(address, authkey):
+    """Serve as an LdaCluster worker on another machine, one cluster after
+    the other, until interrupted
+
+    Messages are pickled, only listen on localhost or a private interface.
+
+    Args:
+        address: (host, port) to listen on
+        authkey: Bytes shared with the clusters
+
+    Raises:
+        Exception: No authkey
+    """
+    if not authkey:
+        raise Exception('An LDA worker needs an authkey')
+    listener = Listener(tuple(address), authkey=authkey)
+    logger.info('LDA worker listening on %s:%s', *tuple(address))
+    try:
+        while True:
+            conn = listener.accept()
+            logger.info('LDA worker serving %s', listener.last_accepted)
+            _serve(conn)
+    finally:
+        listener.close()
+
+def _serve(conn):
+    """Answer the messages of an LdaCluster until told to stop
+
+    Args:
+        conn: multiprocessing connection to the LdaCluster
+    """
+    shard = []
+    lda = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        command = message[0]
+        if command == 'stop':
+            conn.close()
+            return
+        elif command == 'reset':
+            shard = []
+        elif command == 'docs':
+            shard.extend(message[1])
+        elif command == 'model':
+            lda = message[1]
+        elif command == 'estep':
+            try:
+                lda.alpha, lda.expElogbeta = message[1], message[2]
+                sstats = np.zeros_like(lda.expElogbeta)
+                for i in range(0, len(shard), lda.chunksize):
+                    gamma, part = lda.inference(shard[i:i + lda.chunksize], \
+                                                        collect_sstats=True)
+                    sstats += part
+                conn.send(('sstats', sstats, len(shard)))
+            except Exception as e:
+                conn.send(('error', repr(e)))
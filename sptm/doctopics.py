@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Fast loading of Mallet document topic files
+"""
+
+#######################################
+
+import os
+import logging
+import tempfile
+
+from itertools import islice
+
+import numpy as np
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+def load_doctopics(path, num_topics=None, dtype=np.float32, cache=True, \
+                                        mmap=True, chunk_bytes=1 << 24):
+    """Read a document topic file into a matrix of documents x topics
+
+    Reads the files written by Mallet's --output-doc-topics (and by
+    Model.save(), Model.update() and ModelVanilla.update()), in either
+    format, with or without the '#doc name topic proportion' header line:
+
+        dense: doc name proportion_0 proportion_1 ...
+        sparse: doc name topic proportion topic proportion ... (Mallet up to
+            2.0.7), topics left out having a proportion of 0
+
+    The file is parsed in chunks of lines by numpy, not cell by cell. With
+    cache, the matrix is also saved next to the file and later calls open
+    that copy, memory-mapped, as long as it is newer than the file and of
+    the width asked for. The copy is <path>.<dtype>.npy when the width is
+    found from the file and <path>.<num_topics>.<dtype>.npy when it is
+    given, so a sparse file read with and without num_topics keeps one
+    copy of each width. A .npy file, or a sptm.bundle.ModelBundle
+    directory, is opened directly.
+
+    Args:
+        path: Location of the document topic file
+        num_topics: Number of topics, found from the file if not given
+        dtype: numpy dtype of the matrix
+        cache: Read and write the .npy copy of the file
+        mmap: Memory-map the .npy copy instead of reading it
+        chunk_bytes: Size of the chunks the file is parsed in
+
+    Returns:
+        numpy array of shape (num_docs, num_topics)
+
+    Raises:
+        IOError: File not found
+        Exception: Not a document topic file, sparse file of more than
+            num_topics topics
+    """
+    mode = 'r' if mmap else None
+    dtype = np.dtype(dtype)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'doc_topic.npy')
+    if path.endswith('.npy'):
+        try:
+            return np.load(path, mmap_mode=mode)
+        except (IOError, OSError, ValueError):
+            raise IOError('File not found')
+
+    try:
+        copy = _fresh_cache(path, num_topics, dtype) if cache else None
+        if copy is not None:
+            return np.load(copy, mmap_mode=mode)
+        matrix = _parse(path, num_topics, dtype, chunk_bytes)
+    except (IOError, OSError):
+        raise IOError('File not found')
+
+    if cache:
+        copy = _cache_path(path, dtype, num_topics)
+        temp = None
+        try:
+            # Own temporary name, as other processes may cache the same file
+            handle, temp = tempfile.mkstemp(suffix='.npy', \
+                                    dir=os.path.dirname(copy) or os.curdir)
+            with os.fdopen(handle, 'wb') as F:
+                np.save(F, matrix)
+            os.replace(temp, copy)
+            if mmap:
+                matrix = np.load(copy, mmap_mode=mode)
+        except (IOError, OSError):
+            logger.warning('could not write the doctopics cache %s', copy)
+            if temp is not None and os.path.exists(temp):
+                os.remove(temp)
+    return matrix
+
+def iter_doctopics(path, num_topics=None, dtype=np.float32, \
+                                                        chunksize=100000):
+    """Read a document topic file in chunks of documents
+
+    Reads the same files as load_doctopics(), without ever holding more
+    than a chunk: a .npy file, its fresh .npy copy or a
+    sptm.bundle.ModelBundle directory is memory-mapped and sliced, other
+    files are parsed chunksize lines at a time. A sparse file is widened to
+    num_topics topics, or to the topics of its first chunk if not given.
+
+    Args:
+        path: Location of the document topic file
+        num_topics: Number of topics, found from the file if not given
+        dtype: numpy dtype of the chunks
+        chunksize: Number of documents of a chunk
+
+    Yields:
+        numpy arrays of shape (up to chunksize, num_topics)
+
+    Raises:
+        IOError: File not found
+        Exception: Not a document topic file, sparse file of more than
+            num_topics topics
+    """
+    dtype = np.dtype(dtype)
+    if os.path.isdir(path):
+        path = os.path.join(path, 'doc_topic.npy')
+    try:
+        if not path.endswith('.npy'):
+            path = _fresh_cache(path, num_topics, dtype) or path
+        if path.endswith('.npy'):
+            matrix = np.load(path, mmap_mode='r')
+        else:
+            F = open(path, 'rb')
+    except (IOError, OSError, ValueError):
+        raise IOError('File not found')
+
+    if path.endswith('.npy'):
+        for start in range(0, len(matrix), chunksize):
+            yield np.asarray(matrix[start:start + chunksize], dtype=dtype)
+        return
+
+    sparse = None
+    with F:
+        while True:
+            lines = list(islice(F, chunksize))
+            if not lines:
+                break
+            rows = _columns(lines)
+            if not rows:
+                continue
+            if sparse is None:
+                sparse = _is_sparse(rows)
+                if num_topics is None and not sparse:
+                    num_topics = len(rows[0].split())
+            if not sparse:
+                yield _dense_rows(rows, num_topics, dtype)
+                continue
+            counts, ids, values = _sparse_rows(rows)
+            if num_topics is None:
+                num_topics = 1 + int(ids.max()) if len(ids) else 0
+            elif len(ids) and ids.max() >= num_topics:
+                raise Exception('Sparse doctopics file of more than %d ' \
+                                        'topics, give num_topics' % num_topics)
+            chunk = np.zeros((len(counts), num_topics), dtype=dtype)
+            chunk[np.repeat(np.arange(len(counts)), counts), ids] = values
+            yield chunk
+
+def _cache_path(path, dtype, num_topics=None):
+    """Location of the .npy copy of a document topic file
+
+    Args:
+        path: Location of the document topic file
+        dtype: numpy dtype of the copy
+        num_topics: Width the file was widened to, None for its own width
+
+    Returns:
+        Location of the copy
+    """
+    if num_topics is None:
+        return '%s.%s.npy' % (path, dtype.name)
+    return '%s.%d.%s.npy' % (path, num_topics, dtype.name)
+
+def _width(path):
+    """Number of columns of a .npy matrix, read from its header
+
+    Args:
+        path: Location of the .npy file
+
+    Returns:
+        Number of columns, None if not a readable matrix
+    """
+    try:
+        matrix = np.load(path, mmap_mode='r')
+    except (IOError, OSError, ValueError):
+        return None
+    return matrix.shape[1] if matrix.ndim == 2 else None
+
+def _fresh_cache(path, num_topics, dtype):
+    """Find a .npy copy of a document topic file newer than the file and of
+    the width asked for
+
+    Args:
+        path: Location of the document topic file
+        num_topics: Number of topics, None for the file's own width
+        dtype: numpy dtype of the copy
+
+    Returns:
+        Location of the copy, None if there is none
+    """
+    copies = [_cache_path(path, dtype)]
+    if num_topics is not None:
+        copies.append(_cache_path(path, dtype, num_topics))
+    for copy in copies:
+        if not os.path.isfile(copy) or \
+                    os.path.getmtime(copy) < os.path.getmtime(path):
+            continue
+        width = _width(copy)
+        if width is not None and num_topics in (None, width):
+            return copy
+    return None
+
+def _parse(path, num_topics, dtype, chunk_bytes):
+    """Parse a document topic file
+
+    Args:
+        path: Location of the file
+        num_topics: Number of topics, None to find it from the file
+        dtype: numpy dtype of the matrix
+        chunk_bytes: Size of the chunks the file is parsed in
+
+    Returns:
+        numpy array of shape (num_docs, num_topics)
+
+    Raises:
+        Exception: Not a document topic file, sparse file of more than
+            num_topics topics
+    """
+    parts = []
+    sparse = None
+    with open(path, 'rb') as F:
+        while True:
+            lines = F.readlines(chunk_bytes)
+            if not lines:
+                break
+            rows = _columns(lines)
+            if not rows:
+                continue
+            if sparse is None:
+                sparse = _is_sparse(rows)
+                if num_topics is None and not sparse:
+                    num_topics = len(rows[0].split())
+            if sparse:
+                parts.append(_sparse_rows(rows))
+            else:
+                parts.append(_dense_rows(rows, num_topics, dtype))
+
+    if sparse:
+        if num_topics is None:
+            num_topics = 1 + max([int(ids.max()) for n, ids, values in \
+                                            parts if len(ids)] or [-1])
+        elif any(len(ids) and ids.max() >= num_topics for n, ids, values \
+                                                                in parts):
+            raise Exception('Sparse doctopics file of more than %d ' \
+                                        'topics, give num_topics' % num_topics)
+        matrix = np.zeros((sum(len(n) for n, ids, values in parts), \
+                                                num_topics), dtype=dtype)
+        start = 0
+        for counts, ids, values in parts:
+            docs = np.repeat(np.arange(start, start + len(counts)), counts)
+            matrix[docs, ids] = values
+            start += len(counts)
+        return matrix
+    if not parts:
+        return np.zeros((0, num_topics or 0), dtype=dtype)
+    return np.concatenate(parts)
+
+def _columns(lines):
+    """Drop the doc and name columns of lines, and the header and blank
+    lines
+
+    Args:
+        lines: List of bytes, lines of the file
+
+    Returns:
+        List of bytes, proportions (or pairs) of every document
+    """
+    rows = []
+    for line in lines:
+        # Names may hold spaces, columns are tab separated then
+        fields = line.split(b'\t', 2) if b'\t' in line else \
+                                                        line.split(None, 2)
+        if len(fields) >= 2 and not line.startswith(b'#'):
+            rows.append(fields[2] if len(fields) == 3 else b'')
+    return rows
+
+def _is_sparse(rows):
+    """Check whether rows are in the sparse format, their first value being
+    a topic and not a proportion
+
+    Args:
+        rows: List of bytes, proportions (or pairs) of documents
+
+    Returns:
+        Boolean
+    """
+    first = b' '.join(rows).split(None, 1)
+    first = first[0] if first else b'0'
+    return not (b'.' in first or b'e' in first.lower())
+
+def _numbers(text):
+    """Parse whitespace separated numbers
+
+    Args:
+        text: Bytes
+
+    Returns:
+        numpy float64 array
+
+    Raises:
+        Exception: Not a number
+    """
+    try:
+        return np.array(text.split(), dtype=np.float64)
+    except ValueError:
+        raise Exception('Not a doctopics file, values are not numbers')
+
+def _dense_rows(rows, num_topics, dtype):
+    """Parse rows of proportions
+
+    Args:
+        rows: List of bytes, proportions of a document
+        num_topics: Number of topics
+        dtype: numpy dtype of the matrix
+
+    Returns:
+        numpy array of shape (len(rows), num_topics)
+
+    Raises:
+        Exception: Rows of another length
+    """
+    values = _numbers(b' '.join(rows))
+    if len(values) != len(rows) * num_topics:
+        raise Exception('Not a dense doctopics file of %d topics' % \
+                                                                    num_topics)
+    return values.reshape(len(rows), num_topics).astype(dtype)
+
+def _sparse_rows(rows):
+    """Parse rows of topic, proportion pairs
+
+    Args:
+        rows: List of bytes, pairs of a document
+
+    Returns:
+        Tuple of number of pairs per row, topics and proportions
+
+    Raises:
+        Exception: Odd number of values in a row
+    """
+    counts = np.array([len(r.split()) for r in rows], dtype=np.int64)
+    if (counts % 2).any():
+        raise Exception('Not a sparse doctopics file')
+    values = _numbers(b' '.join(rows))
+    if len(values) != counts.sum():
+        raise Exception('Not a sparse doctopics file')
+    return counts // 2, values[0::2].astype(np.int64), values[1::2]
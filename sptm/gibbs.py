@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Collapsed Gibbs sampling LDA in NumPy
+"""
+
+#######################################
+
+import time
+import logging
+import multiprocessing
+
+import numpy as np
+import gensim.utils as utils
+from scipy.special import gammaln
+
+from sptm.telemetry import perplexity
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+class GibbsLda(utils.SaveLoad):
+    """LDA trained by collapsed Gibbs sampling, without Mallet
+
+    Tokens are kept as flat int32 arrays of word ids, document numbers and
+    topics. Every iteration resamples the topic of all tokens in blocks:
+    a block holds the n-th token of many documents, so no two tokens of a
+    block share a document, and the topics of a whole block are drawn at
+    once from the vectorized conditionals
+
+        p(z = k) ~ (n_dk + alpha_k) * (n_wk + beta) / (n_k + V * beta)
+
+    the token's own assignment excluded. Within a block, word-topic counts
+    are those of the start of the block. With several workers, documents
+    are split between processes sampling against their own copy of the
+    word-topic counts, merged after every iteration (approximate
+    distributed LDA, Newman et al.). The counts are held in shared memory,
+    workers send back only the counts their sweep changed.
+
+    The interface follows gensim's LdaMallet wrapper, alpha being the sum
+    of the per topic priors as with Mallet.
+
+    Attributes:
+        num_topics: Number of topics
+        num_terms: Size of the vocabulary
+        id2word: Dictionary of the corpus
+        alpha: numpy array, prior of every topic
+        beta: Prior of the words
+        iterations: Number of iterations
+        workers: Number of processes sampling
+        topic_threshold: Smallest topic proportion written out
+        word_topics: numpy int32 array, number of tokens of every word
+            assigned to every topic (num_terms x num_topics)
+        doc_topic_counts: numpy array, number of tokens of every document
+            assigned to every topic (num_docs x num_topics)
+        words: numpy int32 array, word id of every token
+        lengths: numpy int64 array, number of tokens of every document
+        topics: numpy int32 array, topic of every token after training
+        tokens_per_sec: Sampling throughput of the training
+        telemetry: sptm.telemetry.Telemetry of the next training, dropped
+            after it
+    """
+
+    def __init__(self, corpus, num_topics=100, id2word=None, alpha=50, \
+                beta=0.01, iterations=1000, workers=1, random_seed=0, \
+                topic_threshold=0.0, block_size=16384, telemetry=None):
+        """Inits GibbsLda and trains it on corpus
+
+        Args:
+            corpus: Term Document frequency
+            num_topics: Number of topics
+            id2word: Dictionary of the corpus
+            alpha: Sum of the priors of the topics
+            beta: Prior of the words
+            iterations: Number of iterations
+            workers: Number of processes sampling
+            random_seed: Seed of the sampler
+            topic_threshold: Smallest topic proportion written out
+            block_size: Largest number of tokens sampled at once
+            telemetry: sptm.telemetry.Telemetry recording the log likelihood
+                every 10 iterations of the training
+
+        Raises:
+            Exception: Empty corpus
+        """
+        self.num_topics = num_topics
+        self.id2word = id2word
+        self.alpha = np.full(num_topics, float(alpha) / num_topics)
+        self.beta = beta
+        self.iterations = iterations
+        self.workers = max(1, workers)
+        self.random_seed = random_seed
+        self.topic_threshold = topic_threshold
+        self.block_size = block_size
+        self.telemetry = telemetry
+
+        words, lengths = _flatten(corpus)
+        if not len(words):
+            raise Exception('cannot train on an empty corpus')
+        if id2word is not None and len(id2word):
+            self.num_terms = 1 + max(id2word.keys())
+        else:
+            self.num_terms = int(words.max()) + 1
+        self.train(words, lengths)
+
+    def train(self, words, lengths, topics=None, iterations=None):
+        """Sample the topics of every token
+
+        Args:
+            words: numpy int32 array, word id of every token, documents one
+                after the other
+            lengths: numpy array, number of tokens of every document
+            topics: numpy int32 array, topic every token starts from,
+                random if not given
+            iterations: Number of iterations, defaults to self.iterations
+        """
+        K = self.num_topics
+        if iterations is None:
+            iterations = self.iterations
+        if topics is None:
+            state = np.random.RandomState(self.random_seed)
+            topics = state.randint(0, K, len(words)).astype(np.int32)
+        self.word_topics = np.zeros((self.num_terms, K), dtype=np.int32)
+        np.add.at(self.word_topics, (words, topics), 1)
+
+        workers = self.workers
+        if workers > 1 and multiprocessing.current_process().daemon:
+            # e.g. inside a sweep pool, which cannot start processes
+            logger.info('sampling in a single process')
+            workers = 1
+        bounds = _split(lengths, workers)
+
+        start = time.time()
+        if workers == 1:
+            shard = _Shard(words, lengths, topics, self, self.random_seed)
+            for it in range(iterations):
+                shard.sweep(self.word_topics)
+                self._log_progress(it, iterations, shard.ndk)
+            self.doc_topic_counts = shard.ndk
+            topics = shard.topics
+        else:
+            # Word topic counts shared with the workers, only updated here
+            # once every worker has sampled against them
+            shape = self.word_topics.shape
+            shared = multiprocessing.RawArray('i', self.word_topics.size)
+            nwk = np.frombuffer(shared, dtype=np.int32).reshape(shape)
+            nwk[:] = self.word_topics
+            self.word_topics = nwk
+            shards = []
+            for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+                first, last = lengths[:lo].sum(), lengths[:hi].sum()
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=_serve, \
+                    args=(child, shared, shape, words[first:last], \
+                        lengths[lo:hi], topics[first:last], self, \
+                                                    self.random_seed + k))
+                process.daemon = True
+                process.start()
+                child.close()
+                shards.append((parent, process))
+            try:
+                for it in range(iterations):
+                    for conn, process in shards:
+                        conn.send(('sweep',))
+                    deltas = [conn.recv() for conn, process in shards]
+                    flat = nwk.reshape(-1)
+                    for cells, delta in deltas:
+                        flat[cells] += delta
+                    if (it + 1) % 10 == 0 or it + 1 == iterations:
+                        for conn, process in shards:
+                            conn.send(('counts',))
+                        self._log_progress(it, iterations, np.concatenate( \
+                                [conn.recv() for conn, process in shards]))
+                for conn, process in shards:
+                    conn.send(('counts',))
+                self.doc_topic_counts = np.concatenate([conn.recv() \
+                                                for conn, process in shards])
+                for conn, process in shards:
+                    conn.send(('topics',))
+                topics = np.concatenate([conn.recv() \
+                                                for conn, process in shards])
+            finally:
+                for conn, process in shards:
+                    conn.send(('stop',))
+                    process.join()
+                self.word_topics = nwk.copy()
+
+        # Sinks need not survive saving the model
+        self.telemetry = None
+        # Sampler state, to resume from with GibbsLda.update()
+        self.words = np.asarray(words, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.topics = np.asarray(topics, dtype=np.int32)
+
+        elapsed = max(time.time() - start, 1e-9)
+        self.tokens_per_sec = len(words) * iterations / elapsed
+        logger.info('sampled %d tokens x %d iterations in %.1fs with %d ' \
+            'workers, %.0f tokens/sec', len(words), iterations, \
+                                    elapsed, workers, self.tokens_per_sec)
+
+    def update(self, corpus, iterations=100, num_terms=None, telemetry=None):
+        """Add documents and resume sampling from the current topics
+
+        Topics of the tokens already sampled are kept, the tokens of the new
+        documents start from random topics, then every token is sampled
+        <iterations> more times.
+
+        Args:
+            corpus: Term Document frequency of the new documents
+            iterations: Number of iterations
+            num_terms: Size of the vocabulary, if it grew
+            telemetry: sptm.telemetry.Telemetry recording the log likelihood
+                every 10 iterations
+
+        Raises:
+            Exception: Model trained before GibbsLda.update() existed
+        """
+        if getattr(self, 'topics', None) is None:
+            raise Exception('model holds no sampler state to update')
+        words, lengths = _flatten(corpus)
+        num_terms = max(num_terms or 0, self.num_terms, \
+                                int(words.max()) + 1 if len(words) else 0)
+        self.num_terms = num_terms
+        self.telemetry = telemetry
+        state = np.random.RandomState(self.random_seed + len(self.lengths))
+        topics = state.randint(0, self.num_topics, len(words))
+        self.train(np.concatenate([self.words, words]), \
+                np.concatenate([self.lengths, lengths]), \
+                np.concatenate([self.topics, topics.astype(np.int32)]), \
+                                                                    iterations)
+
+    def _log_progress(self, it, iterations, ndk):
+        """Log the log likelihood every 10 iterations, as Mallet does
+
+        Args:
+            it: Iteration just finished
+            iterations: Number of iterations
+            ndk: Document topic counts
+        """
+        if (it + 1) % 10 == 0 or it + 1 == iterations:
+            ll = float(self.log_likelihood(ndk))
+            logger.info('<%d> LL/token: %.5f', it + 1, ll)
+            if self.telemetry is not None:
+                self.telemetry.record(it + 1, log_likelihood=ll, \
+                                                perplexity=perplexity(ll))
+
+    def log_likelihood(self, ndk=None):
+        """Log likelihood of the topic assignments per token
+
+        Args:
+            ndk: Document topic counts, defaults to doc_topic_counts
+
+        Returns:
+            Float value
+        """
+        if ndk is None:
+            ndk = self.doc_topic_counts
+        nwk = self.word_topics
+        V, beta = self.num_terms, self.beta
+        nk = nwk.sum(axis=0)
+        ll = self.num_topics * (gammaln(V * beta) - V * gammaln(beta))
+        ll += gammaln(nwk + beta).sum() - gammaln(nk + V * beta).sum()
+        alpha = self.alpha
+        lengths = ndk.sum(axis=1)
+        ll += len(ndk) * (gammaln(alpha.sum()) - gammaln(alpha).sum())
+        ll += gammaln(ndk + alpha).sum() - gammaln(lengths + \
+                                                        alpha.sum()).sum()
+        return ll / max(nk.sum(), 1)
+
+    def get_topics(self):
+        """Topic word distributions
+
+        Returns:
+            numpy array of shape (num_topics, num_terms)
+        """
+        topics = self.word_topics.T + self.beta
+        return topics / topics.sum(axis=1)[:, None]
+
+    def show_topic(self, topicid, topn=10):
+        """Top words of a topic
+
+        Args:
+            topicid: Topic number
+            topn: Number of words
+
+        Returns:
+            List of (word, probability)
+        """
+        topic = self.get_topics()[topicid]
+        best = np.argsort(-topic)[:topn]
+        return [(self.id2word[i] if self.id2word is not None else i, \
+                                                float(topic[i])) for i in best]
+
+    def show_topics(self, num_topics=10, num_words=10, log=False, \
+                                                            formatted=True):
+        """Top words of the first num_topics topics
+
+        Args:
+            num_topics: Number of topics, -1 for all
+            num_words: Number of words of every topic
+            log: Log the topics too
+            formatted: Format the words as gensim does
+
+        Returns:
+            List of (topic number, top words)
+        """
+        if num_topics < 0 or num_topics > self.num_topics:
+            num_topics = self.num_topics
+        shown = []
+        for i in range(num_topics):
+            topic = self.show_topic(i, num_words)
+            if formatted:
+                topic = ' + '.join('%.3f*"%s"' % (p, w) for w, p in topic)
+            shown.append((i, topic))
+            if log:
+                logger.info('topic #%i: %s', i, topic)
+        return shown
+
+    def print_topics(self, num_topics=20, num_words=10):
+        """Top words of the first num_topics topics, logged
+
+        Args:
+            num_topics: Number of topics, -1 for all
+            num_words: Number of words of every topic
+
+        Returns:
+            List of (topic number, top words)
+        """
+        return self.show_topics(num_topics, num_words, log=True)
+
+    def doc_topics(self):
+        """Topic distribution of every training document
+
+        Returns:
+            numpy float32 array of shape (num_docs, num_topics)
+        """
+        return _proportions(self.doc_topic_counts, \
+                                            self.alpha).astype(np.float32)
+
+    def get_document_topics(self, bow, iterations=100):
+        """Infer the topic distribution of a document, sampling its topics
+        against the trained word topic counts
+
+        Every iteration resamples the topics of all tokens of the document
+        at once, each token's own assignment excluded from the document
+        topic counts, as training does within a block.
+
+        Args:
+            bow: Bag of words of the document, or a corpus
+            iterations: Number of iterations
+
+        Returns:
+            List of (topic number, probability) above topic_threshold, or a
+            generator of them for a corpus
+        """
+        phi = self.get_topics()
+        is_corpus, bow = utils.is_corpus(bow)
+        if is_corpus:
+            return (self._infer(doc, phi, iterations) for doc in bow)
+        return self._infer(bow, phi, iterations)
+
+    def _infer(self, bow, phi, iterations):
+        """Infer the topic distribution of a document, see
+        get_document_topics()
+
+        Args:
+            bow: Bag of words of the document
+            phi: Topic word distributions
+            iterations: Number of iterations
+
+        Returns:
+            List of (topic number, probability) above topic_threshold
+        """
+        K = self.num_topics
+        words, lengths = _flatten([bow])
+        words = words[words < self.num_terms]
+        pw = phi[:, words].T
+        rows = np.arange(len(words))
+        state = np.random.RandomState(self.random_seed)
+        topics = state.randint(0, K, len(words))
+        ndk = np.bincount(topics, minlength=K)
+        for it in range(iterations):
+            nd = np.broadcast_to(ndk + self.alpha, pw.shape).copy()
+            nd[rows, topics] -= 1
+            cdf = np.cumsum(nd * pw, axis=1)
+            u = state.random_sample(len(words)) * cdf[:, -1]
+            topics = np.minimum((cdf < u[:, None]).sum(axis=1), K - 1)
+            ndk = np.bincount(topics, minlength=K)
+        dist = (ndk + self.alpha) / (len(words) + self.alpha.sum())
+        return [(k, float(p)) for k, p in enumerate(dist) \
+                                            if p > self.topic_threshold]
+
+    def __getitem__(self, bow):
+        return self.get_document_topics(bow)
+
+    def write_doctopics(self, path, first=0):
+        """Write the topic distribution of every training document in
+        Mallet's doctopics format (document number, name, proportions)
+
+        Args:
+            path: Location of the file
+            first: Number of the first document written, the file being
+                appended to if above 0, e.g. with the documents added by
+                GibbsLda.update()
+
+        Raises:
+            IOError: Path could not be written
+        """
+        try:
+            with open(path, 'a' if first else 'w') as F:
+                for start in range(first, len(self.doc_topic_counts), 10000):
+                    dist = _proportions(self.doc_topic_counts[start:start + \
+                                                        10000], self.alpha)
+                    for i, row in enumerate(dist):
+                        row = np.where(row > self.topic_threshold, row, 0)
+                        F.write('%d\t%d\t%s\n' % (start + i, start + i, \
+                                    '\t'.join(repr(float(p)) for p in row)))
+        except (IOError, OSError):
+            raise IOError('Error with output path')
+
+class _Shard:
+    """Tokens of a range of documents and their topics, sampled block by
+    block
+
+    Attributes:
+        words: numpy int32 array, word id of every token
+        docs: numpy int32 array, document of every token
+        topics: numpy int32 array, topic of every token
+        ndk: numpy array, document topic counts
+        blocks: List of arrays of token positions sampled together
+    """
+
+    def __init__(self, words, lengths, topics, model, seed):
+        K = model.num_topics
+        self.alpha = model.alpha
+        self.beta = model.beta
+        self.vbeta = model.num_terms * model.beta
+        self.state = np.random.RandomState(seed)
+        self.words = np.asarray(words, dtype=np.int32)
+        self.topics = np.asarray(topics, dtype=np.int32).copy()
+        lengths = np.asarray(lengths, dtype=np.int64)
+        self.docs = np.repeat(np.arange(len(lengths), dtype=np.int32), \
+                                                                    lengths)
+
+        # Document counts fit in int16 for documents below 32768 tokens
+        dtype = np.int16 if (not len(lengths) or \
+                                lengths.max() < 32768) else np.int32
+        self.ndk = np.zeros((len(lengths), K), dtype=dtype)
+        np.add.at(self.ndk, (self.docs, self.topics), 1)
+
+        # Blocks of tokens at the same position of different documents
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        position = np.arange(len(self.words)) - np.repeat(starts, lengths)
+        order = np.argsort(position, kind='stable')
+        bounds = np.flatnonzero(np.diff(position[order])) + 1
+        self.blocks = []
+        for block in np.split(order, bounds):
+            for i in range(0, len(block), model.block_size):
+                self.blocks.append(block[i:i + model.block_size])
+
+    def sweep(self, nwk):
+        """Resample the topic of every token once
+
+        Args:
+            nwk: numpy int32 array of word topic counts, updated in place
+        """
+        nk = nwk.sum(axis=0).astype(np.float64)
+        for block in self.blocks:
+            rows = np.arange(len(block))
+            w = self.words[block]
+            d = self.docs[block]
+            old = self.topics[block]
+
+            nd = self.ndk[d].astype(np.float64)
+            nd[rows, old] -= 1
+            nw = nwk[w].astype(np.float64)
+            nw[rows, old] -= 1
+            denom = np.broadcast_to(nk + self.vbeta, nd.shape).copy()
+            denom[rows, old] -= 1
+
+            cdf = np.cumsum((nd + self.alpha) * (nw + self.beta) / denom, \
+                                                                    axis=1)
+            u = self.state.random_sample(len(block)) * cdf[:, -1]
+            new = np.minimum((cdf < u[:, None]).sum(axis=1), \
+                                        nd.shape[1] - 1).astype(np.int32)
+
+            moved = new != old
+            if moved.any():
+                w, d, old, new = w[moved], d[moved], old[moved], new[moved]
+                np.add.at(nwk, (w, old), -1)
+                np.add.at(nwk, (w, new), 1)
+                self.ndk[d, old] -= 1
+                self.ndk[d, new] += 1
+                nk -= np.bincount(old, minlength=len(nk))
+                nk += np.bincount(new, minlength=len(nk))
+                self.topics[block[moved]] = new
+
+def _serve(conn, shared, shape, words, lengths, topics, model, seed):
+    """Sample a shard of documents in a worker process until told to stop
+
+    Every sweep samples against a copy of the shared word topic counts and
+    sends back the flat positions and changes of the counts it moved.
+
+    Args:
+        conn: multiprocessing connection to the GibbsLda
+        shared: multiprocessing RawArray of the word topic counts
+        shape: Shape of the word topic counts
+        words: Word ids of the tokens of the shard
+        lengths: Number of tokens of every document of the shard
+        topics: Initial topics of the tokens of the shard
+        model: GibbsLda object
+        seed: Seed of the shard's sampler
+    """
+    shard = _Shard(words, lengths, topics, model, seed)
+    counts = np.frombuffer(shared, dtype=np.int32).reshape(shape)
+    while True:
+        message = conn.recv()
+        if message[0] == 'sweep':
+            nwk = counts.copy()
+            shard.sweep(nwk)
+            cells = np.flatnonzero(nwk != counts)
+            conn.send((cells, nwk.reshape(-1)[cells] - \
+                                                counts.reshape(-1)[cells]))
+        elif message[0] == 'counts':
+            conn.send(shard.ndk)
+        elif message[0] == 'topics':
+            conn.send(shard.topics)
+        else:
+            conn.close()
+            return
+
+def _flatten(corpus):
+    """Expand a corpus to one word id per token
+
+    Args:
+        corpus: Term Document frequency
+
+    Returns:
+        Tuple of numpy int32 word ids and numpy int64 document lengths
+    """
+    ids = []
+    counts = []
+    lengths = []
+    for doc in corpus:
+        lengths.append(0)
+        for i, c in doc:
+            ids.append(i)
+            counts.append(int(c))
+            lengths[-1] += int(c)
+    words = np.repeat(np.asarray(ids, dtype=np.int32), \
+                                        np.asarray(counts, dtype=np.int64))
+    return words, np.asarray(lengths, dtype=np.int64)
+
+def _split(lengths, parts):
+    """Split documents in contiguous ranges of about the same number of
+    tokens
+
+    Args:
+        lengths: Number of tokens of every document
+        parts: Number of ranges
+
+    Returns:
+        List of parts + 1 document bounds
+    """
+    cumulative = np.cumsum(lengths)
+    total = cumulative[-1] if len(cumulative) else 0
+    bounds = [0]
+    for k in range(1, parts):
+        bounds.append(max(bounds[-1], int(np.searchsorted(cumulative, \
+                                                    total * k / parts))))
+    bounds.append(len(lengths))
+    return bounds
+
+def _proportions(counts, alpha):
+    """Smoothed topic proportions of documents
+
+    Args:
+        counts: Document topic counts
+        alpha: Prior of every topic
+
+    Returns:
+        numpy array of proportions
+    """
+    counts = counts + alpha
+    return counts / counts.sum(axis=1)[:, None]
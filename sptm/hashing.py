@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Fixed memory hashed vocabulary
+"""
+
+#######################################
+
+import zlib
+import math
+import logging
+
+from collections.abc import Mapping
+
+import numpy as np
+import gensim.utils as utils
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+class HashedDictionary(utils.SaveLoad):
+    """Vocabulary mapping tokens to a fixed number of hash buckets
+
+    Drop-in replacement for gensim's Dictionary in the spirit of gensim's
+    HashDictionary: the id of a token is its hash modulo num_buckets, so
+    memory stays constant however many new tokens show up. Document
+    frequencies and bucket occupancy are kept per bucket.
+
+    Instead of every token ever seen, only the top_n most frequent tokens
+    are remembered (Misra-Gries summary of at most 2 * top_n entries). They
+    give buckets a readable name (e.g. when printing topics) and exact
+    collision counts among frequent tokens. Other buckets are named
+    '#<bucket>'.
+
+    Attributes:
+        num_buckets: Number of ids
+        top_n: Number of frequent tokens remembered
+        dfs: numpy array, document frequency of every bucket
+        num_docs: Number of documents processed
+        num_pos: Number of tokens processed
+        num_nnz: Number of (document, bucket) pairs processed
+    """
+
+    def __init__(self, documents=None, num_buckets=1 << 20, top_n=100000, \
+                                                        myhash=zlib.crc32):
+        """Inits HashedDictionary, adding documents if passed
+
+        Args:
+            documents: Iterable of lists of tokens
+            num_buckets: Number of ids
+            top_n: Number of frequent tokens remembered, 0 for none
+            myhash: Hash function taking bytes and returning an int
+        """
+        self.num_buckets = num_buckets
+        self.top_n = top_n
+        self.myhash = myhash
+        self.dfs = np.zeros(num_buckets, dtype=np.int64)
+        self.num_docs = 0
+        self.num_pos = 0
+        self.num_nnz = 0
+        self._counts = dict()
+        self._names = None
+        self._token2id = None
+        if documents is not None:
+            self.add_documents(documents)
+
+    def restricted_hash(self, token):
+        """Bucket of a token
+
+        Args:
+            token: String
+
+        Returns:
+            Integer id
+        """
+        return self.myhash(utils.to_utf8(token)) % self.num_buckets
+
+    def doc2bow(self, document, allow_update=False):
+        """Convert a document to bag of words
+
+        Args:
+            document: List of tokens
+            allow_update: Update the frequency statistics with the document
+
+        Returns:
+            List of (id, count) sorted by id
+        """
+        result = dict()
+        for token in document:
+            tokenid = self.restricted_hash(token)
+            result[tokenid] = result.get(tokenid, 0) + 1
+
+        if allow_update:
+            self.num_docs += 1
+            self.num_pos += len(document)
+            self.num_nnz += len(result)
+            self.dfs[list(result)] += 1
+            if self.top_n:
+                self._count(document)
+        return sorted(result.items())
+
+    def add_documents(self, documents):
+        """Update the frequency statistics with several documents
+
+        Args:
+            documents: Iterable of lists of tokens
+        """
+        for docno, document in enumerate(documents):
+            if docno % 100000 == 0:
+                logger.info('adding document #%d to %s', docno, self)
+            self.doc2bow(document, allow_update=True)
+
+    def _count(self, document):
+        """Update the summary of frequent tokens
+
+        Args:
+            document: List of tokens
+        """
+        counts = self._counts
+        for token in document:
+            counts[token] = counts.get(token, 0) + 1
+        if len(counts) > 2 * self.top_n:
+            # Keep the top_n heaviest, discounting the others' weight
+            floor = sorted(counts.values(), reverse=True)[self.top_n]
+            self._counts = dict((t, c - floor) for t, c in counts.items() \
+                                                                if c > floor)
+        self._names = None
+        self._token2id = None
+
+    def top_tokens(self):
+        """Frequent tokens remembered, most frequent first
+
+        Returns:
+            List of (token, approximate count)
+        """
+        ranked = sorted(self._counts.items(), key=lambda x: (-x[1], x[0]))
+        return ranked[:self.top_n]
+
+    def _bucket_names(self):
+        """Name buckets after the most frequent token hashed to them
+
+        Returns:
+            Dictionary of {id: token}
+        """
+        if self._names is None:
+            self._names = dict()
+            for token, count in self.top_tokens():
+                self._names.setdefault(self.restricted_hash(token), token)
+        return self._names
+
+    @property
+    def token2id(self):
+        """Mapping of the name of every bucket, and of every frequent token
+        remembered, to its id
+
+        Covers every name id2token and __getitem__ hand out, '#<id>'
+        included, so words read back by name (e.g. by LdaMallet from its
+        state file) find their id.
+        """
+        if getattr(self, '_token2id', None) is None:
+            self._token2id = _BucketIds(self)
+        return self._token2id
+
+    @property
+    def id2token(self):
+        """Mapping of ids to the name of their bucket"""
+        return self._bucket_names()
+
+    def collision_stats(self):
+        """Estimate how many tokens share a bucket
+
+        The number of distinct tokens is estimated from bucket occupancy
+        (linear counting). Collisions among the frequent tokens remembered
+        are counted exactly.
+
+        Returns:
+            Dictionary of statistics
+        """
+        occupied = int(np.count_nonzero(self.dfs))
+        empty = self.num_buckets - occupied
+        if empty > 0:
+            distinct = -self.num_buckets * math.log(float(empty) / \
+                                                            self.num_buckets)
+        else:
+            distinct = float('inf')
+        top = self.top_tokens()
+        return {
+            'num_buckets': self.num_buckets,
+            'occupied': occupied,
+            'load_factor': float(occupied) / self.num_buckets,
+            'estimated_tokens': distinct,
+            'estimated_collisions': distinct - occupied,
+            'top_tokens': len(top),
+            'top_collisions': len(top) - len(set(self.restricted_hash(t) \
+                                                            for t, c in top)),
+        }
+
+    def __getitem__(self, tokenid):
+        return self._bucket_names().get(tokenid, u'#%d' % tokenid)
+
+    def get(self, tokenid, default=None):
+        if 0 <= tokenid < self.num_buckets:
+            return self[tokenid]
+        return default
+
+    def __contains__(self, tokenid):
+        return 0 <= tokenid < self.num_buckets
+
+    def __len__(self):
+        return self.num_buckets
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """All ids
+
+        Returns:
+            range of ids
+        """
+        return range(self.num_buckets)
+
+    def items(self):
+        """All ids with the name of their bucket
+
+        Returns:
+            Generator of (id, name)
+        """
+        return ((i, self[i]) for i in self.keys())
+
+    def __str__(self):
+        return 'HashedDictionary(%d buckets, %d documents)' % \
+                                            (self.num_buckets, self.num_docs)
+
+class _BucketIds(Mapping):
+    """Read only {name: id} mapping of all the buckets of a
+    HashedDictionary, looked up without storing a name per bucket
+
+    Attributes:
+        dictionary: HashedDictionary
+    """
+
+    def __init__(self, dictionary):
+        """Inits _BucketIds
+
+        Args:
+            dictionary: HashedDictionary
+        """
+        self.dictionary = dictionary
+        self._names = dictionary._bucket_names()
+        self._tokens = dict((t, dictionary.restricted_hash(t)) for t, c in \
+                                                    dictionary.top_tokens())
+
+    def __getitem__(self, token):
+        if token in self._tokens:
+            return self._tokens[token]
+        # Unnamed buckets are called '#<id>'
+        if token[:1] == u'#':
+            try:
+                tokenid = int(token[1:])
+            except ValueError:
+                raise KeyError(token)
+            if u'#%d' % tokenid == token and tokenid not in self._names \
+                            and 0 <= tokenid < self.dictionary.num_buckets:
+                return tokenid
+        raise KeyError(token)
+
+    def __iter__(self):
+        for token in self._tokens:
+            yield token
+        for tokenid in range(self.dictionary.num_buckets):
+            if tokenid not in self._names:
+                yield u'#%d' % tokenid
+
+    def __len__(self):
+        return len(self._tokens) + self.dictionary.num_buckets - \
+                                                            len(self._names)
@@ -33,7 +33,8 @@ class Inferencer:
 
         Args:
             model: sptm.Model object
-            dictionary: sptm.Model.id2word
+            dictionary: sptm.Model.id2word, gensim Dictionary or
+                sptm.hashing.HashedDictionary
         """
         self.model = model
         self.dictionary = dictionary
@@ -53,5 +54,7 @@ class Inferencer:
         query_corpus = sptm.preprocess.Corpus(None, query, None, None)
         query_corpus.split_sentence(min_len=sentence_ml)
         query_corpus.tokenize_custom(min_len=token_ml)
-        query_bow = self.dictionary.doc2bow(query_corpus.tokens)
+        # Bag of words of all the tokens, without the data index numbers
+        query_bow = self.dictionary.doc2bow([t for row in \
+                                        query_corpus.tokens for t in row[1:]])
         return self.model.get_document_topics(query_bow)
@@ -6,18 +6,36 @@
 
 #######################################
 
+import os
+import math
+import time
+import gzip
+import hashlib
 import logging
 import codecs
+import tempfile
+import threading
 import multiprocessing
-from shutil import copy2
+from shutil import copy2, rmtree
+from itertools import chain, islice, zip_longest
 
+import numpy as np
 import gensim.corpora as corpora
 import gensim.models.wrappers as Wrappers
 import gensim.utils as utils
+import gensim.models.ldamulticore as ldamulticore
 from gensim.models.ldamodel import LdaModel
-from gensim.models import CoherenceModel
+from gensim.models.ldamulticore import LdaMulticore
 
 from sptm.utils import force_unicode
+from sptm.tokenstore import TokenStore
+from sptm.hashing import HashedDictionary
+from sptm.coherence import CooccurrenceCache
+from sptm.distributed import LdaCluster
+from sptm.gibbs import GibbsLda
+from sptm.telemetry import Telemetry, TelemetryMetric, run_mallet
+from sptm.bundle import ModelBundle
+from sptm.doctopics import load_doctopics
 
 __author__ = "Rochan Avlur Venkat"
 __credits__ = ["Anupam Mediratta"]
@@ -32,17 +50,586 @@ __email__ = "rochan170543@mechyd.ac.in"
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', \
                                                         level=logging.INFO)
 
+# Held while an _LdaMulticore swaps the Queue of gensim's ldamulticore
+_QUEUE_LOCK = threading.Lock()
+
+class _TokenFile:
+    """Tokens file read lazily, one row at a time, each time it is iterated
+
+    Attributes:
+        path: Location of the tokens file
+    """
+
+    def __init__(self, path):
+        """Inits _TokenFile
+
+        Args:
+            path: Location of the tokens file
+
+        Raises:
+            IOError: File not found
+        """
+        if not os.path.isfile(path):
+            raise IOError("File not found")
+        self.path = path
+
+    def __iter__(self):
+        with codecs.open(self.path, 'r', encoding='utf8') as F:
+            for row in F:
+                token_in_row = row.rstrip('\n').split(",")
+                yield [force_unicode(t) for t in token_in_row[1:]]
+
+def _fit(model, weights=None, stream=False, corpus_path=None, \
+                no_below=None, no_above=None, keep_n=None, hash_buckets=None, \
+                                                        hash_top_n=100000):
+    """Build id2word and the term document frequency of a model's tokens
+
+    Shared by Model.fit() and ModelVanilla.fit(), see there.
+
+    Args:
+        model: Model or ModelVanilla object
+        weights: Number of copies each row of tokens stands for, applied
+            to the bag of words of ModelVanilla only
+        stream: Serialize the corpus to corpus_path and read it from disk
+        corpus_path: Location of the Matrix Market corpus file
+        no_below: Drop tokens found in less than no_below rows
+        no_above: Drop tokens found in more than no_above (fraction) rows
+        keep_n: Keep only the keep_n most frequent tokens
+        hash_buckets: Number of buckets of a sptm.hashing.HashedDictionary
+            used instead of a gensim Dictionary
+        hash_top_n: Number of frequent tokens the HashedDictionary remembers
+
+    Returns:
+        Tuple of id2word and corpus
+
+    Raises:
+        Exception: Pruning asked for a hashed vocabulary
+    """
+    prune = (no_below, no_above, keep_n) != (None, None, None)
+
+    if hash_buckets is not None:
+        if prune:
+            raise Exception('a hashed vocabulary cannot be pruned')
+        # Fixed size vocabulary, however many distinct tokens there are
+        id2word = HashedDictionary(model.tokens, num_buckets=hash_buckets, \
+                                                            top_n=hash_top_n)
+        logging.info('hashed vocabulary: %s', id2word.collision_stats())
+        corpus = (id2word.doc2bow(text) for text in model.tokens)
+    elif model.store is not None:
+        # Read both straight from the token ids of the store
+        id2word = model.store.dictionary()
+        corpus = model.store.bow()
+        if prune:
+            old_ids = dict(id2word.token2id)
+            _prune(id2word, no_below, no_above, keep_n)
+            new_ids = [id2word.token2id.get(t, -1) for t in \
+                                    sorted(old_ids, key=old_ids.get)]
+            corpus = ([(new_ids[i], c) for i, c in doc if new_ids[i] >= 0] \
+                                                            for doc in corpus)
+    else:
+        # Create Dictionary, in a single pass over the tokens
+        id2word = corpora.Dictionary(model.tokens)
+        if prune:
+            _prune(id2word, no_below, no_above, keep_n)
+        # Term Document Frequency
+        corpus = (id2word.doc2bow(text) for text in model.tokens)
+
+    if weights is not None:
+        corpus = _weight_corpus(corpus, weights)
+
+    if not stream:
+        return id2word, list(corpus)
+
+    if corpus_path is None:
+        handle, corpus_path = tempfile.mkstemp(suffix='_corpus.mm')
+        os.close(handle)
+    corpora.MmCorpus.serialize(corpus_path, corpus, id2word=id2word)
+    return id2word, corpora.MmCorpus(corpus_path)
+
+def _prune(id2word, no_below, no_above, keep_n):
+    """Filter a Dictionary, only on the criteria given
+
+    Args:
+        id2word: gensim Dictionary
+        no_below: Drop tokens found in less than no_below rows
+        no_above: Drop tokens found in more than no_above (fraction) rows
+        keep_n: Keep only the keep_n most frequent tokens
+    """
+    size = len(id2word)
+    id2word.filter_extremes(no_below=no_below if no_below is not None else 0,\
+                no_above=no_above if no_above is not None else 1.0, \
+                                                                keep_n=keep_n)
+    logging.info('pruned dictionary from %d to %d tokens', size, len(id2word))
+
+# Model being swept, inherited by the processes of the sweep pool
+_SWEEP_MODEL = None
+
+def _init_sweep(model):
+    """Initializer of the sweep pool processes
+
+    Args:
+        model: Model or ModelVanilla object
+    """
+    global _SWEEP_MODEL
+    _SWEEP_MODEL = model
+
+def _sweep_job(job):
+    """Train and score one candidate in a sweep pool process
+
+    Args:
+        job: Tuple of number of topics, budget and workers
+
+    Returns:
+        c_v coherence
+    """
+    num_topics, units, workers = job
+    return _SWEEP_MODEL._candidate(num_topics, units, workers)
+
+def _sweep(model, candidates, total, cores, processes=None, halving=False, \
+                                                                    eta=3):
+    """Train and score models for several numbers of topics
+
+    Shared by Model.optimum_topic() and ModelVanilla.optimum_topic(), see
+    there. Up to <processes> candidates train at once, sharing the <cores>
+    between them. With halving, every candidate first trains on
+    total // eta ** r iterations (or passes) and only the best 1/eta of
+    them move on to the next round, trained again from scratch on eta
+    times more, until the survivors train on the full budget. There are
+    only as many rounds as the budget can be split in, so every round
+    trains longer than the one before.
+
+    Args:
+        model: Model or ModelVanilla object
+        candidates: Numbers of topics to try
+        total: Training budget, number of iterations (or passes) of a
+            model
+        cores: Total number of cores to use
+        processes: Number of candidates trained at once, defaults to cores
+        halving: Stop low coherence candidates early
+        eta: Fraction of candidates kept and budget growth every round
+
+    Returns:
+        List of dictionaries {num_topics, c_v, budget} in candidates order,
+        budget being the fraction of the training budget the candidate
+        reached
+
+    Raises:
+        Exception: eta below 2 / budget too small to halve
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return []
+    cores = max(1, cores)
+    processes = max(1, min(processes or cores, len(candidates)))
+
+    rounds = 0
+    if halving:
+        if int(eta) != eta or eta < 2:
+            raise Exception('eta must be an integer of at least 2')
+        eta = int(eta)
+        remaining = len(candidates)
+        while remaining > 1 and total // eta ** (rounds + 1) >= 1:
+            remaining = int(math.ceil(remaining / float(eta)))
+            rounds += 1
+        if rounds == 0 and len(candidates) > 1:
+            raise Exception('A budget of %d cannot be halved, it takes at ' \
+                                            'least %d' % (total, eta))
+    model._prepare()
+
+    scores = dict()
+    budget = dict()
+    alive = candidates
+    for r in range(rounds, -1, -1):
+        units = total // eta ** r
+        width = min(processes, len(alive))
+        workers = max(1, cores // width)
+        logging.info('sweep: %d candidates at %d of %d, %d at a time with ' \
+                '%d workers each', len(alive), units, total, width, workers)
+        if width == 1:
+            values = [model._candidate(k, units, workers) for k in alive]
+        else:
+            pool = multiprocessing.Pool(width, _init_sweep, (model,))
+            try:
+                values = pool.map(_sweep_job, [(k, units, workers) \
+                                            for k in alive], chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        for k, cv in zip(alive, values):
+            scores[k] = cv
+            budget[k] = units / float(total)
+        if r:
+            keep = set(sorted(alive, key=lambda k: -scores[k])[:max(1, \
+                                int(math.ceil(len(alive) / float(eta))))])
+            alive = [k for k in alive if k in keep]
+
+    return [{'num_topics': k, 'c_v': round(float(scores[k]), 4), \
+                                'budget': budget[k]} for k in candidates]
+
+def _cooccurrence(model):
+    """Co-occurrence statistics of a model's tokens, computed on first use
+    after every fit
+
+    Args:
+        model: Model or ModelVanilla object
+
+    Returns:
+        sptm.coherence.CooccurrenceCache object
+    """
+    if getattr(model, 'cooccurrence', None) is None:
+        model.cooccurrence = CooccurrenceCache(model.tokens, model.id2word)
+    return model.cooccurrence
+
+def _weight_corpus(corpus, weights):
+    """Multiply the term frequencies of every document by its weight
+
+    Args:
+        corpus: Iterable of bag of words
+        weights: Weight of every document
+
+    Yields:
+        Weighted bag of words
+
+    Raises:
+        Exception: weights does not match the corpus
+    """
+    missing = object()
+    for doc, w in zip_longest(corpus, weights, fillvalue=missing):
+        if doc is missing or w is missing:
+            raise Exception('weights must have one value per row of tokens')
+        yield [(i, c * int(w)) for i, c in doc]
+
+def _new_texts(tokens):
+    """Tokens of new rows, read like the constructors read them
+
+    Args:
+        tokens: List of lists containing data index number and tokens, or
+            sptm.tokenstore.TokenStore
+
+    Returns:
+        List of lists of tokens
+
+    Raises:
+        Exception: Not in specified structure
+    """
+    if isinstance(tokens, TokenStore):
+        return [list(t) for t in tokens.texts()]
+    try:
+        return [list(row[1:]) for row in tokens]
+    except:
+        raise Exception("Tokens list does not follow required structure")
+
+class _Concat:
+    """Several iterables of texts (or documents) iterated one after the
+    other, each time
+
+    Attributes:
+        parts: List of iterables
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def __iter__(self):
+        return chain.from_iterable(self.parts)
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+def _extend(model, texts, corpus):
+    """Append new rows to the tokens and corpus of a model
+
+    Tokens held in memory are extended in place, tokens read from disk are
+    chained with the new ones. The new documents of a corpus streamed from
+    a Matrix Market file are written to a file of their own
+    (<corpus>.<first document>) chained after it, the earlier documents
+    are not read again.
+
+    Args:
+        model: Model or ModelVanilla object
+        texts: List of lists of tokens of the new rows
+        corpus: Term Document frequency of the new rows
+    """
+    if isinstance(model.tokens, list):
+        model.tokens.extend(texts)
+    else:
+        model.tokens = _Concat([model.tokens, texts])
+        # fit() must not read the tokens from the store alone any more
+        model.store = None
+
+    if isinstance(model.corpus, list):
+        model.corpus.extend(corpus)
+    else:
+        if not isinstance(model.corpus, _Concat):
+            model.corpus = _Concat([model.corpus])
+        path = '%s.%d' % (model.corpus.parts[0].input, len(model.corpus))
+        corpora.MmCorpus.serialize(path, corpus, id2word=model.id2word)
+        model.corpus.parts.append(corpora.MmCorpus(path))
+    # Co-occurrences of the previous tokens no longer apply
+    model.cooccurrence = None
+
+def _grow(lda, num_terms):
+    """Widen a gensim LDA model to a larger vocabulary, the new words
+    starting from their prior
+
+    Args:
+        lda: gensim LdaModel or LdaMulticore object
+        num_terms: Size of the vocabulary
+    """
+    extra = num_terms - lda.num_terms
+    if extra <= 0:
+        return
+    sstats = lda.state.sstats
+    lda.state.sstats = np.hstack([sstats, np.zeros((sstats.shape[0], \
+                                                extra), dtype=sstats.dtype)])
+    eta = np.asarray(lda.eta)
+    if eta.ndim == 1:
+        eta = np.concatenate([eta, np.full(extra, eta.mean(), \
+                                                        dtype=eta.dtype)])
+    else:
+        eta = np.hstack([eta, np.repeat(eta.mean(axis=1, keepdims=True), \
+                                                            extra, axis=1)])
+    lda.eta = lda.state.eta = eta
+    lda.num_terms = num_terms
+    lda.sync_state()
+
+def _append_doctopics(source, path, first):
+    """Append the rows of the documents from <first> on of a Mallet
+    doctopics file to another
+
+    Args:
+        source: Location of the doctopics file written by Mallet
+        path: Location of the doctopics file appended to
+        first: Number of the first document appended
+
+    Raises:
+        IOError: Files could not be read or written
+    """
+    try:
+        with open(source) as F, open(path, 'a') as G:
+            for line in F:
+                if line.startswith('#'):
+                    continue
+                if int(line.split(None, 1)[0]) >= first:
+                    G.write(line)
+    except (IOError, OSError, ValueError):
+        raise IOError('Error with doctopics file')
+
+def _merge_state(old_path, fresh_path, path):
+    """Mallet state of the fresh one, the tokens of the old one keeping
+    their topics
+
+    The fresh state covers the old documents, in the same order, followed
+    by the new ones.
+
+    Args:
+        old_path: Location of the gzipped state of the trained model
+        fresh_path: Location of the gzipped state of the whole corpus
+        path: Location of the merged state
+
+    Raises:
+        Exception: States of different corpora
+    """
+    with gzip.open(old_path, 'rt', encoding='utf8') as old, \
+            gzip.open(fresh_path, 'rt', encoding='utf8') as fresh, \
+            gzip.open(path, 'wt', encoding='utf8') as out:
+        old_lines = iter(old)
+        previous = next(old_lines, None)
+        # Keep the format line and hyperparameters of the trained model
+        while previous is not None and previous.startswith('#'):
+            out.write(previous)
+            previous = next(old_lines, None)
+        for line in fresh:
+            if line.startswith('#'):
+                continue
+            fields = line.split()
+            if previous is not None:
+                before = previous.split()
+                if before[:5] != fields[:5]:
+                    raise Exception('Mallet state does not match the ' + \
+                                                    'corpus, fit and train')
+                fields[5] = before[5]
+                previous = next(old_lines, None)
+            out.write(' '.join(fields) + '\n')
+        if previous is not None:
+            raise Exception('Mallet state does not match the corpus, ' + \
+                                                            'fit and train')
+
+def _params(model, names):
+    """Parameters of a model that can be written as json
+
+    Args:
+        model: Model or ModelVanilla object
+        names: Names of the parameters
+
+    Returns:
+        Dictionary of {name: value}, parameters not set left out
+    """
+    params = dict()
+    for name in names:
+        value = getattr(model, name, None)
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        if value is None or isinstance(value, (bool, int, float, str, \
+                                                                list, tuple)):
+            params[name] = value
+    return params
+
+class _LdaMallet(Wrappers.LdaMallet):
+    """gensim's Mallet wrapper, training on a corpus already imported to
+    Mallet's format if given one
+
+    Attributes:
+        corpus_mallet: Location of the imported corpus, None to convert the
+            corpus as gensim does
+        input_state: Location of a gzipped Mallet state the training starts
+            from, None to start from random topics
+        telemetry: sptm.telemetry.Telemetry fed with Mallet's progress
+            during the training, None to run Mallet as gensim does
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Set before LdaMallet.__init__() trains on the corpus
+        self.corpus_mallet = kwargs.pop('corpus_mallet', None)
+        self.input_state = kwargs.pop('input_state', None)
+        self.telemetry = kwargs.pop('telemetry', None)
+        super(_LdaMallet, self).__init__(*args, **kwargs)
+
+    def train(self, corpus):
+        """Train Mallet LDA, as gensim does, from the input state if any
+        and reading Mallet's progress if there is telemetry
+
+        Args:
+            corpus: Term Document frequency
+        """
+        if self.input_state is None and self.telemetry is None:
+            return super(_LdaMallet, self).train(corpus)
+        self.convert_input(corpus, infer=False)
+        cmd = self.mallet_path + ' train-topics --input %s ' \
+            '--num-topics %s --alpha %s --optimize-interval %s ' \
+            '--num-threads %s --output-state %s --output-doc-topics %s ' \
+            '--output-topic-keys %s --num-iterations %s ' \
+            '--inferencer-filename %s --doc-topics-threshold %s ' \
+            '--random-seed %s'
+        cmd = cmd % (self.fcorpusmallet(), self.num_topics, self.alpha, \
+            self.optimize_interval, self.workers, self.fstate(), \
+            self.fdoctopics(), self.ftopickeys(), self.iterations, \
+            self.finferencer(), self.topic_threshold, \
+                                            getattr(self, 'random_seed', 0))
+        if self.input_state is not None:
+            cmd += ' --input-state %s' % self.input_state
+        logging.info('training MALLET LDA with %s', cmd)
+        if self.telemetry is None:
+            utils.check_output(args=cmd, shell=True)
+        else:
+            run_mallet(cmd, self.telemetry)
+            # Sinks need not survive saving the model
+            self.telemetry = None
+        self.word_topics = self.load_word_topics()
+        self.wordtopics = self.word_topics
+
+    def convert_input(self, corpus, infer=False, serialize_corpus=True):
+        """Convert the corpus to Mallet's format, unless it was imported
+        already
+
+        Args:
+            corpus: Term Document frequency
+            infer: Convert documents to infer the topics of
+            serialize_corpus: Write the corpus text file first
+        """
+        if infer or self.corpus_mallet is None:
+            return super(_LdaMallet, self).convert_input(corpus, infer, \
+                                                            serialize_corpus)
+        target = self.fcorpusmallet()
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(self.corpus_mallet, target)
+        except OSError:
+            copy2(self.corpus_mallet, target)
+
+class _LdaMulticore(LdaMulticore):
+    """gensim's LdaMulticore, queueing a given number of chunks for the
+    workers
+
+    LdaMulticore builds its job queue inside update() from the Queue of
+    gensim's ldamulticore module, which takes no size. With queue_depth,
+    update() swaps that Queue for one bounding the job queue of its own
+    thread only, other threads training an LdaMulticore meanwhile get the
+    queues of gensim. Trainings with queue_depth in several threads of a
+    process run one after the other.
+
+    Attributes:
+        queue_depth: Number of chunks queued for the workers, None to queue
+            2 * workers as gensim does
+    """
+
+    def __init__(self, *args, **kwargs):
+        # Set before LdaMulticore.__init__() trains on the corpus
+        self.queue_depth = kwargs.pop('queue_depth', None)
+        super(_LdaMulticore, self).__init__(*args, **kwargs)
+
+    def update(self, corpus, chunks_as_numpy=False):
+        """Train on the corpus, as gensim does, with the job queue bounded
+        by queue_depth if set
+
+        Args:
+            corpus: Term Document frequency
+            chunks_as_numpy: Whether the chunks are passed as numpy arrays
+        """
+        if self.queue_depth is None:
+            return super(_LdaMulticore, self).update(corpus, chunks_as_numpy)
+        with _QUEUE_LOCK:
+            queue = ldamulticore.Queue
+            depth = self.queue_depth
+            owner = threading.get_ident()
+
+            def bounded(maxsize=0):
+                # gensim bounds the job queue only, not the result queue
+                if maxsize and threading.get_ident() == owner:
+                    maxsize = depth
+                return queue(maxsize=maxsize)
+
+            ldamulticore.Queue = bounded
+            try:
+                return super(_LdaMulticore, self).update(corpus, \
+                                                            chunks_as_numpy)
+            finally:
+                ldamulticore.Queue = queue
+
+def _mallet_key(corpus, id2word):
+    """Hash of the Mallet text file a corpus converts to
+
+    Args:
+        corpus: Term Document frequency
+        id2word: Dictionary of the corpus
+
+    Returns:
+        Hexadecimal digest
+    """
+    digest = hashlib.sha1()
+    for doc in corpus:
+        digest.update(u' '.join(u'%s:%d' % (id2word[i], c) for i, c in \
+                                                doc).encode('utf8') + b'\n')
+    return digest.hexdigest()
+
 class Model:
     """Adjust, train and optimize LDA model
 
     This class is responsible for traning the Topic Model using Mallet's
-    LDA which can be found [here](http://mallet.cs.umass.edu/topics.php)
+    LDA which can be found [here](http://mallet.cs.umass.edu/topics.php),
+    or the Mallet-free Gibbs sampler of sptm.gibbs
 
     Attributes:
         mallet_path: Path to Mallet binary
         tokens: List of lists containing data index number and tokens
+        store: sptm.tokenstore.TokenStore the tokens were read from, if any
         id2word: Dictionary of the Corpus
         corpus: Term Document frequency
+        cooccurrence: sptm.coherence.CooccurrenceCache of the tokens, built
+            by the first coherence computation after fit
+        corpus_mallet: Location of the corpus imported to Mallet's format,
+            imported by the first training after fit
         alpha = Model alpha hyperparameter
         workers = Number of workers spawned while training the model
         prefix = prefix
@@ -51,10 +638,16 @@ class Model:
         iterations = Number of iterations
         topic_threshold = topic threshold
         num_topics = Number of topics
-        lda_model_mallet = Gensim Mallet LDA wrapper object
+        backend = 'mallet' or 'gibbs', LDA implementation used
+        tokens_per_sec = Sampling throughput of the last training
+        telemetry = sptm.telemetry.Telemetry of the trainings, None for
+            none, see Model.set_telemetry()
+        lda_model_mallet = Gensim Mallet LDA wrapper object, or
+            sptm.gibbs.GibbsLda object with the gibbs backend
     """
 
-    def __init__(self, mallet_path, tokens=None, input_path=None):
+    def __init__(self, mallet_path, tokens=None, input_path=None, \
+                                                                stream=False):
         """Inits Model with Mallet path, tokenized data or input path to open
         saved tokenized data.
 
@@ -63,8 +656,12 @@ class Model:
 
         Args:
             mallet_path: Location of Mallet binary
-            input_path: Location of saved preprocessed tokens file
-            tokens: tokens of preprocessed data
+            input_path: Location of saved preprocessed tokens file or of a
+                sptm.tokenstore.TokenStore directory
+            tokens: tokens of preprocessed data, list of lists or
+                sptm.tokenstore.TokenStore
+            stream: Read the tokens file from disk each time it is needed
+                instead of loading it in memory
 
         Raises:
             IOError: Tokens file not found or not in specified format
@@ -72,26 +669,46 @@ class Model:
         """
         self.mallet_path = mallet_path
         self.tokens = []
+        self.store = None
 
         if (tokens is not None and input_path is None) or \
                             (tokens is not None and input_path is not None):
             # Use tokens list passed as an argument
-            print('Using tokens passed as argument')
-            try:
-                for i, val in enumerate(tokens):
-                    self.tokens.append(tokens[i][1:])
-            except:
-                raise Exception("Tokens list does not follow required " + \
-                                                                "structure")
+            logging.info('Using tokens passed as argument')
+            if isinstance(tokens, TokenStore):
+                # Compact tokens of a Corpus, no need to copy them
+                self.store = tokens
+                self.tokens = tokens.texts()
+            else:
+                try:
+                    for i, val in enumerate(tokens):
+                        self.tokens.append(tokens[i][1:])
+                except:
+                    raise Exception("Tokens list does not follow " + \
+                                                    "required structure")
+
+        elif tokens is None and input_path is not None and \
+                                            TokenStore.is_store(input_path):
+
+            # Memory-map the binary token store
+            logging.info('Opening token store')
+            self.store = TokenStore.load(input_path)
+            self.tokens = self.store.texts()
+
+        elif tokens is None and input_path is not None and stream:
+
+            # Read the saved tokens file lazily, every time it is needed
+            logging.info('Streaming tokens file')
+            self.tokens = _TokenFile(input_path)
 
         elif tokens is None and input_path is not None:
 
             # Read the saved tokens file
-            print('Opening tokens file')
+            logging.info('Opening tokens file')
             try:
                 with codecs.open(input_path, 'r', encoding='utf8') as F:
                     for row in F:
-                        token_in_row = row.split(",")
+                        token_in_row = row.rstrip('\n').split(",")
                         for i, val in enumerate(token_in_row):
                             token_in_row[i] = force_unicode(token_in_row[i])
                         self.tokens.append(token_in_row[1:])
@@ -101,32 +718,70 @@ class Model:
                 raise Exception("Tokens list does not follow required " + \
                                                                 "structure")
         elif tokens is None and input_path is None:
-            print("Assuming load model from saved file, use Model.load()")
+            logging.info("Assuming load model from saved file, use " + \
+                                                            "Model.load()")
         else:
-            print("Missing tokens data")
+            logging.info("Missing tokens data")
 
-    def fit(self):
+    def fit(self, stream=False, corpus_path=None, \
+                no_below=None, no_above=None, keep_n=None, hash_buckets=None, \
+                                                        hash_top_n=100000):
         """Generate the id2word dictionary and term document frequency of
         the given tokens
 
         NOTE: Should be called only after making sure that the tokens
         have been properly read
 
+        With stream, the term document frequency is written to a Matrix
+        Market file and self.corpus reads it back from disk instead of
+        holding it in memory. Combine with stream=True in the constructor to
+        keep the tokens on disk too.
+
+        With hash_buckets, tokens are hashed to a fixed number of ids by a
+        sptm.hashing.HashedDictionary, keeping the memory of id2word
+        constant on unbounded corpora. Only the hash_top_n most frequent
+        tokens keep a readable name, the others show up as '#<id>' in
+        topics. Check self.id2word.collision_stats() to pick the number of
+        buckets.
+
+        Rows collapsed by sptm.dedup.Deduplicator are trained once each:
+        Mallet and GibbsLda sample every token of a document, so repeating
+        the tokens of a row by its weight would lengthen the document and
+        change how alpha smooths it. Map the document topics of
+        Deduplicator.tokens back to every row with Deduplicator.expand().
+
+        Args:
+            stream: Serialize the corpus to disk and stream it from there
+            corpus_path: Location of the Matrix Market corpus file, a
+                temporary file if not given
+            no_below: Drop tokens found in less than no_below rows
+            no_above: Drop tokens found in more than no_above (fraction of
+                all rows) rows
+            keep_n: Keep only the keep_n most frequent tokens
+            hash_buckets: Number of ids of a hashed vocabulary, None for a
+                gensim Dictionary
+            hash_top_n: Number of frequent tokens the hashed vocabulary
+                remembers the name of, 0 for none
+
         Raises:
+            IOError: Corpus file could not be written
             Exception: self.tokens empty or not in required format
         """
         try:
-                # Create Dictionary
-                self.id2word = corpora.Dictionary(self.tokens)
-                # Term Document Frequency
-                self.corpus = \
-                        [self.id2word.doc2bow(text) for text in self.tokens]
-        except:
-            raise Exception('tokens not compatible')
+            self.id2word, self.corpus = _fit(self, None, stream, \
+                                corpus_path, no_below, no_above, keep_n, \
+                                                    hash_buckets, hash_top_n)
+            # Statistics of the previous id2word no longer apply
+            self.cooccurrence = None
+            self.corpus_mallet = None
+        except IOError:
+            raise IOError('Error writing corpus file')
+        except Exception as e:
+            raise Exception('tokens not compatible: %s' % e)
 
     def params(self, alpha=50, workers=multiprocessing.cpu_count(), \
                     prefix=None, optimize_interval=0, iterations=1000, \
-                                        topic_threshold=0.0, num_topics=100):
+                    topic_threshold=0.0, num_topics=100, backend='mallet'):
         """Model parameters
 
         NOTE: These are the same parameters used while traning models
@@ -142,7 +797,15 @@ class Model:
             iterations: Number of iterations
             topic_threshold: Topic threshold
             num_topics: Number of topics
+            backend: 'mallet' to train with Mallet, 'gibbs' to train with
+                sptm.gibbs.GibbsLda in <workers> processes, which ignores
+                prefix and optimize_interval
+
+        Raises:
+            Exception: Unknown backend
         """
+        if backend not in ('mallet', 'gibbs'):
+            raise Exception('Unknown backend, use mallet or gibbs')
         self.alpha = alpha
         self.workers = workers
         self.prefix = prefix
@@ -150,17 +813,195 @@ class Model:
         self.iterations = iterations
         self.topic_threshold = topic_threshold
         self.num_topics = num_topics
+        self.backend = backend
+
+    def set_telemetry(self, sinks=None):
+        """Report the progress of every training to sinks
+
+        Every 10 iterations, as Mallet prints its progress (or the gibbs
+        backend logs it), a record of the wall time per iteration,
+        tokens/sec, log likelihood per token, perplexity and resident memory
+        of the training processes is sent to every sink, see
+        sptm.telemetry.Telemetry.
+
+        Args:
+            sinks: List of sinks, e.g. sptm.telemetry.JsonLinesSink,
+                sptm.telemetry.PrometheusTextSink or functions taking the
+                record, None to stop reporting
+        """
+        self.telemetry = Telemetry(sinks) if sinks else None
+
+    def _corpus_mallet(self):
+        """Import the corpus to Mallet's format, once per fit
+
+        The imported corpus is kept next to the prefix (or in the temporary
+        directory) under a hash of the corpus and reused by every training,
+        of this model or of any other with the same corpus.
+
+        Returns:
+            Location of the imported corpus
+        """
+        if getattr(self, 'corpus_mallet', None) is not None and \
+                                        os.path.isfile(self.corpus_mallet):
+            return self.corpus_mallet
+
+        folder = os.path.dirname(self.prefix) if self.prefix else \
+                                                        tempfile.gettempdir()
+        path = os.path.join(folder or os.curdir, 'sptm_%s_corpus.mallet' % \
+                                        _mallet_key(self.corpus, self.id2word))
+        if os.path.isfile(path):
+            logging.info('reusing Mallet corpus %s', path)
+        else:
+            converter = Wrappers.LdaMallet(self.mallet_path, \
+                    id2word=self.id2word, prefix=tempfile.mkdtemp() + os.sep)
+            converter.convert_input(self.corpus)
+            # Appear at once to other processes converting the same corpus
+            os.replace(converter.fcorpusmallet(), path)
+            os.remove(converter.fcorpustxt())
+            os.rmdir(os.path.dirname(converter.prefix))
+        self.corpus_mallet = path
+        return path
+
+    def _prepare(self):
+        """Compute what every model of a sweep shares, before the sweep
+        pool inherits the model
+        """
+        _cooccurrence(self)
+        if self.backend == 'mallet':
+            self._corpus_mallet()
+
+    def _lda(self, num_topics, iterations, workers, prefix):
+        """Train a model with the backend and parameters set in
+        Model.params(), logging its throughput
+
+        Args:
+            num_topics: Number of topics
+            iterations: Number of iterations
+            workers: Number of Mallet threads / sampling processes
+            prefix: Prefix of the Mallet files
+
+        Returns:
+            Gensim Mallet LDA wrapper or sptm.gibbs.GibbsLda object
+        """
+        num_tokens = sum(c for doc in self.corpus for i, c in doc)
+        telemetry = getattr(self, 'telemetry', None)
+        if telemetry is not None:
+            telemetry.start(self.backend, num_topics, num_tokens)
+
+        start = time.time()
+        if self.backend == 'gibbs':
+            model = GibbsLda(self.corpus, num_topics=num_topics, \
+                alpha=self.alpha, id2word=self.id2word, \
+                iterations=iterations, workers=workers, \
+                topic_threshold=self.topic_threshold, telemetry=telemetry)
+        else:
+            model = _LdaMallet(self.mallet_path, \
+                corpus=self.corpus, num_topics=num_topics, \
+                alpha=self.alpha, id2word=self.id2word, \
+                workers=workers, prefix=prefix, \
+                optimize_interval=self.optimize_interval, \
+                iterations=iterations, \
+                topic_threshold=self.topic_threshold, \
+                corpus_mallet=self._corpus_mallet(), telemetry=telemetry)
+        elapsed = max(time.time() - start, 1e-9)
+
+        self.tokens_per_sec = num_tokens * iterations / elapsed
+        logging.info('%s backend: %d tokens x %d iterations in %.1fs, ' \
+            '%.0f tokens/sec', self.backend, num_tokens, iterations, \
+                                                elapsed, self.tokens_per_sec)
+        return model
 
     def train(self):
-        """Train LDA Mallet model using gensim's Mallet wrapper
+        """Train LDA model with the backend set in Model.params()
+
+        With Mallet, the corpus is imported to Mallet's format only by the
+        first training after fit.
         """
-        self.lda_model_mallet = Wrappers.LdaMallet(self.mallet_path, \
-            corpus=self.corpus, num_topics=self.num_topics, \
-            alpha=self.alpha, id2word=self.id2word, \
-            workers=self.workers, prefix=self.prefix, \
-            optimize_interval=self.optimize_interval, \
-            iterations=self.iterations, \
-            topic_threshold=self.topic_threshold)
+        self.lda_model_mallet = self._lda(self.num_topics, self.iterations, \
+                                                    self.workers, self.prefix)
+
+    def update(self, new_tokens, iterations=100, doctopics_path=None):
+        """Add newly arrived rows of tokens to the trained model
+
+        The dictionary grows with the new tokens and training resumes from
+        the topics the model holds instead of starting over: Mallet starts
+        from the state it saved (--input-state), the gibbs backend from its
+        sampler state, the tokens of the new rows from random topics. Every
+        token is then sampled <iterations> more times, a fraction of what
+        training from scratch takes.
+
+        The document_topic distribution of the new rows can be appended to
+        one saved earlier, e.g. <output_path>_doctopic of Model.save(), the
+        rows of the earlier documents being left as they were.
+
+        NOTE: Mallet needs the state file under the prefix of the model,
+        and the names of the earlier tokens must not change, which a hashed
+        vocabulary does not guarantee
+
+        Args:
+            new_tokens: tokens of the new rows, list of lists containing data
+                index number and tokens, or sptm.tokenstore.TokenStore
+            iterations: Number of iterations
+            doctopics_path: Location of a doctopics file to append the
+                document_topic distribution of the new rows to
+
+        Raises:
+            IOError: Mallet state not found / doctopics file not written
+            Exception: Not in specified structure / state does not match
+        """
+        texts = _new_texts(new_tokens)
+        first = len(self.corpus)
+        self.id2word.add_documents(texts)
+        corpus = [self.id2word.doc2bow(text) for text in texts]
+        _extend(self, texts, corpus)
+        self.corpus_mallet = None
+        old = self.lda_model_mallet
+        telemetry = getattr(self, 'telemetry', None)
+        if telemetry is not None:
+            telemetry.start('%s update' % ('gibbs' if isinstance(old, \
+                GibbsLda) else 'mallet'), old.num_topics, sum(c for doc in \
+                                        self.corpus for i, c in doc))
+
+        start = time.time()
+        if isinstance(old, GibbsLda):
+            old.update(corpus, iterations, 1 + max(self.id2word.keys()), \
+                                                                    telemetry)
+        else:
+            state = old.fstate()
+            if not os.path.isfile(state):
+                raise IOError('Mallet state of the model not found')
+            folder = tempfile.mkdtemp()
+            try:
+                # Random topics for the whole corpus, in Mallet's token order
+                fresh = _LdaMallet(self.mallet_path, corpus=self.corpus, \
+                    num_topics=old.num_topics, alpha=old.alpha, \
+                    id2word=self.id2word, workers=old.workers, \
+                    prefix=folder + os.sep, iterations=0, \
+                    corpus_mallet=self._corpus_mallet())
+                merged = os.path.join(folder, 'input_state.mallet.gz')
+                _merge_state(state, fresh.fstate(), merged)
+                self.lda_model_mallet = _LdaMallet(self.mallet_path, \
+                    corpus=self.corpus, num_topics=old.num_topics, \
+                    alpha=old.alpha, id2word=self.id2word, \
+                    workers=old.workers, prefix=old.prefix, \
+                    optimize_interval=old.optimize_interval, \
+                    iterations=iterations, \
+                    topic_threshold=old.topic_threshold, \
+                    corpus_mallet=self._corpus_mallet(), \
+                                input_state=merged, telemetry=telemetry)
+            finally:
+                rmtree(folder, ignore_errors=True)
+        elapsed = max(time.time() - start, 1e-9)
+        logging.info('updated with %d rows (%d in all) in %.1fs', \
+                                    len(corpus), first + len(corpus), elapsed)
+
+        if doctopics_path is None:
+            return
+        if isinstance(old, GibbsLda):
+            old.write_doctopics(doctopics_path, first)
+        else:
+            _append_doctopics(self.lda_model_mallet.fdoctopics(), \
+                                                    doctopics_path, first)
 
     def topics(self, num_topics=100, num_words=10):
         """Return top <num_words> words for the first <num_topics> topics
@@ -174,16 +1015,43 @@ class Model:
         """
         return self.lda_model_mallet.print_topics(num_topics, num_words)
 
-    def save(self, output_path):
+    def save(self, output_path, bundle=False):
         """Save the Mallet lDA model
 
-        Also, save the document_topic distribution, corpus and inferencer
+        Also, save the document_topic distribution, corpus and inferencer.
+        With the gibbs backend, only the document_topic distribution is
+        saved along the model, in Mallet's format.
+
+        With bundle, save instead a sptm.bundle.ModelBundle directory at
+        output_path: topic_word and document_topic matrices, dictionary and
+        parameters, which Model.load() opens without Mallet's files.
 
         Args:
-            output_path: Location with filename to save the LDA model
+            output_path: Location with filename to save the LDA model, or of
+                the bundle directory
+            bundle: Save a sptm.bundle.ModelBundle
         Raises:
             IOError: Error with output_path / File already exists
         """
+        if bundle:
+            model = self.lda_model_mallet
+            if isinstance(model, GibbsLda):
+                doc_topic = model.doc_topics()
+            else:
+                doc_topic = load_doctopics(model.fdoctopics(), \
+                                            model.num_topics, cache=False)
+            ModelBundle(model.get_topics(), doc_topic, model.id2word, \
+                _params(self, ('alpha', 'workers', 'prefix', \
+                    'optimize_interval', 'iterations', 'topic_threshold', \
+                    'num_topics', 'backend')), type(self).__name__ + '/' + \
+                                    type(model).__name__).save(output_path)
+            return
+
+        if isinstance(self.lda_model_mallet, GibbsLda):
+            self.lda_model_mallet.write_doctopics(output_path + "_doctopic")
+            self.lda_model_mallet.save(output_path)
+            return
+
         doctopic = self.lda_model_mallet.fdoctopics()
         inferencer = self.lda_model_mallet.finferencer()
         corpus = self.lda_model_mallet.fcorpusmallet()
@@ -204,59 +1072,75 @@ class Model:
         Returns:
             Float value
         """
-        coherence_model_lda = CoherenceModel(model=self.lda_model_mallet, \
-                texts=self.tokens, dictionary=self.id2word, \
-                coherence='c_v')
-        coherence_lda = coherence_model_lda.get_coherence()
-        return coherence_lda
+        return _cooccurrence(self).coherence(self.lda_model_mallet)
 
-    def optimum_topic(self, start=10, limit=100, step=11):
+    def _candidate(self, num_topics, iterations, workers):
+        """Train a model of a sweep and compute its c_v coherence
+
+        Args:
+            num_topics: Number of topics
+            iterations: Number of iterations to train for
+            workers: Number of Mallet threads / sampling processes
+
+        Returns:
+            Float value
+        """
+        # Candidates running at once must not share Mallet files
+        prefix = self.prefix and '%sk%d_' % (self.prefix, num_topics)
+        model = self._lda(num_topics, iterations, workers, prefix)
+        return _cooccurrence(self).coherence(model)
+
+    def optimum_topic(self, start=10, limit=100, step=11, processes=None, \
+                                                    halving=False, eta=3):
         """Compute c_v coherence for various number of topics
 
         if you want to change the parameters of the model while training,
         call Model.params() first as it uses the same parameters.
 
+        Up to <processes> models train at once, splitting the workers set
+        in Model.params() between them. With halving, candidates are first
+        trained for iterations // eta ** r iterations and only the best
+        1/eta of them are trained again on eta times more (successive
+        halving), so the c_v of the candidates stopped early comes from
+        shorter training.
+
         NOTE: You cannot compute the coherence score of a saved model.
 
         Args:
-            dictionary: Gensim dictionary
-            corpus: Gensim corpus
-            texts: List of input texts
-            limit: Max num of topics
+            start: Starting number of topics
+            limit: Limit number of topics
+            step: Step size
+            processes: Number of models trained at once, defaults to
+                workers
+            halving: Stop low coherence candidates early
+            eta: Fraction of candidates kept and growth of the iterations
+                every halving round, an integer
 
         Returns:
-            Dictionary of {num_topics, c_v}
+            List of dictionaries {num_topics, c_v, budget}, one per number
+            of topics, budget being the fraction of the iterations trained
+
+        Raises:
+            Exception: Fewer than eta iterations to halve
         """
-        coherence_values = []
-        model_list = []
-        for num_topics in range(start, limit, step):
-            model = Wrappers.LdaMallet(self.mallet_path, \
-                corpus=self.corpus, num_topics=num_topics, \
-                alpha=self.alpha, id2word=self.id2word, \
-                workers=self.workers, prefix=self.prefix, \
-                optimize_interval=self.optimize_interval, \
-                iterations=self.iterations, \
-                topic_threshold=self.topic_threshold)
-            model_list.append(model)
-            coherencemodel = CoherenceModel(model=model, \
-                texts=self.tokens, dictionary=self.id2word, \
-                coherence='c_v')
-            coherence_values.append(coherencemodel.get_coherence())
-        x = range(start, limit, step)
-        out = dict()
-        for m, cv in zip(x, coherence_values):
-            out["num_topics"] = m
-            out["c_v"] = round(cv, 4)
-        return out
+        return _sweep(self, range(start, limit, step), self.iterations, \
+                                    self.workers, processes, halving, eta)
 
     def load(self, saved_model):
         """Load a Mallet LDA model previously saved
 
+        A sptm.bundle.ModelBundle directory is opened memory-mapped and
+        stands in for the model: Model.topics() reads it, training related
+        methods need the model itself.
+
         Args:
-            saved_model: Location to saved model
+            saved_model: Location to saved model or bundle directory
         Raises:
             IOError: File already present or location does not exist
         """
+        if ModelBundle.is_bundle(saved_model):
+            self.lda_model_mallet = ModelBundle.load(saved_model)
+            return
         try:
             self.lda_model_mallet = utils.SaveLoad.load(saved_model)
         except IOError:
@@ -266,12 +1150,16 @@ class ModelVanilla:
     """Adjust, train and optimize LDA model
 
     This class is responsible for traning the Topic Model using Gensim's
-    LDA.
+    LDA, on one core (LdaModel), several (LdaMulticore) or several
+    processes and machines (sptm.distributed.LdaCluster).
 
     Attributes:
         tokens: List of lists containing data index number and tokens
+        store: sptm.tokenstore.TokenStore the tokens were read from, if any
         id2word: Dictionary of the Corpus
         corpus: Term Document frequency
+        cooccurrence: sptm.coherence.CooccurrenceCache of the tokens, built
+            by the first coherence computation after fit
         alpha = Model alpha hyperparameter
         workers = Number of workers spawned while training the model
         prefix = prefix
@@ -280,10 +1168,24 @@ class ModelVanilla:
         iterations = Number of iterations
         topic_threshold = topic threshold
         num_topics = Number of topics
+        backend = 'single', 'multicore' or 'cluster', how LDA is trained
+        workers = Number of local worker processes of the multicore and
+            cluster backends
+        hosts = List of (host, port) of the remote workers of the cluster
+            backend
+        authkey = Bytes shared with the remote workers
+        queue_depth = Number of chunks the multicore backend queues for its
+            workers, None for gensim's default
+        throughput = Dictionary of {backend: documents per second} of the
+            last training with each backend
+        telemetry = sptm.telemetry.Telemetry of the trainings, None for
+            none, see ModelVanilla.set_telemetry()
+        perplexity_docs = Number of documents the perplexity reported to
+            telemetry is estimated on
         lda_model = Gensim LDA object
     """
 
-    def __init__(self, tokens=None, input_path=None):
+    def __init__(self, tokens=None, input_path=None, stream=False):
         """Inits Model, tokenized data or input path to open saved tokenized
         data.
 
@@ -291,34 +1193,58 @@ class ModelVanilla:
         higher preference
 
         Args:
-            input_path: Location of saved preprocessed tokens file
-            tokens: tokens of preprocessed data
+            input_path: Location of saved preprocessed tokens file or of a
+                sptm.tokenstore.TokenStore directory
+            tokens: tokens of preprocessed data, list of lists or
+                sptm.tokenstore.TokenStore
+            stream: Read the tokens file from disk each time it is needed
+                instead of loading it in memory
 
         Raises:
             IOError: Tokens file not found or not in specified format
             Exception: Not in specified structure
         """
         self.tokens = []
+        self.store = None
 
         if (tokens is not None and input_path is None) or \
                             (tokens is not None and input_path is not None):
             # Use tokens list passed as an argument
-            print('Using tokens passed as argument')
-            try:
-                for i, val in enumerate(tokens):
-                    self.tokens.append(tokens[i][1:])
-            except:
-                raise Exception("Tokens list does not follow required " + \
-                                                                "structure")
+            logging.info('Using tokens passed as argument')
+            if isinstance(tokens, TokenStore):
+                # Compact tokens of a Corpus, no need to copy them
+                self.store = tokens
+                self.tokens = tokens.texts()
+            else:
+                try:
+                    for i, val in enumerate(tokens):
+                        self.tokens.append(tokens[i][1:])
+                except:
+                    raise Exception("Tokens list does not follow " + \
+                                                    "required structure")
+
+        elif tokens is None and input_path is not None and \
+                                            TokenStore.is_store(input_path):
+
+            # Memory-map the binary token store
+            logging.info('Opening token store')
+            self.store = TokenStore.load(input_path)
+            self.tokens = self.store.texts()
+
+        elif tokens is None and input_path is not None and stream:
+
+            # Read the saved tokens file lazily, every time it is needed
+            logging.info('Streaming tokens file')
+            self.tokens = _TokenFile(input_path)
 
         elif tokens is None and input_path is not None:
 
             # Read the saved tokens file
-            print('Opening tokens file')
+            logging.info('Opening tokens file')
             try:
                 with codecs.open(input_path, 'r', encoding='utf8') as F:
                     for row in F:
-                        token_in_row = row.split(",")
+                        token_in_row = row.rstrip('\n').split(",")
                         for i, val in enumerate(token_in_row):
                             token_in_row[i] = force_unicode(token_in_row[i])
                         self.tokens.append(token_in_row[1:])
@@ -328,31 +1254,68 @@ class ModelVanilla:
                 raise Exception("Tokens list does not follow required " + \
                                                                 "structure")
         elif tokens is None and input_path is None:
-            print("Assuming load model from saved file, use Model.load()")
+            logging.info("Assuming load model from saved file, use " + \
+                                                            "Model.load()")
         else:
-            print("Missing tokens data")
+            logging.info("Missing tokens data")
 
-    def fit(self):
+    def fit(self, weights=None, stream=False, corpus_path=None, \
+                no_below=None, no_above=None, keep_n=None, hash_buckets=None, \
+                                                        hash_top_n=100000):
         """Generate the id2word dictionary and term document frequency of
         the given tokens
 
         NOTE: Should be called only after making sure that the tokens
         have been properly read
 
+        With stream, the term document frequency is written to a Matrix
+        Market file and self.corpus reads it back from disk instead of
+        holding it in memory. Combine with stream=True in the constructor to
+        keep the tokens on disk too.
+
+        With hash_buckets, tokens are hashed to a fixed number of ids by a
+        sptm.hashing.HashedDictionary, keeping the memory of id2word
+        constant on unbounded corpora. Only the hash_top_n most frequent
+        tokens keep a readable name, the others show up as '#<id>' in
+        topics. Check self.id2word.collision_stats() to pick the number of
+        buckets.
+
+        Args:
+            weights: Number of copies each row of tokens stands for, e.g.
+                sptm.dedup.Deduplicator.weights. Term frequencies of a row
+                are multiplied by its weight, so the bag of words is the one
+                of the copies added up
+            stream: Serialize the corpus to disk and stream it from there
+            corpus_path: Location of the Matrix Market corpus file, a
+                temporary file if not given
+            no_below: Drop tokens found in less than no_below rows
+            no_above: Drop tokens found in more than no_above (fraction of
+                all rows) rows
+            keep_n: Keep only the keep_n most frequent tokens
+            hash_buckets: Number of ids of a hashed vocabulary, None for a
+                gensim Dictionary
+            hash_top_n: Number of frequent tokens the hashed vocabulary
+                remembers the name of, 0 for none
+
         Raises:
+            IOError: Corpus file could not be written
             Exception: self.tokens empty or not in required format
         """
         try:
-                # Create Dictionary
-                self.id2word = corpora.Dictionary(self.tokens)
-                # Term Document Frequency
-                self.corpus = \
-                        [self.id2word.doc2bow(text) for text in self.tokens]
-        except:
-            raise Exception('tokens not compatible')
+            self.id2word, self.corpus = _fit(self, weights, stream, \
+                                corpus_path, no_below, no_above, keep_n, \
+                                                    hash_buckets, hash_top_n)
+            # Co-occurrences of the previous id2word no longer apply
+            self.cooccurrence = None
+        except IOError:
+            raise IOError('Error writing corpus file')
+        except Exception as e:
+            raise Exception('tokens not compatible: %s' % e)
 
     def params(self, alpha='symmetric', num_topics=100, distributed=False, \
-                    chunksize=2000, passes=1, update_every=1, iterations=50):
+                    chunksize=2000, passes=1, update_every=1, iterations=50, \
+                    backend='single', workers=None, hosts=(), authkey=None, \
+                                                        queue_depth=None):
         """Model parameters
 
         NOTE: These are the same parameters used while traning models
@@ -378,7 +1341,35 @@ class ModelVanilla:
                 update. Set to 0 for batch learning, > 1 for online iterative
                 learning.
             iterations: Number of iterations
+            backend: 'single' to train with gensim's LdaModel, 'multicore'
+                to train with LdaMulticore, 'cluster' to train with a
+                sptm.distributed.LdaCluster. The multicore and cluster
+                backends do not support alpha='auto' nor distributed. The
+                multicore backend learns in batch mode if update_every is 0,
+                online otherwise, the cluster backend always in batch mode
+            workers: Number of local worker processes of the multicore
+                backend, defaults to the number of CPUs minus one, and of
+                the cluster backend, defaults to the number of CPUs
+            hosts: List of (host, port) of sptm.distributed.serve() workers
+                the cluster backend also shares the corpus with
+            authkey: Bytes shared with the remote workers, required if
+                there are hosts
+            queue_depth: Number of chunks of <chunksize> documents the
+                multicore backend queues for its workers, bounding the
+                memory held by chunks not yet trained on, defaults to
+                2 * workers as in gensim
+
+        Raises:
+            Exception: Unknown backend / option not supported by the backend
         """
+        if backend not in ('single', 'multicore', 'cluster'):
+            raise Exception('Unknown backend, use single, multicore or ' + \
+                                                                    'cluster')
+        if backend != 'single' and (distributed or alpha == 'auto'):
+            raise Exception('%s backend supports neither ' % backend + \
+                                            'distributed nor alpha=auto')
+        if queue_depth is not None and queue_depth < 1:
+            raise Exception('queue_depth must be at least 1')
         self.alpha = alpha
         self.num_topics = num_topics
         self.distributed = distributed
@@ -386,16 +1377,168 @@ class ModelVanilla:
         self.passes = passes
         self.update_every = update_every
         self.iterations = iterations
+        self.backend = backend
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+            if backend == 'multicore':
+                workers = max(1, workers - 1)
+        self.workers = workers
+        self.hosts = list(hosts)
+        self.authkey = authkey
+        self.queue_depth = queue_depth
 
-    def train(self):
-        """Train LDA model using gensim's LDA object
+    def set_telemetry(self, sinks=None, perplexity_docs=1000):
+        """Report the progress of every training to sinks
+
+        After every pass, a record of the wall time per pass, documents/sec,
+        per token likelihood bound and perplexity (estimated on the first
+        <perplexity_docs> documents) and resident memory of the training
+        processes is sent to every sink, see sptm.telemetry.Telemetry. The
+        multicore backend, which takes no gensim callbacks, only reports at
+        the end of the training.
+
+        Args:
+            sinks: List of sinks, e.g. sptm.telemetry.JsonLinesSink,
+                sptm.telemetry.PrometheusTextSink or functions taking the
+                record, None to stop reporting
+            perplexity_docs: Number of documents the perplexity is estimated
+                on, 0 for none
         """
-        self.lda_model = LdaModel(corpus=self.corpus, \
-                        num_topics=self.num_topics, alpha=self.alpha, \
+        self.telemetry = Telemetry(sinks) if sinks else None
+        self.perplexity_docs = perplexity_docs
+
+    def _lda(self, num_topics, passes, workers):
+        """Train a gensim LDA model with the backend and parameters set in
+        ModelVanilla.params(), logging its throughput
+
+        Args:
+            num_topics: Number of topics
+            passes: Number of passes through the corpus
+            workers: Number of local worker processes of the multicore and
+                cluster backends
+
+        Returns:
+            gensim LdaModel or LdaMulticore object
+        """
+        telemetry = getattr(self, 'telemetry', None)
+        callbacks = None
+        if telemetry is not None:
+            telemetry.start(self.backend, num_topics, \
+                                                num_docs=len(self.corpus))
+            sample = list(islice(self.corpus, self.perplexity_docs))
+            callbacks = [TelemetryMetric(telemetry, sample)]
+
+        start = time.time()
+        if self.backend == 'cluster':
+            model = LdaModel(num_topics=num_topics, alpha=self.alpha, \
+                        id2word=self.id2word, chunksize=self.chunksize, \
+                                                iterations=self.iterations)
+            cluster = LdaCluster(workers, self.hosts, self.authkey)
+            try:
+                cluster.scatter(self.corpus, self.chunksize)
+                cluster.train(model, passes, callbacks)
+            finally:
+                cluster.close()
+        elif self.backend == 'multicore':
+            model = _LdaMulticore(corpus=self.corpus, \
+                        num_topics=num_topics, alpha=self.alpha, \
+                        id2word=self.id2word, workers=workers, \
+                        chunksize=self.chunksize, passes=passes, \
+                        batch=(self.update_every == 0), \
+                        iterations=self.iterations, \
+                        queue_depth=getattr(self, 'queue_depth', None))
+            if callbacks:
+                # No callbacks in LdaMulticore, report the whole training
+                callbacks[0].passes = passes - 1
+                callbacks[0].get_value(model=model)
+        else:
+            model = LdaModel(corpus=self.corpus, \
+                        num_topics=num_topics, alpha=self.alpha, \
                         id2word=self.id2word, distributed=self.distributed, \
-                        chunksize=self.chunksize, passes=self.passes, \
+                        chunksize=self.chunksize, passes=passes, \
                         update_every=self.update_every, \
-                                                iterations=self.iterations)
+                        iterations=self.iterations, callbacks=callbacks)
+            # Sinks need not survive saving the model
+            model.callbacks = None
+        elapsed = max(time.time() - start, 1e-9)
+
+        if not hasattr(self, 'throughput'):
+            self.throughput = dict()
+        self.throughput[self.backend] = len(self.corpus) * passes / elapsed
+        logging.info('%s backend: %d documents x %d passes in %.1fs, ' \
+            '%.0f docs/sec (%s)', self.backend, len(self.corpus), passes, \
+            elapsed, self.throughput[self.backend], ', '.join('%s %.0f' % \
+                                        x for x in self.throughput.items()))
+        return model
+
+    def train(self):
+        """Train LDA model using gensim's LDA object of the backend set in
+        ModelVanilla.params()
+        """
+        self.lda_model = self._lda(self.num_topics, self.passes, self.workers)
+
+    def update(self, new_tokens, doctopics_path=None):
+        """Add newly arrived rows of tokens to the trained model
+
+        The dictionary grows with the new tokens, the model gets one column
+        per new token starting from its prior, and gensim's online update
+        trains it on the new rows only, with the passes set in
+        ModelVanilla.params(). The earlier rows are neither read nor
+        rewritten, the new rows of a streamed corpus being written to a
+        file of their own.
+
+        The document_topic distribution of the new rows can be appended to a
+        doctopics file in Mallet's format (document number, name,
+        proportions), the rows of the earlier documents being left as they
+        were.
+
+        Args:
+            new_tokens: tokens of the new rows, list of lists containing data
+                index number and tokens, or sptm.tokenstore.TokenStore
+            doctopics_path: Location of a doctopics file to append the
+                document_topic distribution of the new rows to
+
+        Raises:
+            IOError: doctopics file not written
+            Exception: Not in specified structure
+        """
+        texts = _new_texts(new_tokens)
+        first = len(self.corpus)
+        self.id2word.add_documents(texts)
+        corpus = [self.id2word.doc2bow(text) for text in texts]
+        _extend(self, texts, corpus)
+        _grow(self.lda_model, 1 + max(self.id2word.keys()))
+
+        telemetry = getattr(self, 'telemetry', None)
+        if telemetry is not None:
+            telemetry.start('%s update' % self.backend, \
+                            self.lda_model.num_topics, num_docs=len(corpus))
+            self.lda_model.callbacks = [TelemetryMetric(telemetry, \
+                                        corpus[:self.perplexity_docs])]
+
+        start = time.time()
+        try:
+            self.lda_model.update(corpus)
+        finally:
+            self.lda_model.callbacks = None
+        elapsed = max(time.time() - start, 1e-9)
+        logging.info('updated with %d rows (%d in all) in %.1fs', \
+                                    len(corpus), first + len(corpus), elapsed)
+
+        if doctopics_path is None:
+            return
+        num_topics = self.lda_model.num_topics
+        try:
+            with open(doctopics_path, 'a') as F:
+                for i, bow in enumerate(corpus):
+                    row = np.zeros(num_topics)
+                    for k, p in self.lda_model.get_document_topics(bow, \
+                                                    minimum_probability=0.0):
+                        row[k] = p
+                    F.write('%d\t%d\t%s\n' % (first + i, first + i, \
+                                    '\t'.join(repr(float(p)) for p in row)))
+        except (IOError, OSError):
+            raise IOError('Error with doctopics file')
 
     def topics(self, num_topics=100, num_words=10):
         """Return top <num_words> words for the first <num_topics> topics
@@ -409,15 +1552,38 @@ class ModelVanilla:
         """
         return self.lda_model.print_topics(num_topics, num_words)
 
-    def save(self, output_path):
+    def save(self, output_path, bundle=False):
         """Save the lDA model
 
+        With bundle, save instead a sptm.bundle.ModelBundle directory at
+        output_path: topic_word and document_topic matrices (inferred for
+        the documents of the corpus), dictionary and parameters, which
+        ModelVanilla.load() opens memory-mapped.
+
         Args:
-            output_path: Location with filename to save the LDA model
+            output_path: Location with filename to save the LDA model, or of
+                the bundle directory
+            bundle: Save a sptm.bundle.ModelBundle
         Raises:
             IOError: Error with output_path / File already exists
         """
-        self.lda_model.save(output_path)
+        if not bundle:
+            self.lda_model.save(output_path)
+            return
+
+        model = self.lda_model
+        parts = [np.zeros((0, model.num_topics), dtype=np.float32)]
+        for chunk in utils.grouper(getattr(self, 'corpus', None) or [], \
+                                                        model.chunksize):
+            gamma = model.inference(chunk)[0]
+            parts.append((gamma / gamma.sum(axis=1)[:, None]).astype( \
+                                                                np.float32))
+        ModelBundle(model.get_topics(), np.concatenate(parts), \
+            model.id2word, _params(self, ('alpha', 'num_topics', \
+                'distributed', 'chunksize', 'passes', 'update_every', \
+                'iterations', 'backend', 'workers', 'queue_depth')), \
+                                                    type(self).__name__ + \
+                        '/' + type(model).__name__).save(output_path)
 
     def get_coherence(self):
         """Compute Coherence Score of the model
@@ -427,57 +1593,84 @@ class ModelVanilla:
         Returns:
             Float value
         """
-        coherence_model_lda = CoherenceModel(model=self.lda_model, \
-                texts=self.tokens, dictionary=self.id2word, \
-                coherence='c_v')
-        coherence_lda = coherence_model_lda.get_coherence()
-        return coherence_lda
+        return _cooccurrence(self).coherence(self.lda_model)
+
+    def _prepare(self):
+        """Compute what every model of a sweep shares, before the sweep
+        pool inherits the model
+        """
+        _cooccurrence(self)
+
+    def _candidate(self, num_topics, passes, workers):
+        """Train a model of a sweep and compute its c_v coherence
+
+        Args:
+            num_topics: Number of topics
+            passes: Number of passes to train for
+            workers: Number of local worker processes of the multicore and
+                cluster backends
+
+        Returns:
+            Float value
+        """
+        model = self._lda(num_topics, passes, workers)
+        return _cooccurrence(self).coherence(model)
 
-    def optimum_topic(self, start=10, limit=100, step=11):
+    def optimum_topic(self, start=10, limit=100, step=11, processes=None, \
+                                                    halving=False, eta=3):
         """Compute c_v coherence for various number of topics
 
         if you want to change the parameters of the model while training,
         call Model.params() first as it uses the same parameters.
 
+        Up to <processes> models train at once. The multicore and cluster
+        backends train one model at a time, with all their workers, since
+        worker processes cannot be started from a sweep process. With halving,
+        candidates are first trained for passes // eta ** r passes and only
+        the best 1/eta of them are trained again on eta times more
+        (successive halving). It needs ModelVanilla.params() to set at least
+        eta passes.
+
         NOTE: You cannot compute the coherence score of a saved model.
 
         Args:
             start: Starting number of topics
             limit: Limit number of topics
             step: Step size
+            processes: Number of models trained at once, defaults to the
+                number of CPUs
+            halving: Stop low coherence candidates early
+            eta: Fraction of candidates kept and growth of the passes every
+                halving round, an integer
 
         Returns:
-            Dictionary of {num_topics, c_v}
+            List of dictionaries {num_topics, c_v, budget}, one per number
+            of topics, budget being the fraction of the passes trained
+
+        Raises:
+            Exception: Fewer than eta passes to halve
         """
-        coherence_values = []
-        model_list = []
-        for num_topics in range(start, limit, step):
-            model = LdaModel(corpus=self.corpus, \
-                        num_topics=self.num_topics, alpha=self.alpha, \
-                        id2word=self.id2word, distributed=self.distributed, \
-                        chunksize=self.chunksize, passes=self.passes, \
-                        update_every=self.update_every, \
-                                                iterations=self.iterations)
-            model_list.append(model)
-            coherencemodel = CoherenceModel(model=model, \
-                texts=self.tokens, dictionary=self.id2word, \
-                coherence='c_v')
-            coherence_values.append(coherencemodel.get_coherence())
-        x = range(start, limit, step)
-        out = dict()
-        for m, cv in zip(x, coherence_values):
-            out["num_topics"] = m
-            out["c_v"] = round(cv, 4)
-        return out
+        if self.backend != 'single':
+            return _sweep(self, range(start, limit, step), self.passes, \
+                                        self.workers, 1, halving, eta)
+        return _sweep(self, range(start, limit, step), self.passes, \
+                multiprocessing.cpu_count(), processes, halving, eta)
 
     def load(self, saved_model):
         """Load a LDA model previously saved
 
+        A sptm.bundle.ModelBundle directory is opened memory-mapped and
+        stands in for the model: ModelVanilla.topics() reads it, training
+        related methods need the model itself.
+
         Args:
-            saved_model: Location to saved model
+            saved_model: Location to saved model or bundle directory
         Raises:
             IOError: File already present or location does not exist
         """
+        if ModelBundle.is_bundle(saved_model):
+            self.lda_model = ModelBundle.load(saved_model)
+            return
         try:
             self.lda_model = utils.SaveLoad.load(saved_model)
         except IOError:
@@ -77,7 +77,7 @@ class TopicDistanceMap:
         dists = []
 
         for d in self.matrix:
-            dists.append(map(float, d[1:]))
+            dists.append(list(map(float, d[1:])))
             if len(self.labels) == 0:
                 self.labels.append(d[0])
 
@@ -7,13 +7,21 @@
 #######################################
 
 import re
-import logging
+import os
 import io
+import json
+import mmap
+import logging
+import multiprocessing
+import itertools
+import collections
+import time
 
-import spacy
+import numpy as np
 import gensim
 
 from sptm.utils import force_unicode
+from sptm.tokenstore import TokenStore, SentenceStore
 
 __author__ = "Rochan Avlur Venkat"
 __credits__ = ["Anupam Mediratta"]
@@ -27,9 +35,137 @@ __email__ = "rochan170543@mechyd.ac.in"
 # Setup logging for gensim
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', \
                                                             level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Spacy pipeline components disabled for each profile. 'filter' keeps only
+# what tokenize_custom() reads: tags/POS, dependency labels and lemmas
+NLP_PROFILES = {
+    'full': (),
+    'filter': ('ner', 'textcat', 'entity_ruler', 'entity_linker', 'senter'),
+}
+
+# Spacy models loaded so far, keyed by (model, profile)
+_NLP = {}
+
+# Number of sentences looked up in a TokenCache at a time
+CACHE_BLOCK = 50000
+
+def load_nlp(model='en_core_web_sm', profile='filter'):
+    """Load a spacy model, only the first time it is asked for
+
+    Args:
+        model: Name or path of the spacy model
+        profile: Key of NLP_PROFILES, pipeline components to disable
+
+    Returns:
+        spacy Language object
+
+    Raises:
+        Exception: Unknown profile
+    """
+    if profile not in NLP_PROFILES:
+        raise Exception('Unknown spacy profile, use one of ' + \
+                                            ', '.join(sorted(NLP_PROFILES)))
+    key = (model, profile)
+    if key not in _NLP:
+        import spacy
+        start = time.time()
+        _NLP[key] = spacy.load(model, disable=list(NLP_PROFILES[profile]))
+        logger.info('loaded spacy model %s (%s: %s) in %.2fs', model, \
+                profile, ', '.join(_NLP[key].pipe_names), time.time() - start)
+    return _NLP[key]
+
+class TokenFilter:
+    """Filter out grammar tokens of a spacy Doc and lemmatize the rest
+
+    Instead of comparing string attributes token by token, the stop word
+    flag, POS, tag, dependency label and length of every token in the Doc
+    are pulled out as integer arrays (Doc.to_array) and the keep-mask is
+    computed with numpy against the ids of the excluded values.
+
+    A token is kept if it is not a stop word, its POS, tag and dependency
+    label are not excluded and its length is not min_len.
+
+    Attributes:
+        min_len: Length of tokens to drop
+        exclude_pos: POS values to drop
+        exclude_tag: Fine grained tag values to drop
+        exclude_dep: Dependency labels to drop
+    """
+
+    def __init__(self, min_len=1, exclude_pos=('SYM', 'NUM'), \
+                exclude_tag=('PRP', 'PRP$'), \
+                                exclude_dep=('aux', 'prep', 'det', 'cc')):
+        """Inits TokenFilter with the length and values to exclude
+
+        Args:
+            min_len: Length of tokens to drop
+            exclude_pos: POS values to drop
+            exclude_tag: Fine grained tag values to drop
+            exclude_dep: Dependency labels to drop
+        """
+        self.min_len = min_len
+        self.exclude_pos = tuple(exclude_pos)
+        self.exclude_tag = tuple(exclude_tag)
+        self.exclude_dep = tuple(exclude_dep)
+        self._ids = None
+
+    def signature(self):
+        """Describe the filter configuration
+
+        Returns:
+            String, equal for filters that keep the same tokens
+        """
+        return u'min_len=%d;pos=%s;tag=%s;dep=%s' % (self.min_len, \
+            ','.join(sorted(self.exclude_pos)), \
+            ','.join(sorted(self.exclude_tag)), \
+                                        ','.join(sorted(self.exclude_dep)))
 
-# Setup spacy model for custom preprocessing of data used in tokenize_custom()
-NLP = spacy.load('en_core_web_sm')
+    def _excluded_ids(self, strings):
+        """Look up the ids of the excluded values once
+
+        Args:
+            strings: spacy StringStore of the Docs being filtered
+
+        Returns:
+            Tuple of numpy arrays of POS, tag and dependency ids
+        """
+        if self._ids is None:
+            self._ids = tuple(np.array([strings.add(v) for v in values], \
+                                                            dtype=np.uint64) \
+                for values in (self.exclude_pos, self.exclude_tag, \
+                                                            self.exclude_dep))
+        return self._ids
+
+    def mask(self, doc):
+        """Compute which tokens of a Doc to keep
+
+        Args:
+            doc: spacy Doc
+
+        Returns:
+            numpy boolean array, one value per token
+        """
+        from spacy.attrs import IS_STOP, POS, TAG, DEP, LENGTH
+
+        pos_ids, tag_ids, dep_ids = self._excluded_ids(doc.vocab.strings)
+        attrs = doc.to_array([IS_STOP, POS, TAG, DEP, LENGTH]).reshape(-1, 5)
+        return (attrs[:, 0] == 0) & \
+                ~np.isin(attrs[:, 1], pos_ids) & \
+                ~np.isin(attrs[:, 2], tag_ids) & \
+                ~np.isin(attrs[:, 3], dep_ids) & \
+                (attrs[:, 4] != self.min_len)
+
+    def __call__(self, doc):
+        """Filter a Doc
+
+        Args:
+            doc: spacy Doc
+
+        Returns:
+            List of lemmas of the tokens kept
+        """
+        return [doc[i].lemma_ for i in np.flatnonzero(self.mask(doc))]
 
 class Corpus:
     """Corpus object to handle all pre-processing of data
@@ -45,13 +181,18 @@ class Corpus:
         path: path to the data file
         raw_review: data read from the file in a list
         sentences: list of lists containing data number and
-            sentence
+            sentence (sptm.tokenstore.SentenceStore if compact)
         tokens: list of lists of data index number followed by tokenized
-            sentence
+            sentence (sptm.tokenstore.TokenStore if compact)
+        sentences_per_sec: throughput of the last tokenize_custom() run
+        nlp_model: spacy model used by tokenize_custom()
+        nlp_profile: spacy pipeline profile used by tokenize_custom(), see
+            NLP_PROFILES
     """
 
     def __init__(self, path=None, raw_review=None, sentences=None,\
-                                                                tokens=None):
+                tokens=None, nlp_model='en_core_web_sm', \
+                                    nlp_profile='filter', compact=False):
         """Inits Corpus with path, raw_review, sentences and tokens if passed
 
         One can directly pass semi processed data at different stages and use
@@ -63,11 +204,23 @@ class Corpus:
             sentences: list of lists containing data index number and sentences
             tokens: list of lists of data index number followed by tokenized
                 sentence
+            nlp_model: spacy model to use, loaded on first use
+            nlp_profile: 'filter' to disable the spacy components
+                tokenize_custom() does not need, 'full' to run all of them
+            compact: Keep sentences and tokens in array backed
+                sptm.tokenstore.SentenceStore / TokenStore objects instead of
+                lists of lists, unless passed
         """
         self.path = path
         self.raw_review = raw_review if (raw_review is not None) else []
-        self.sentences = sentences if (sentences is not None) else []
-        self.tokens = tokens if (tokens is not None) else []
+        if sentences is None:
+            sentences = SentenceStore() if compact else []
+        if tokens is None:
+            tokens = TokenStore() if compact else []
+        self.sentences = sentences
+        self.tokens = tokens
+        self.nlp_model = nlp_model
+        self.nlp_profile = nlp_profile
 
     def read_reviews(self, delimiter='\t', reg=r"(\\u[0-z][0-z][0-z])\w",\
                                                                     rep=" "):
@@ -78,6 +231,28 @@ class Corpus:
             reg: Custom regex to filter
             rep: String to replace the regex values
 
+        Raises:
+            IOError: file not found
+            Exception: Data format in the file opened does not follow the
+                specified template style
+        """
+        self.raw_review = list(self.iter_reviews(delimiter, reg, rep))
+
+    def iter_reviews(self, delimiter='\t', reg=r"(\\u[0-z][0-z][0-z])\w",\
+                                                                    rep=" "):
+        """Lazily read reviews one line at a time
+
+        Same as read_reviews() but yields the data of every line instead of
+        storing the whole file in self.raw_review.
+
+        Args:
+            delimiter: The seperator between data
+            reg: Custom regex to filter
+            rep: String to replace the regex values
+
+        Yields:
+            Data (last column) of each line in the file
+
         Raises:
             IOError: file not found
             Exception: Data format in the file opened does not follow the
@@ -86,20 +261,13 @@ class Corpus:
 
         # Open the data file
         try:
-            with io.open(self.path, 'rb') as raw:
-                self.raw_review = [x.strip().split(delimiter) for x in raw]
+            raw = io.open(self.path, 'rb')
         except IOError:
             raise IOError('File not found')
 
-        try:
-            # Select data only
-            for i, val in enumerate(self.raw_review):
-                # Take the last column values
-                self.raw_review[i] = self.raw_review[i][-1]
-                # Run regex
-                self.raw_review[i] = re.sub(reg, rep, self.raw_review[i])
-        except:
-            raise Exception('Data format in the file does not follow template')
+        with raw:
+            for line in raw:
+                yield _select_data(line, delimiter, reg, rep)
 
     def split_sentence(self, min_len=2):
         """Split each data index into its individual sentences
@@ -109,17 +277,29 @@ class Corpus:
         Args:
             min_len: Minimum length of a sentence above which to include
         """
+        self.sentences.extend(self.iter_sentences(self.raw_review, min_len))
+
+    def iter_sentences(self, reviews, min_len=2, start=0):
+        """Lazily split reviews into their individual sentences
+
+        Args:
+            reviews: Iterable of data values
+            min_len: Minimum length of a sentence above which to include
+            start: Data index number of the first review in reviews
+
+        Yields:
+            Lists containing data index number and sentence
+        """
 
         # Iterate over every unique data value
-        for i, val in enumerate(self.raw_review):
+        for i, val in enumerate(reviews, start):
             # Split the sentences
-            sentence = self.raw_review[i].split('.')
+            sentence = val.split('.')
 
-            # Append the other sentences to the end of the self.sentences
             for j, v in enumerate(sentence):
                 # Make sure the sentence has more than <min_len> words
                 if len(sentence[j]) > min_len:
-                    self.sentences.append([i, sentence[j]])
+                    yield [i, sentence[j]]
 
     def tokenize_simple(self, deacc=False, min_len=2, max_len=15):
         """Processes sentences
@@ -131,36 +311,104 @@ class Corpus:
             min_len: Minimal length of token in result
             max_len: Maximum length of token in result
         """
+        self.tokens.extend(self.iter_tokens_simple(self.sentences, deacc, \
+                                                            min_len, max_len))
+
+    def iter_tokens_simple(self, sentences, deacc=False, min_len=2, \
+                                                                max_len=15):
+        """Lazily tokenize sentences, see tokenize_simple()
+
+        Args:
+            sentences: Iterable of lists containing data index number and
+                sentence
+            deacc: Remove accentuation
+            min_len: Minimal length of token in result
+            max_len: Maximum length of token in result
+
+        Yields:
+            Lists of data index number followed by tokenized sentence, as
+            the custom tokenizer
+        """
 
         # Simple tokens, de-accent and lowercase processor
-        for i, val in enumerate(self.sentences):
-            self.tokens.append([self.sentences[i][0], \
-            gensim.utils.simple_preprocess(self.sentences[i][1], deacc, \
-                                                            min_len, max_len)])
+        for sentence in sentences:
+            yield [str(sentence[0])] + gensim.utils.simple_preprocess( \
+                                        sentence[1], deacc, min_len, max_len)
 
-    def tokenize_custom(self, min_len=1):
+    def tokenize_custom(self, min_len=1, batch_size=1000, n_process=1, \
+                                            token_filter=None, cache=None):
         """Processes sentences
 
         Tokenize, ignore tokens that are too small, lemmatize, filter out
         grammar {stop words, symbols, prepositions, numbers etc}
 
+        Sentences are sent through spacy in batches of <batch_size> using
+        <n_process> processes. The order of self.tokens is not affected by
+        either value.
+
         Args:
             min_len: Minimum length of tokens
+            batch_size: Number of sentences spacy processes at a time
+            n_process: Number of processes spacy uses, -1 for all CPUs
+            token_filter: TokenFilter to use instead of the default one built
+                from min_len
+            cache: sptm.cache.TokenCache, sentences found in it are not sent
+                through spacy and the rest are added to it
         """
+        self.tokens.extend(self.iter_tokens_custom(self.sentences, min_len, \
+                                batch_size, n_process, token_filter, cache))
+
+    def iter_tokens_custom(self, sentences, min_len=1, batch_size=1000, \
+                                n_process=1, token_filter=None, cache=None):
+        """Lazily tokenize sentences, see tokenize_custom()
+
+        Throughput in sentences/sec is logged once sentences is exhausted and
+        stored in self.sentences_per_sec.
+
+        Args:
+            sentences: Iterable of lists containing data index number and
+                sentence
+            min_len: Minimum length of tokens
+            batch_size: Number of sentences spacy processes at a time
+            n_process: Number of processes spacy uses, -1 for all CPUs
+            token_filter: TokenFilter to use instead of the default one built
+                from min_len
+            cache: sptm.cache.TokenCache, sentences found in it are not sent
+                through spacy and the rest are added to it
+
+        Yields:
+            Lists of data index number followed by tokenized sentence
+        """
+        if token_filter is None:
+            token_filter = TokenFilter(min_len=min_len)
+
+        nlp = load_nlp(self.nlp_model, self.nlp_profile)
+        if cache is None:
+            texts = ((force_unicode(s[1]), s[0]) for s in sentences)
+            docs = nlp.pipe(texts, as_tuples=True, batch_size=batch_size, \
+                                                        n_process=n_process)
+            lemmas = ((index, token_filter(doc)) for doc, index in docs)
+        else:
+            lemmas = _iter_cached(nlp, sentences, token_filter, cache, \
+                                                        batch_size, n_process)
 
         # POS Tagging and filtering sentences
-        for i, val in enumerate(self.sentences):
-            doc = NLP(force_unicode(self.sentences[i][1]))
-            to = [unicode(self.sentences[i][0])]
-            for tok in doc:
-                if tok.is_stop != True and tok.pos_ != 'SYM' and \
-                    tok.tag_ != 'PRP' and tok.tag_ != 'PRP$' and \
-                    tok.pos_ != 'NUM' and tok.dep_ != 'aux' and \
-                    tok.dep_ != 'prep' and tok.dep_ != 'det' and \
-                    tok.dep_ != 'cc' and len(tok) != min_len:
-                    to.append(tok.lemma_)
+        count = 0
+        start = time.time()
+        for index, lemma in lemmas:
+            count += 1
+            to = [str(index)] + lemma
             if len(to) > 1:
-                self.tokens.append(to)
+                yield to
+
+        elapsed = time.time() - start
+        self.sentences_per_sec = count / elapsed if elapsed > 0 else 0.0
+        logger.info('tokenized %d sentences in %.2fs (%.1f sentences/sec, ' \
+            'batch_size=%d, n_process=%d)', count, elapsed, \
+                            self.sentences_per_sec, batch_size, n_process)
+        if cache is not None:
+            logger.info('token cache: %d hits, %d misses', cache.hits, \
+                                                                cache.misses)
 
     def write_processed(self, name):
         """Save to file
@@ -179,9 +427,497 @@ class Corpus:
         try:
             # Write the preprocessed reviews to file
             with io.open(name, "a", encoding='utf8') as outfile:
-                for i, val in enumerate(self.tokens):
-                    outfile.write(unicode(','.join(self.tokens[i]) + "\n"))
+                _write_rows(outfile, self.tokens)
         except IOError:
             raise IOError('Path does not exist')
         except Exception:
             raise Exception('Error while saving file, check self.tokens value')
+
+    def write_binary(self, name):
+        """Save to a binary token store
+
+        Alternative to write_processed(), see sptm.tokenstore.TokenStore.
+        Unlike write_processed(), an existing store is overwritten.
+
+        Args:
+            name: Directory to save the store in
+
+        Raises:
+            IOError: Path does not exist
+            Exception: self.tokens structure not supported, manually check its
+                value
+        """
+        if isinstance(self.tokens, TokenStore):
+            self.tokens.save(name)
+        else:
+            TokenStore.from_rows(self.tokens).save(name)
+
+    def process_stream(self, name, chunk_size=10000, tokenizer='custom', \
+                    delimiter='\t', reg=r"(\\u[0-z][0-z][0-z])\w", rep=" ", \
+                    sentence_min_len=2, token_min_len=1, batch_size=1000, \
+                                n_process=1, token_filter=None, cache=None, \
+                                                            checkpoint=None):
+        """Read, split, tokenize and save the data file in a streaming fashion
+
+        Equivalent to calling read_reviews(), split_sentence(),
+        tokenize_custom() (or tokenize_simple()) and write_processed() one
+        after the other, except that only <chunk_size> tokenized sentences
+        (plus the spacy batch in flight) are held in memory at any point.
+        self.raw_review, self.sentences and self.tokens are left untouched.
+
+        With a checkpoint file, progress is committed after every chunk: the
+        tokens file is synced and the input offset, tokens file size and next
+        data index number of the last review fully written are saved. A run
+        with the same checkpoint file truncates the tokens file back to the
+        last commit and carries on from there, so a crashed run resumes
+        without duplicate rows. Once the whole data file is processed the
+        checkpoint is kept, a later run only processes the reviews appended
+        to the data file since.
+
+        Args:
+            name: Name of file to append the tokens to
+            chunk_size: Number of tokenized sentences to buffer before
+                writing them out
+            tokenizer: 'custom' or 'simple', tokenize method to use
+            delimiter: The seperator between data
+            reg: Custom regex to filter
+            rep: String to replace the regex values
+            sentence_min_len: Minimum length of a sentence above which to
+                include
+            token_min_len: Minimum length of tokens
+            batch_size: Number of sentences spacy processes at a time
+            n_process: Number of processes spacy uses, -1 for all CPUs
+            token_filter: TokenFilter to use with the custom tokenizer instead
+                of the default one built from token_min_len
+            cache: sptm.cache.TokenCache to use with the custom tokenizer
+            checkpoint: Location of a checkpoint file to commit progress to
+                and resume from
+
+        Returns:
+            Number of tokenized sentences written
+
+        Raises:
+            IOError: Data file not found / Path does not exist
+            Exception: Data format in the file opened does not follow the
+                specified template style
+        """
+        if checkpoint is None:
+            reviews = self.iter_reviews(delimiter, reg, rep)
+            tokens = self._iter_pipeline(reviews, tokenizer, \
+                            sentence_min_len, token_min_len, batch_size, \
+                                            n_process, token_filter, cache)
+            return _write_chunks(name, tokens, chunk_size)
+
+        state = {'input_offset': 0, 'output_offset': None, 'next_index': 0}
+        if os.path.isfile(checkpoint):
+            with io.open(checkpoint, 'r', encoding='utf8') as F:
+                state = json.load(F)
+            logger.info('resuming %s from byte %d, data index %d', \
+                        self.path, state['input_offset'], state['next_index'])
+
+        # Reviews read but not fully written yet, as (index, end offset)
+        pending = collections.deque()
+
+        def reviews():
+            offset = state['input_offset']
+            try:
+                raw = io.open(self.path, 'rb')
+            except IOError:
+                raise IOError('File not found')
+            with raw:
+                raw.seek(offset)
+                for i, line in enumerate(raw, state['next_index']):
+                    offset += len(line)
+                    pending.append((i, offset))
+                    yield _select_data(line, delimiter, reg, rep)
+
+        sentences = self.iter_sentences(reviews(), sentence_min_len, \
+                                                        state['next_index'])
+        tokens = self._iter_tokens(sentences, tokenizer, token_min_len, \
+                                batch_size, n_process, token_filter, cache)
+
+        try:
+            outfile = io.open(name, 'ab')
+        except IOError:
+            raise IOError('Path does not exist')
+
+        count = 0
+        with outfile:
+            # Drop whatever was written after the last commit
+            if state['output_offset'] is None:
+                state['output_offset'] = outfile.seek(0, os.SEEK_END)
+            outfile.truncate(state['output_offset'])
+            outfile.seek(state['output_offset'])
+            size = state['output_offset']
+            current, current_start = None, size
+
+            while True:
+                chunk = list(itertools.islice(tokens, chunk_size))
+                for row in chunk:
+                    if row[0] != current:
+                        current, current_start = row[0], size
+                    line = force_unicode(','.join(row) + "\n").encode('utf8')
+                    outfile.write(line)
+                    size += len(line)
+                count += len(chunk)
+
+                if chunk:
+                    # Reviews before the one being written are complete
+                    done = int(current) - 1
+                    output_offset = current_start
+                else:
+                    done = pending[-1][0] if pending else None
+                    output_offset = size
+                while pending and pending[0][0] <= done:
+                    index, offset = pending.popleft()
+                    state['input_offset'] = offset
+                    state['next_index'] = index + 1
+                state['output_offset'] = output_offset
+                outfile.flush()
+                os.fsync(outfile.fileno())
+                _save_checkpoint(checkpoint, state)
+
+                if not chunk:
+                    break
+        return count
+
+    def process_parallel(self, name, processes=None, shards=None, \
+                    tokenizer='custom', delimiter='\t', \
+                    reg=r"(\\u[0-z][0-z][0-z])\w", rep=" ", \
+                    sentence_min_len=2, token_min_len=1, batch_size=1000, \
+                                        token_filter=None, chunk_size=10000):
+        """Read, split, tokenize and save the data file using a process pool
+
+        The data file is memory-mapped and cut into <shards> byte ranges
+        aligned on line ends. Every shard goes through the same pipeline as
+        process_stream() in its own worker process and is written to its own
+        file (<name>.shard-<number>). The shard files are then appended to
+        <name> in file order, shifting data index numbers so they are the
+        same as with process_stream().
+
+        Args:
+            name: Name of file to append the tokens to
+            processes: Number of worker processes, defaults to the number of
+                CPUs
+            shards: Number of byte ranges, defaults to processes
+            tokenizer: 'custom' or 'simple', tokenize method to use
+            delimiter: The seperator between data
+            reg: Custom regex to filter
+            rep: String to replace the regex values
+            sentence_min_len: Minimum length of a sentence above which to
+                include
+            token_min_len: Minimum length of tokens
+            batch_size: Number of sentences spacy processes at a time
+            token_filter: TokenFilter to use with the custom tokenizer instead
+                of the default one built from token_min_len
+            chunk_size: Number of tokenized sentences to buffer before
+                writing them out
+
+        Returns:
+            Number of tokenized sentences written
+
+        Raises:
+            IOError: Data file not found / Path does not exist
+            Exception: Data format in the file opened does not follow the
+                specified template style
+        """
+        if tokenizer not in ('custom', 'simple'):
+            raise Exception('Unknown tokenizer, use custom or simple')
+        processes = processes or multiprocessing.cpu_count()
+        shards = shards or processes
+
+        try:
+            with io.open(self.path, 'rb') as raw:
+                size = os.fstat(raw.fileno()).st_size
+                if size == 0:
+                    return 0
+                mm = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    bounds = [0]
+                    for k in range(1, shards):
+                        end = mm.find(b'\n', max(k * size // shards - 1, \
+                                                                bounds[-1]))
+                        end = size if end == -1 else end + 1
+                        if end > bounds[-1] and end < size:
+                            bounds.append(end)
+                    bounds.append(size)
+                finally:
+                    mm.close()
+        except IOError:
+            raise IOError('File not found')
+
+        worker = Corpus(self.path, nlp_model=self.nlp_model, \
+                                                nlp_profile=self.nlp_profile)
+        jobs = [(worker, '%s.shard-%05d' % (name, k), start, end, \
+                tokenizer, delimiter, reg, rep, sentence_min_len, \
+                token_min_len, batch_size, token_filter, chunk_size) \
+                    for k, (start, end) in enumerate(zip(bounds[:-1], \
+                                                                bounds[1:]))]
+        logger.info('processing %s in %d shards with %d processes', \
+                                            self.path, len(jobs), processes)
+
+        # Rows written before, kept if the merge fails half way
+        try:
+            written = os.path.getsize(name)
+        except OSError:
+            written = None
+
+        try:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_process_shard, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+            # Merge the shards in file order, shifting the data index
+            # numbers. Sentences without tokens are rows of an index only
+            count = 0
+            offset = 0
+            try:
+                with io.open(name, "a", encoding='utf8') as outfile:
+                    for shard, num_reviews, num_rows in results:
+                        with io.open(shard, 'r', encoding='utf8') as F:
+                            for line in F:
+                                index, comma, rest = \
+                                            line.rstrip('\n').partition(',')
+                                outfile.write(u'%d%s%s\n' % (int(index) + \
+                                                    offset, comma, rest))
+                        offset += num_reviews
+                        count += num_rows
+            except Exception:
+                if written is None:
+                    _remove(name)
+                else:
+                    with io.open(name, 'ab') as outfile:
+                        outfile.truncate(written)
+                raise
+        except IOError:
+            raise IOError('Path does not exist')
+        finally:
+            for job in jobs:
+                _remove(job[1])
+        return count
+
+    def _iter_pipeline(self, reviews, tokenizer, sentence_min_len, \
+            token_min_len, batch_size, n_process, token_filter, cache):
+        """Chain iter_sentences() and the chosen tokenizer over reviews
+
+        Args:
+            reviews: Iterable of data values
+            tokenizer: 'custom' or 'simple', tokenize method to use
+            sentence_min_len: Minimum length of a sentence above which to
+                include
+            token_min_len: Minimum length of tokens
+            batch_size: Number of sentences spacy processes at a time
+            n_process: Number of processes spacy uses, -1 for all CPUs
+            token_filter: TokenFilter to use with the custom tokenizer
+            cache: sptm.cache.TokenCache to use with the custom tokenizer
+
+        Returns:
+            Generator of lists of data index number followed by tokenized
+            sentence
+
+        Raises:
+            Exception: Unknown tokenizer
+        """
+        sentences = self.iter_sentences(reviews, sentence_min_len)
+        return self._iter_tokens(sentences, tokenizer, token_min_len, \
+                                batch_size, n_process, token_filter, cache)
+
+    def _iter_tokens(self, sentences, tokenizer, token_min_len, batch_size, \
+                                            n_process, token_filter, cache):
+        """Run the chosen tokenizer over sentences
+
+        Args:
+            sentences: Iterable of lists containing data index number and
+                sentence
+            tokenizer: 'custom' or 'simple', tokenize method to use
+            token_min_len: Minimum length of tokens
+            batch_size: Number of sentences spacy processes at a time
+            n_process: Number of processes spacy uses, -1 for all CPUs
+            token_filter: TokenFilter to use with the custom tokenizer
+            cache: sptm.cache.TokenCache to use with the custom tokenizer
+
+        Returns:
+            Generator of lists of data index number followed by tokenized
+            sentence
+
+        Raises:
+            Exception: Unknown tokenizer
+        """
+        if tokenizer == 'custom':
+            return self.iter_tokens_custom(sentences, token_min_len, \
+                                batch_size, n_process, token_filter, cache)
+        elif tokenizer == 'simple':
+            return self.iter_tokens_simple(sentences, min_len=token_min_len)
+        raise Exception('Unknown tokenizer, use custom or simple')
+
+def _remove(path):
+    """Delete a file if it exists
+
+    Args:
+        path: Location of the file
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _process_shard(job):
+    """Process one byte range of a data file, see Corpus.process_parallel()
+
+    Args:
+        job: Tuple of the Corpus, shard file name, start and end byte
+            offsets followed by the pipeline arguments
+
+    Returns:
+        Tuple of shard file name, number of reviews (lines) in the range and
+        number of tokenized sentences written
+    """
+    corpus, name, start, end, tokenizer, delimiter, reg, rep, \
+        sentence_min_len, token_min_len, batch_size, token_filter, \
+                                                            chunk_size = job
+    lines = [0]
+
+    def reviews(mm):
+        mm.seek(start)
+        while mm.tell() < end:
+            lines[0] += 1
+            yield _select_data(mm.readline(), delimiter, reg, rep)
+
+    # Start from an empty shard file, the pool may be re-running this job
+    io.open(name, 'w', encoding='utf8').close()
+    with io.open(corpus.path, 'rb') as raw:
+        mm = mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            tokens = corpus._iter_pipeline(reviews(mm), tokenizer, \
+                sentence_min_len, token_min_len, batch_size, 1, \
+                                                        token_filter, None)
+            count = _write_chunks(name, tokens, chunk_size)
+        finally:
+            mm.close()
+    return name, lines[0], count
+
+def _save_checkpoint(path, state):
+    """Atomically replace a checkpoint file
+
+    Args:
+        path: Location of the checkpoint file
+        state: Dictionary to save
+    """
+    with io.open(path + '.tmp', 'w', encoding='utf8') as F:
+        F.write(force_unicode(json.dumps(state)))
+        F.flush()
+        os.fsync(F.fileno())
+    os.replace(path + '.tmp', path)
+
+def _write_chunks(name, rows, chunk_size):
+    """Append rows to a file, <chunk_size> rows at a time
+
+    Args:
+        name: Name of file
+        rows: Iterable of lists of data index number followed by tokens
+        chunk_size: Number of rows to buffer before writing them out
+
+    Returns:
+        Number of rows written
+
+    Raises:
+        IOError: Path does not exist
+    """
+    count = 0
+    try:
+        outfile = io.open(name, "a", encoding='utf8')
+    except IOError:
+        raise IOError('Path does not exist')
+
+    with outfile:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            _write_rows(outfile, chunk)
+            count += len(chunk)
+    return count
+
+def _iter_cached(nlp, sentences, token_filter, cache, batch_size, n_process):
+    """Filter sentences, skipping spacy for the ones found in the cache
+
+    Sentences are looked up CACHE_BLOCK at a time, the misses of a block are
+    sent through spacy together and added to the cache.
+
+    Args:
+        nlp: spacy Language object
+        sentences: Iterable of lists containing data index number and
+            sentence
+        token_filter: TokenFilter
+        cache: sptm.cache.TokenCache
+        batch_size: Number of sentences spacy processes at a time
+        n_process: Number of processes spacy uses, -1 for all CPUs
+
+    Yields:
+        Tuples of data index number and list of lemmas kept
+    """
+    import spacy
+
+    config = u'spacy=%s;model=%s_%s-%s;pipeline=%s;%s' % (spacy.__version__, \
+        nlp.meta.get('lang'), nlp.meta.get('name'), nlp.meta.get('version'), \
+                        ','.join(nlp.pipe_names), token_filter.signature())
+
+    sentences = iter(sentences)
+    while True:
+        block = [(force_unicode(s[1]), s[0]) for s in \
+                                itertools.islice(sentences, CACHE_BLOCK)]
+        if not block:
+            break
+        keys = [cache.key(text, config) for text, index in block]
+        found = cache.get_many(keys)
+
+        # Sentences repeated within the block only go through spacy once
+        missing = dict()
+        for (text, index), key in zip(block, keys):
+            if key not in found:
+                missing[key] = text
+        new = []
+        if missing:
+            docs = nlp.pipe(((text, key) for key, text in missing.items()), \
+                as_tuples=True, batch_size=batch_size, n_process=n_process)
+            new = [(key, token_filter(doc)) for doc, key in docs]
+            cache.put_many(new)
+        cache.commit()
+        found.update(new)
+
+        for (text, index), key in zip(block, keys):
+            yield index, found[key]
+
+def _select_data(line, delimiter, reg, rep):
+    """Select the data (last column) of a line and run the regex on it
+
+    Args:
+        line: Line read from the data file, bytes are decoded as utf8
+        delimiter: The seperator between data
+        reg: Custom regex to filter
+        rep: String to replace the regex values
+
+    Returns:
+        Filtered data
+
+    Raises:
+        Exception: Data format in the line does not follow template
+    """
+    try:
+        return re.sub(reg, rep, force_unicode(line).strip().split( \
+                                                            delimiter)[-1])
+    except:
+        raise Exception('Data format in the file does not follow template')
+
+def _write_rows(outfile, rows):
+    """Write token rows to an open file, one comma joined row per line
+
+    Args:
+        outfile: File object opened in text mode
+        rows: Iterable of lists of data index number followed by tokens
+    """
+    for row in rows:
+        outfile.write(force_unicode(','.join(row) + "\n"))
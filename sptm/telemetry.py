@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Training telemetry: throughput, likelihood and memory of LDA trainings
+"""
+
+#######################################
+
+import os
+import re
+import json
+import math
+import time
+import logging
+import subprocess
+
+from gensim.models.callbacks import Metric
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+logger = logging.getLogger(__name__)
+
+# Progress line Mallet prints every 10 iterations
+_MALLET_PROGRESS = re.compile(r'^<(\d+)> LL/token: (-?[0-9.]+(?:E-?\d+)?)')
+
+class Telemetry:
+    """Metrics of a training, sent to sinks as it goes
+
+    Every record is a dictionary holding the backend, number of topics,
+    iteration (or pass) reached, wall time since the previous record and
+    per iteration, tokens/sec and/or documents/sec, resident memory of the
+    process and the processes it started (rss_bytes, None without /proc)
+    and whatever the backend measured, e.g. log_likelihood (per token, in
+    nats as Mallet's LL/token and gensim's bound) and perplexity, its
+    exponential, see perplexity().
+
+    A sink is an object with an emit(record) method, e.g. JsonLinesSink or
+    PrometheusTextSink, or any function taking the record.
+
+    Attributes:
+        sinks: List of sinks
+        backend: Backend of the training
+        num_topics: Number of topics of the training
+        num_tokens: Number of tokens sampled every iteration, if known
+        num_docs: Number of documents read every pass, if known
+        pid: Process whose memory is reported, this one if None
+    """
+
+    def __init__(self, sinks):
+        """Inits Telemetry
+
+        Args:
+            sinks: List of sinks
+        """
+        self.sinks = list(sinks)
+        self.start(None)
+
+    def start(self, backend, num_topics=None, num_tokens=None, \
+                                                num_docs=None, pid=None):
+        """Start measuring a new training
+
+        Args:
+            backend: Backend of the training
+            num_topics: Number of topics
+            num_tokens: Number of tokens sampled every iteration
+            num_docs: Number of documents read every pass
+            pid: Process whose memory is reported, this one if None
+        """
+        self.backend = backend
+        self.num_topics = num_topics
+        self.num_tokens = num_tokens
+        self.num_docs = num_docs
+        self.pid = pid
+        self._time = time.time()
+        self._iteration = 0
+
+    def record(self, iteration, **values):
+        """Send a record to every sink
+
+        A sink failing is logged, it does not stop the training.
+
+        Args:
+            iteration: Number of iterations (or passes) done
+            values: Other metrics of the record
+
+        Returns:
+            The record
+        """
+        now = time.time()
+        elapsed = max(now - self._time, 1e-9)
+        done = max(iteration - self._iteration, 0)
+        record = {'time': now, 'backend': self.backend, \
+            'num_topics': self.num_topics, 'iteration': iteration, \
+            'seconds': elapsed, \
+            'seconds_per_iteration': elapsed / done if done else None, \
+            'rss_bytes': rss(self.pid)}
+        if self.num_tokens is not None:
+            record['tokens_per_sec'] = self.num_tokens * done / elapsed
+        if self.num_docs is not None:
+            record['docs_per_sec'] = self.num_docs * done / elapsed
+        record.update(values)
+        self._time = now
+        self._iteration = iteration
+
+        for sink in self.sinks:
+            try:
+                if hasattr(sink, 'emit'):
+                    sink.emit(record)
+                else:
+                    sink(record)
+            except (IOError, OSError) as e:
+                logger.warning('telemetry sink %r failed: %s', sink, e)
+        return record
+
+class JsonLinesSink:
+    """Append every record to a file, one JSON object per line
+
+    Attributes:
+        path: Location of the file
+    """
+
+    def __init__(self, path):
+        """Inits JsonLinesSink
+
+        Args:
+            path: Location of the file
+        """
+        self.path = path
+
+    def emit(self, record):
+        """Append a record
+
+        Args:
+            record: Dictionary of metrics
+        """
+        with open(self.path, 'a') as F:
+            F.write(json.dumps(record, sort_keys=True) + '\n')
+
+class PrometheusTextSink:
+    """Keep the latest record in a file of the Prometheus text format, for
+    node-exporter's textfile collector
+
+    Every numeric metric is a gauge named <prefix>_<metric>, labelled with
+    the backend and number of topics. The file is replaced at once so the
+    collector never reads it half written.
+
+    Attributes:
+        path: Location of the file, ending in .prom
+        prefix: Prefix of the metric names
+    """
+
+    def __init__(self, path, prefix='sptm_train'):
+        """Inits PrometheusTextSink
+
+        Args:
+            path: Location of the file, ending in .prom
+            prefix: Prefix of the metric names
+        """
+        self.path = path
+        self.prefix = prefix
+
+    def emit(self, record):
+        """Write a record over the previous one
+
+        Args:
+            record: Dictionary of metrics
+        """
+        labels = '{backend="%s",num_topics="%s"}' % (record.get('backend'), \
+                                                    record.get('num_topics'))
+        lines = []
+        for key in sorted(record):
+            value = record[key]
+            if key == 'num_topics' or isinstance(value, bool) or \
+                                not isinstance(value, (int, float)):
+                continue
+            name = '%s_%s' % (self.prefix, key)
+            lines.append('# TYPE %s gauge\n' % name)
+            lines.append('%s%s %r\n' % (name, labels, float(value)))
+        with open(self.path + '.tmp', 'w') as F:
+            F.writelines(lines)
+        os.replace(self.path + '.tmp', self.path)
+
+class TelemetryMetric(Metric):
+    """gensim callback sending a record after every pass of LdaModel
+
+    Attributes:
+        telemetry: Telemetry object
+        corpus: Documents the per token likelihood bound and perplexity are
+            estimated on, none estimated if None
+        passes: Number of passes done
+    """
+
+    def __init__(self, telemetry, corpus=None, title='telemetry'):
+        """Inits TelemetryMetric
+
+        Args:
+            telemetry: Telemetry object
+            corpus: Documents the likelihood is estimated on, e.g. a sample
+                of the training corpus
+            title: Name of the metric in the model's metrics
+        """
+        self.telemetry = telemetry
+        self.corpus = corpus
+        self.title = title
+        self.logger = None
+        self.viz_env = None
+        self.passes = 0
+
+    def get_value(self, **kwargs):
+        """Send the record of the pass just done
+
+        Args:
+            kwargs: model, the gensim LDA model trained
+
+        Returns:
+            Per token likelihood bound, None if not estimated
+        """
+        self.passes += 1
+        values = dict()
+        if self.corpus:
+            bound = kwargs['model'].log_perplexity(self.corpus)
+            values = {'log_likelihood': bound, \
+                                            'perplexity': perplexity(bound)}
+        self.telemetry.record(self.passes, **values)
+        return values.get('log_likelihood')
+
+def perplexity(log_likelihood):
+    """Perplexity of a log likelihood per token
+
+    Mallet, the Gibbs sampler and gensim's bound all give natural log
+    likelihoods, gensim's own log line reports 2 ** -bound instead.
+
+    Args:
+        log_likelihood: Log likelihood per token, in nats
+
+    Returns:
+        Float value
+    """
+    return math.exp(-log_likelihood)
+
+def rss(pid=None):
+    """Resident memory of a process and all the processes it started
+
+    Args:
+        pid: Process id, this process if None
+
+    Returns:
+        Number of bytes, None where /proc is not available or the process
+        is gone
+    """
+    pid = pid or os.getpid()
+    try:
+        page = os.sysconf('SC_PAGE_SIZE')
+        names = os.listdir('/proc')
+    except (IOError, OSError, ValueError, AttributeError):
+        return None
+
+    children = dict()
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as F:
+                parent = int(F.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(name))
+
+    total = None
+    tree = [pid]
+    while tree:
+        current = tree.pop()
+        try:
+            with open('/proc/%d/statm' % current) as F:
+                total = (total or 0) + int(F.read().split()[1]) * page
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        tree.extend(children.get(current, ()))
+    return total
+
+def mallet_progress(line):
+    """Iteration and log likelihood of a Mallet progress line
+
+    Args:
+        line: Line of Mallet's output
+
+    Returns:
+        Tuple of iteration and log likelihood per token, None if the line is
+        not a progress line
+    """
+    match = _MALLET_PROGRESS.match(line.strip())
+    if match is None:
+        return None
+    return int(match.group(1)), float(match.group(2))
+
+def run_mallet(cmd, telemetry):
+    """Run a Mallet command, sending a record to telemetry for every
+    progress line it prints
+
+    Args:
+        cmd: Shell command
+        telemetry: Telemetry object, started
+
+    Raises:
+        subprocess.CalledProcessError: Mallet failed
+    """
+    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, \
+                        stderr=subprocess.STDOUT, universal_newlines=True)
+    telemetry.pid = process.pid
+    output = []
+    for line in process.stdout:
+        output.append(line)
+        progress = mallet_progress(line)
+        if progress is not None:
+            iteration, ll = progress
+            telemetry.record(iteration, log_likelihood=ll, \
+                                                perplexity=perplexity(ll))
+    process.stdout.close()
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, cmd, \
+                                                            ''.join(output))
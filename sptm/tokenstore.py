@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Binary storage of tokenized sentences
+"""
+
+#######################################
+
+import io
+import os
+import json
+import array
+import codecs
+
+import numpy as np
+import gensim.corpora as corpora
+
+from sptm.utils import force_unicode
+
+__author__ = "Rochan Avlur Venkat"
+__credits__ = ["Anupam Mediratta"]
+__license__ = "MIT"
+__version__ = "1.1"
+__maintainer__ = "Rochan Avlur Venkat"
+__email__ = "rochan170543@mechyd.ac.in"
+
+#######################################
+
+FORMAT_VERSION = 1
+
+class TokenStore:
+    """Tokenized sentences stored as flat arrays
+
+    Alternative to the comma separated tokens file written by
+    Corpus.write_processed(). A store is a directory holding:
+
+        meta.json: format version and sizes
+        vocab.json: list of tokens, position in the list is the token id
+        ids.npy: int32 token ids of all sentences, one after the other
+        offsets.npy: int64 position in ids.npy where each sentence starts,
+            plus the total number of tokens
+        data_index.npy: int64 data index number of each sentence
+
+    Token ids are handed out in the same order gensim's Dictionary does
+    (sentence by sentence, new tokens of a sentence in sorted order), so the
+    vocabulary doubles as the id2word mapping of the tokens.
+
+    A TokenStore can also stand in for the Corpus.tokens list: it supports
+    append(), extend(), len(), indexing and iteration, rows coming out as
+    lists of data index number followed by tokens. Every token is kept
+    once in the vocabulary and sentences cost 4 bytes per token plus 16
+    bytes of offset and data index. Stores opened with load() are read
+    only.
+
+    Attributes:
+        vocab: List of tokens
+        token2id: Dictionary of {token: id}
+        ids: int32 token ids
+        offsets: int64 start of each sentence in ids
+        data_index: int64 data index number of each sentence
+    """
+
+    def __init__(self, vocab=None, ids=None, offsets=None, data_index=None):
+        """Inits TokenStore, empty unless arrays are passed
+
+        Args:
+            vocab: List of tokens
+            ids: int32 token ids
+            offsets: int64 start of each sentence in ids, plus len(ids)
+            data_index: int64 data index number of each sentence
+        """
+        self.vocab = vocab if (vocab is not None) else []
+        self.token2id = dict((t, i) for i, t in enumerate(self.vocab))
+        self.ids = ids if (ids is not None) else array.array('i')
+        self.offsets = offsets if (offsets is not None) else \
+                                                        array.array('q', [0])
+        self.data_index = data_index if (data_index is not None) else \
+                                                            array.array('q')
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a store from token rows
+
+        Args:
+            rows: Iterable of lists of data index number followed by tokens,
+                like Corpus.tokens
+
+        Returns:
+            TokenStore object
+
+        Raises:
+            Exception: Rows do not follow required structure
+        """
+        store = cls()
+        try:
+            for row in rows:
+                store.append(row)
+        except (ValueError, TypeError, IndexError):
+            raise Exception("Tokens list does not follow required structure")
+        return store
+
+    @classmethod
+    def from_file(cls, path):
+        """Build a store from a tokens file written by
+        Corpus.write_processed()
+
+        Args:
+            path: Location of the tokens file
+
+        Returns:
+            TokenStore object
+
+        Raises:
+            IOError: File not found
+            Exception: Tokens file does not follow required structure
+        """
+        try:
+            with codecs.open(path, 'r', encoding='utf8') as F:
+                return cls.from_rows(row.rstrip('\n').split(',') for row in F)
+        except IOError:
+            raise IOError('File not found')
+
+    def append(self, row):
+        """Add a token row at the end of the store
+
+        Args:
+            row: List of data index number followed by tokens
+        """
+        tokens = [force_unicode(t) for t in row[1:]]
+        for token in sorted(set(t for t in tokens if t not in self.token2id)):
+            self.token2id[token] = len(self.vocab)
+            self.vocab.append(token)
+        self.ids.extend(self.token2id[t] for t in tokens)
+        self.offsets.append(len(self.ids))
+        self.data_index.append(int(row[0]))
+
+    def extend(self, rows):
+        """Add several token rows at the end of the store
+
+        Args:
+            rows: Iterable of lists of data index number followed by tokens
+        """
+        for row in rows:
+            self.append(row)
+
+    def save(self, path):
+        """Save the store in a directory
+
+        Args:
+            path: Directory to save to, created if missing
+
+        Raises:
+            IOError: Path could not be written
+        """
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            np.save(os.path.join(path, 'ids.npy'), \
+                                        np.asarray(self.ids, dtype=np.int32))
+            np.save(os.path.join(path, 'offsets.npy'), \
+                                    np.asarray(self.offsets, dtype=np.int64))
+            np.save(os.path.join(path, 'data_index.npy'), \
+                                np.asarray(self.data_index, dtype=np.int64))
+            with io.open(os.path.join(path, 'vocab.json'), 'w', \
+                                                        encoding='utf8') as F:
+                F.write(force_unicode(json.dumps(self.vocab)))
+            with io.open(os.path.join(path, 'meta.json'), 'w', \
+                                                        encoding='utf8') as F:
+                F.write(force_unicode(json.dumps({'version': FORMAT_VERSION, \
+                    'num_docs': len(self), 'num_tokens': len(self.ids), \
+                                            'num_terms': len(self.vocab)})))
+        except (IOError, OSError):
+            raise IOError('Error with output path')
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Open a store saved with TokenStore.save()
+
+        Args:
+            path: Directory of the store
+            mmap: Memory-map the arrays instead of reading them
+
+        Returns:
+            TokenStore object
+
+        Raises:
+            IOError: Not a token store / unsupported version
+        """
+        mode = 'r' if mmap else None
+        try:
+            with io.open(os.path.join(path, 'meta.json'), 'r', \
+                                                        encoding='utf8') as F:
+                meta = json.load(F)
+            if meta['version'] != FORMAT_VERSION:
+                raise IOError('Unsupported token store version')
+            with io.open(os.path.join(path, 'vocab.json'), 'r', \
+                                                        encoding='utf8') as F:
+                vocab = json.load(F)
+            return cls(vocab, \
+                np.load(os.path.join(path, 'ids.npy'), mmap_mode=mode), \
+                np.load(os.path.join(path, 'offsets.npy'), mmap_mode=mode), \
+                np.load(os.path.join(path, 'data_index.npy'), mmap_mode=mode))
+        except (IOError, OSError, ValueError, KeyError):
+            raise IOError('Token store not found or corrupted')
+
+    @staticmethod
+    def is_store(path):
+        """Check whether a path is a directory saved with TokenStore.save()
+
+        Args:
+            path: Location to check
+
+        Returns:
+            Boolean
+        """
+        return os.path.isfile(os.path.join(path, 'meta.json'))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('TokenStore index out of range')
+        vocab = self.vocab
+        return [u'%d' % self.data_index[i]] + [vocab[t] for t in self.doc(i)]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        """Memory used by the arrays of the store, vocabulary excluded
+
+        Returns:
+            Number of bytes
+        """
+        return sum(len(a) * a.itemsize for a in (self.ids, self.offsets, \
+                                                            self.data_index))
+
+    def doc(self, i):
+        """Token ids of a sentence
+
+        Args:
+            i: Position of the sentence
+
+        Returns:
+            Array of token ids
+        """
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def texts(self):
+        """Tokens of every sentence, without the data index number
+
+        Returns:
+            Sequence of lists of tokens, decoded lazily
+        """
+        return _Texts(self)
+
+    def _unique_pairs(self):
+        """Count every distinct (sentence, token id) pair
+
+        Returns:
+            Tuple of numpy arrays: sentence, token id and count of each pair,
+            sorted by sentence then token id
+        """
+        num_terms = max(len(self.vocab), 1)
+        ids = np.asarray(self.ids, dtype=np.int64)
+        offsets = np.asarray(self.offsets, dtype=np.int64)
+        docs = np.repeat(np.arange(len(self), dtype=np.int64), \
+                                                            np.diff(offsets))
+        pairs, counts = np.unique(docs * num_terms + ids, return_counts=True)
+        return pairs // num_terms, pairs % num_terms, counts
+
+    def dictionary(self):
+        """Build the gensim Dictionary of the store without going through
+        the tokens
+
+        Returns:
+            gensim.corpora.Dictionary equal to Dictionary(self.texts())
+        """
+        docs, ids, counts = self._unique_pairs()
+        dfs = np.bincount(ids, minlength=len(self.vocab))
+        cfs = np.bincount(ids, weights=counts, minlength=len(self.vocab))
+
+        dictionary = corpora.Dictionary()
+        dictionary.token2id = dict(self.token2id)
+        dictionary.dfs = dict(enumerate(dfs.tolist()))
+        if hasattr(dictionary, 'cfs'):
+            dictionary.cfs = dict(enumerate(cfs.astype(np.int64).tolist()))
+        dictionary.num_docs = len(self)
+        dictionary.num_pos = int(len(self.ids))
+        dictionary.num_nnz = int(len(ids))
+        return dictionary
+
+    def bow(self):
+        """Term document frequency of every sentence
+
+        Returns:
+            List of lists of (token id, count), equal to calling doc2bow()
+            on every sentence with self.dictionary()
+        """
+        docs, ids, counts = self._unique_pairs()
+        bounds = np.searchsorted(docs, np.arange(len(self) + 1))
+        ids = ids.tolist()
+        counts = counts.tolist()
+        return [list(zip(ids[s:e], counts[s:e])) \
+                                    for s, e in zip(bounds[:-1], bounds[1:])]
+
+class _Texts:
+    """Lazily decoded tokens of a TokenStore, usable like a list of lists
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, i):
+        vocab = self.store.vocab
+        return [vocab[t] for t in self.store.doc(i)]
+
+    def __iter__(self):
+        for i in range(len(self.store)):
+            yield self[i]
+
+class SentenceStore:
+    """Sentences stored as one utf-8 buffer and offsets
+
+    Stands in for the Corpus.sentences list: it supports append(),
+    extend(), len(), indexing and iteration, entries coming out as lists of
+    data index number and sentence.
+
+    Attributes:
+        text: bytearray, utf-8 sentences one after the other
+        offsets: int64 start of each sentence in text, plus len(text)
+        data_index: int64 data index number of each sentence
+    """
+
+    def __init__(self):
+        """Inits an empty SentenceStore
+        """
+        self.text = bytearray()
+        self.offsets = array.array('q', [0])
+        self.data_index = array.array('q')
+
+    def append(self, entry):
+        """Add a sentence at the end of the store
+
+        Args:
+            entry: List of data index number and sentence
+        """
+        self.text.extend(force_unicode(entry[1]).encode('utf8'))
+        self.offsets.append(len(self.text))
+        self.data_index.append(int(entry[0]))
+
+    def extend(self, entries):
+        """Add several sentences at the end of the store
+
+        Args:
+            entries: Iterable of lists of data index number and sentence
+        """
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('SentenceStore index out of range')
+        return [self.data_index[i], bytes(self.text[self.offsets[i]:\
+                                    self.offsets[i + 1]]).decode('utf8')]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        """Memory used by the store
+
+        Returns:
+            Number of bytes
+        """
+        return len(self.text) + (len(self.offsets) + \
+                                                len(self.data_index)) * 8
@@ -6,7 +6,20 @@
 
 #######################################
 
+import io
+import os
+import re
+import json
+import math
+import logging
+import gzip
+import shutil
+import tempfile
+import threading
 from argparse import ArgumentParser
+import numpy as np
+import gensim.corpora as corpora
+from gensim.models.wrappers import LdaMallet
 import sptm
 
 __author__ = "Rochan Avlur Venkat"
@@ -18,6 +31,955 @@ __email__ = "rochan170543@mechyd.ac.in"
 
 #######################################
 
+# Reviews the equivalence tests run on
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+		'test_short.txt')
+
+def _read_rows(path):
+	"""Read a tokens file back as lists of strings"""
+	with io.open(path, 'r', encoding='utf8') as F:
+		return [line.rstrip('\n').split(',') for line in F]
+
+def _batch_rows(tokenizer, directory):
+	"""Tokens of TEST_DATA written by the one step at a time methods"""
+	corpus = sptm.Corpus(TEST_DATA)
+	corpus.read_reviews()
+	corpus.split_sentence()
+	if tokenizer == 'simple':
+		corpus.tokenize_simple(min_len=1)
+	else:
+		corpus.tokenize_custom()
+	path = os.path.join(directory, 'batch_%s.csv' % tokenizer)
+	corpus.write_processed(path)
+	return _read_rows(path)
+
+def test_process_stream_tokenizers():
+	"""process_stream() writes the rows of both tokenizers as the one step
+	at a time methods do"""
+	directory = tempfile.mkdtemp()
+	try:
+		for tokenizer in ('simple', 'custom'):
+			path = os.path.join(directory, 'stream_%s.csv' % tokenizer)
+			count = sptm.Corpus(TEST_DATA).process_stream(path, \
+					chunk_size=7, tokenizer=tokenizer)
+			rows = _read_rows(path)
+			assert count == len(rows) > 0
+			assert rows == _batch_rows(tokenizer, directory)
+	finally:
+		shutil.rmtree(directory)
+
+def test_token_filter():
+	"""TokenFilter keeps the lemmas the token by token condition keeps"""
+	corpus = sptm.Corpus(TEST_DATA)
+	corpus.read_reviews()
+	corpus.split_sentence()
+	nlp = sptm.preprocess.load_nlp()
+	token_filter = sptm.TokenFilter(min_len=1)
+	for index, sentence in corpus.sentences:
+		doc = nlp(sptm.force_unicode(sentence))
+		kept = [tok.lemma_ for tok in doc if tok.is_stop != True and \
+				tok.pos_ != 'SYM' and tok.tag_ != 'PRP' and \
+				tok.tag_ != 'PRP$' and tok.pos_ != 'NUM' and \
+				tok.dep_ != 'aux' and tok.dep_ != 'prep' and \
+				tok.dep_ != 'det' and tok.dep_ != 'cc' and len(tok) != 1]
+		assert token_filter(doc) == kept
+
+def test_custom_tokens_order():
+	"""Batched spacy keeps the sentences in order whatever the batch size
+	and number of processes, and the trimmed pipeline and the model cache
+	lemmatize as the full pipeline does"""
+	corpus = sptm.Corpus(TEST_DATA, nlp_profile='full')
+	corpus.read_reviews()
+	corpus.split_sentence()
+	nlp = sptm.preprocess.load_nlp(profile='full')
+	token_filter = sptm.TokenFilter(min_len=1)
+	expected = []
+	for index, sentence in corpus.sentences:
+		row = [str(index)] + token_filter(nlp(sptm.force_unicode(sentence)))
+		if len(row) > 1:
+			expected.append(row)
+	assert expected
+
+	for batch_size, n_process in ((1, 1), (7, 1), (1000, 1), (7, 2)):
+		assert list(corpus.iter_tokens_custom(corpus.sentences, \
+				batch_size=batch_size, n_process=n_process)) == expected
+
+	assert sptm.preprocess.load_nlp(profile='full') is nlp
+	filtered = sptm.preprocess.load_nlp(profile='filter')
+	assert filtered is sptm.preprocess.load_nlp() and filtered is not nlp
+	corpus.nlp_profile = 'filter'
+	assert list(corpus.iter_tokens_custom(corpus.sentences, \
+			batch_size=7)) == expected
+	try:
+		sptm.preprocess.load_nlp(profile='tagger')
+		assert False, 'unknown profile loaded'
+	except Exception as e:
+		assert 'Unknown spacy profile' in str(e)
+
+def test_token_store():
+	"""TokenStore rows, dictionary and bag of words are the ones of the
+	tokens file and gensim"""
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'tokens.csv')
+		sptm.Corpus(TEST_DATA).process_stream(path, tokenizer='simple')
+		rows = _read_rows(path)
+		texts = [row[1:] for row in rows]
+
+		sptm.TokenStore.from_file(path).save(os.path.join(directory, 'store'))
+		store = sptm.TokenStore.load(os.path.join(directory, 'store'))
+		assert list(store) == rows
+
+		dictionary = corpora.Dictionary(texts)
+		built = store.dictionary()
+		assert built.token2id == dictionary.token2id
+		assert built.dfs == dictionary.dfs
+		assert built.cfs == dictionary.cfs
+		assert (built.num_docs, built.num_pos, built.num_nnz) == \
+				(dictionary.num_docs, dictionary.num_pos, dictionary.num_nnz)
+		assert store.bow() == [dictionary.doc2bow(t) for t in texts]
+	finally:
+		shutil.rmtree(directory)
+
+def test_token_cache():
+	"""TokenCache evicts the least recently used sentences, counts hits and
+	misses, and tokenizes as spacy does"""
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'tokens.sqlite')
+		cache = sptm.TokenCache(path, max_entries=3)
+		keys = [sptm.TokenCache.key(t, 'config') for t in 'abcde']
+		for i in range(3):
+			cache.put_many([(keys[i], [str(i)])])
+			cache.commit()
+		assert cache.get_many(keys[:1]) == {keys[0]: ['0']}
+		cache.commit()
+		cache.put_many([(keys[3], ['3'])])
+		cache.commit()
+		assert len(cache) == 3
+		# b was the least recently used, a was looked up after c
+		found = cache.get_many(keys)
+		assert sorted(found) == sorted([keys[0], keys[2], keys[3]])
+		assert (cache.hits, cache.misses) == (4, 2)
+		assert sptm.TokenCache.key('a', 'other') != keys[0]
+		cache.close()
+
+		cache = sptm.TokenCache(path, max_entries=3)
+		assert len(cache) == 3 and (cache.hits, cache.misses) == (0, 0)
+		assert cache.get_many(keys[3:4]) == {keys[3]: ['3']}
+		cache.close()
+
+		corpus = sptm.Corpus(TEST_DATA)
+		corpus.read_reviews()
+		corpus.split_sentence()
+		sentences = corpus.sentences
+		plain = list(corpus.iter_tokens_custom(sentences))
+		cache = sptm.TokenCache(os.path.join(directory, 'spacy.sqlite'))
+		assert list(corpus.iter_tokens_custom(sentences, \
+				cache=cache)) == plain
+		assert (cache.hits, cache.misses) == (0, len(sentences))
+		assert list(corpus.iter_tokens_custom(sentences, \
+				cache=cache)) == plain
+		assert cache.hits == len(sentences)
+		cache.close()
+	finally:
+		shutil.rmtree(directory)
+
+def test_compact_corpus():
+	"""A compact Corpus holds the sentences and tokens of a list backed one
+	and writes the same rows"""
+	directory = tempfile.mkdtemp()
+	try:
+		for tokenizer in ('simple', 'custom'):
+			results = []
+			for compact in (False, True):
+				corpus = sptm.Corpus(TEST_DATA, compact=compact)
+				corpus.read_reviews()
+				corpus.split_sentence()
+				if tokenizer == 'simple':
+					corpus.tokenize_simple()
+				else:
+					corpus.tokenize_custom()
+				path = os.path.join(directory, '%s_%s.csv' % \
+						(tokenizer, compact))
+				corpus.write_processed(path)
+				results.append((corpus, _read_rows(path)))
+			(plain, plain_rows), (compact, compact_rows) = results
+			assert isinstance(compact.sentences, sptm.SentenceStore)
+			assert isinstance(compact.tokens, sptm.TokenStore)
+			assert list(compact.sentences) == list(plain.sentences)
+			assert list(compact.tokens) == list(plain.tokens)
+			assert compact_rows == plain_rows
+			assert len(compact.tokens) == len(plain.tokens) > 0
+
+		store = sptm.SentenceStore()
+		store.extend([[3, u'caf\xe9 au lait'], ['4', b'room'], [5, u'']])
+		assert len(store) == 3
+		assert store[0] == [3, u'caf\xe9 au lait']
+		assert store[-2] == [4, u'room'] and store[2] == [5, u'']
+		assert store.nbytes() == len(u'caf\xe9 au lait'.encode('utf8')) + \
+				4 + (4 + 3) * 8
+		try:
+			store[3]
+			assert False, 'read past the end of the store'
+		except IndexError:
+			pass
+	finally:
+		shutil.rmtree(directory)
+
+def test_process_parallel():
+	"""process_parallel() writes the rows process_stream() does, whatever
+	the number of shards"""
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'serial.csv')
+		sptm.Corpus(TEST_DATA).process_stream(path)
+		serial = _read_rows(path)
+		for shards in (1, 4):
+			path = os.path.join(directory, 'shards_%d.csv' % shards)
+			count = sptm.Corpus(TEST_DATA).process_parallel(path, \
+					processes=2, shards=shards)
+			assert count == len(serial)
+			assert _read_rows(path) == serial
+			assert not [f for f in os.listdir(directory) if '.shard-' in f]
+	finally:
+		shutil.rmtree(directory)
+
+def test_process_parallel_empty_rows():
+	"""Sentences left without tokens are merged as rows of an index only,
+	for both tokenizers"""
+	directory = tempfile.mkdtemp()
+	try:
+		data = os.path.join(directory, 'data.txt')
+		with io.open(data, 'w', encoding='utf8') as F:
+			F.write(u'Oct 12 2009\tNumbers\t12345 678910.\n')
+			F.write(u'Oct 13 2009\tWords\tThe room was clean. 42 42.\n')
+			F.write(u'Oct 14 2009\tNumbers\t12345 678910.\n')
+		for tokenizer in ('simple', 'custom'):
+			path = os.path.join(directory, 'serial_%s.csv' % tokenizer)
+			sptm.Corpus(data).process_stream(path, tokenizer=tokenizer)
+			serial = _read_rows(path)
+			if tokenizer == 'simple':
+				assert ['0'] in serial
+			for shards in (1, 3):
+				path = os.path.join(directory, 'shards_%s_%d.csv' % \
+						(tokenizer, shards))
+				count = sptm.Corpus(data).process_parallel(path, \
+						processes=2, shards=shards, tokenizer=tokenizer)
+				assert count == len(serial)
+				assert _read_rows(path) == serial
+		assert not [f for f in os.listdir(directory) if '.shard-' in f]
+	finally:
+		shutil.rmtree(directory)
+
+class _CrashingFilter(sptm.TokenFilter):
+	"""TokenFilter raising after a number of sentences, a crashed run"""
+
+	def __init__(self, after):
+		sptm.TokenFilter.__init__(self)
+		self.after = after
+
+	def __call__(self, doc):
+		self.after -= 1
+		if self.after < 0:
+			raise RuntimeError('crashed')
+		return sptm.TokenFilter.__call__(self, doc)
+
+def test_process_stream_resume():
+	"""A crashed process_stream() resumed from its checkpoint writes the
+	rows of a run that did not crash, once"""
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'serial.csv')
+		sptm.Corpus(TEST_DATA).process_stream(path)
+		serial = _read_rows(path)
+
+		path = os.path.join(directory, 'resumed.csv')
+		checkpoint = os.path.join(directory, 'checkpoint.json')
+		try:
+			sptm.Corpus(TEST_DATA).process_stream(path, chunk_size=10, \
+					token_filter=_CrashingFilter(45), checkpoint=checkpoint)
+			assert False, 'run did not crash'
+		except RuntimeError:
+			pass
+		assert 0 < len(_read_rows(path)) < len(serial)
+		# Half written row of the crashed run
+		with io.open(path, 'a', encoding='utf8') as F:
+			F.write(u'7,half,writ')
+
+		sptm.Corpus(TEST_DATA).process_stream(path, chunk_size=10, \
+				checkpoint=checkpoint)
+		assert _read_rows(path) == serial
+		assert sptm.Corpus(TEST_DATA).process_stream(path, chunk_size=10, \
+				checkpoint=checkpoint) == 0
+		assert _read_rows(path) == serial
+	finally:
+		shutil.rmtree(directory)
+
+def test_hashed_mallet_topics():
+	"""Word topics LdaMallet reads back from the Mallet state of a hashed
+	vocabulary land on the ids the words were written from"""
+	directory = tempfile.mkdtemp()
+	try:
+		# Far more tokens than remembered, most buckets are named #<id>
+		rows = [[str(i)] + ['w%d' % ((i * 7 + j * 3) % 97) \
+				for j in range(12)] for i in range(60)]
+		model = sptm.Model(None, tokens=rows)
+		model.fit(hash_buckets=64, hash_top_n=5)
+
+		lda = LdaMallet.__new__(LdaMallet)
+		lda.id2word = model.id2word
+		lda.num_terms = len(model.id2word)
+		lda.num_topics = 3
+		lda.prefix = os.path.join(directory, '')
+
+		# State file of Mallet, words being written by their bucket name
+		expected = np.zeros((lda.num_topics, lda.num_terms))
+		with gzip.open(lda.fstate(), 'wt') as F:
+			F.write(u'#doc source pos typeindex type topic\n')
+			F.write(u'#alpha : 0.1 0.1 0.1\n#beta : 0.01\n')
+			for doc, bow in enumerate(model.corpus):
+				pos = 0
+				for tokenid, count in bow:
+					topic = (doc + tokenid) % lda.num_topics
+					for c in range(count):
+						F.write(u'%d NA %d %d %s %d\n' % (doc, pos, \
+								tokenid, lda.id2word[tokenid], topic))
+						expected[topic, tokenid] += 1
+						pos += 1
+		assert any(lda.id2word[i].startswith('#') for i in range(64))
+		assert np.array_equal(lda.load_word_topics(), expected)
+	finally:
+		shutil.rmtree(directory)
+
+def test_corpus_mallet_reuse():
+	"""A corpus is imported to Mallet once, by whichever model fits it
+	first, and a different corpus is imported anew"""
+	directory = tempfile.mkdtemp()
+	try:
+		# Stands for Mallet, logging and copying what it imports
+		log = os.path.join(directory, 'imports.log')
+		mallet = os.path.join(directory, 'mallet')
+		with open(mallet, 'w') as F:
+			F.write('#!/bin/sh\necho "$@" >> %s\n' % log)
+			F.write('while [ $# -gt 0 ]; do case "$1" in ' \
+					'--input) i="$2";; --output) o="$2";; esac; ' \
+					'shift; done\ncp "$i" "$o"\n')
+		os.chmod(mallet, 0o755)
+		prefix = os.path.join(directory, 'lda_')
+		rows = [[str(i)] + t for i, t in enumerate(_planted_texts(20))]
+
+		def imported(tokens):
+			model = sptm.Model(mallet, tokens)
+			model.fit()
+			model.params(prefix=prefix)
+			return model, model._corpus_mallet()
+
+		model, path = imported(rows)
+		assert os.path.dirname(path) == directory and os.path.isfile(path)
+		assert model._corpus_mallet() == path
+		model.fit()
+		assert model._corpus_mallet() == path
+		assert imported(rows)[1] == path
+		assert _count_lines(log) == 1
+
+		changed = imported(rows[1:])[1]
+		assert changed != path and os.path.isfile(changed)
+		assert _count_lines(log) == 2
+		assert sorted(os.listdir(directory)) == sorted(['imports.log', \
+				'mallet', os.path.basename(path), os.path.basename(changed)])
+	finally:
+		shutil.rmtree(directory)
+
+def test_sparse_doctopics_width():
+	"""A sparse document topic file keeps the number of topics it is read
+	with, its .npy copies of either width do not replace each other and
+	it does not fit in fewer topics than it holds"""
+	directory = tempfile.mkdtemp()
+	try:
+		# Mallet's sparse format, topics 3 and 4 never appear
+		path = os.path.join(directory, 'doctopics.txt')
+		with io.open(path, 'w', encoding='utf8') as F:
+			F.write(u'#doc name topic proportion ...\n')
+			F.write(u'0\t0\t1 0.75 0 0.25\n1\t1\t2 1.0\n2\t2\t0 0.5 1 0.5\n')
+		tokens = os.path.join(directory, 'tokens.csv')
+		with io.open(tokens, 'w', encoding='utf8') as F:
+			F.write(u'0,room,clean\n0,staff,rude\n1,food,cold\n')
+
+		for num_topics, width in ((5, 5), (None, 3), (5, 5), (None, 3)):
+			matrix = sptm.load_doctopics(path, num_topics)
+			assert matrix.shape == (3, width)
+			assert matrix[0, 1] == np.float32(0.75)
+		cond = sptm.ConditionalMatrix(path, tokens, num_topics=5)
+		assert cond.num_topics == 5
+		cond.construct_matrix()
+		assert cond.freq_matrix.shape == (5, 5)
+		# Only the copies themselves are left, no temporary file
+		for name in os.listdir(directory):
+			assert name in ('doctopics.txt', 'tokens.csv') or \
+					re.match(r'doctopics\.txt(\.5)?\.float\d+\.npy$', name)
+
+		# Topic 2 does not fit in 2 topics, whether loaded or iterated
+		for load in (sptm.load_doctopics, \
+				lambda p, n: list(sptm.iter_doctopics(p, n))):
+			try:
+				load(path, 2)
+				assert False, 'topic 2 of 2 topics loaded'
+			except Exception as e:
+				assert 'give num_topics' in str(e)
+	finally:
+		shutil.rmtree(directory)
+
+def test_conditional_paths():
+	"""Vectorized, blocked, pooled and streamed conditional matrices match
+	the sentence by sentence double loop"""
+	directory = tempfile.mkdtemp()
+	try:
+		state = np.random.RandomState(0)
+		num_topics = 4
+		index = np.repeat(np.arange(12), state.randint(1, 6, 12))
+		doc_matrix = state.dirichlet(np.ones(num_topics), len(index))
+		path = os.path.join(directory, 'doctopics.txt')
+		with io.open(path, 'w', encoding='utf8') as F:
+			for i, row in enumerate(doc_matrix):
+				F.write(u'%d\t%d\t%s\n' % (i, i, \
+						'\t'.join(repr(float(p)) for p in row)))
+		tokens = os.path.join(directory, 'tokens.csv')
+		with io.open(tokens, 'w', encoding='utf8') as F:
+			for i in index:
+				F.write(u'%d,word\n' % i)
+
+		# Double loop the vectorized construction replaced
+		freq = np.zeros((num_topics, num_topics))
+		topic_freq = np.zeros(num_topics)
+		for i in range(len(index) - 1):
+			if index[i] == index[i + 1]:
+				for x in range(num_topics):
+					for y in range(num_topics):
+						freq[x][y] += doc_matrix[i + 1][y] * doc_matrix[i][x]
+						topic_freq[x] += doc_matrix[i][x]
+		for x in range(num_topics):
+			if topic_freq[x] != 0:
+				freq[x] = freq[x] / topic_freq[x] * 65
+
+		for stream, chunksize, processes in ((False, 100000, 1), \
+				(False, 4, 1), (False, 4, 2), (True, 4, 1), (True, 1, 1)):
+			cond = sptm.ConditionalMatrix(path, tokens, stream=stream)
+			cond.construct_matrix(chunksize=chunksize, processes=processes)
+			assert np.allclose(cond.freq_matrix, freq)
+			assert np.allclose([cond.topic_freq[x] for x in \
+					range(num_topics)], topic_freq)
+	finally:
+		shutil.rmtree(directory)
+
+def _planted_texts(num_docs, seed=0):
+	"""Documents drawn each from one of 3 topics of 8 words of their own"""
+	state = np.random.RandomState(seed)
+	return [['t%d_w%d' % (i % 3, w) for w in state.randint(0, 8, 20)] \
+			for i in range(num_docs)]
+
+def _planted_groups(model, id2word):
+	"""Planted topic of the top words of every topic of a model"""
+	return [set(id2word[i].split('_')[0] for i in \
+			np.argsort(-topic)[:8]) for topic in model.get_topics()]
+
+def _check_counts(model):
+	"""Word and document topic counts of a GibbsLda are those of its
+	token topics"""
+	nwk = np.zeros_like(model.word_topics)
+	np.add.at(nwk, (model.words, model.topics), 1)
+	assert np.array_equal(model.word_topics, nwk)
+	docs = np.repeat(np.arange(len(model.lengths)), model.lengths)
+	ndk = np.zeros(model.doc_topic_counts.shape, dtype=np.int64)
+	np.add.at(ndk, (docs, model.topics), 1)
+	assert np.array_equal(model.doc_topic_counts, ndk)
+
+def test_gibbs_planted_topics():
+	"""GibbsLda finds planted topics with one or several workers, and infers
+	the topic of a document of one of them"""
+	texts = _planted_texts(90)
+	dictionary = corpora.Dictionary(texts)
+	corpus = [dictionary.doc2bow(t) for t in texts]
+	for workers in (1, 2):
+		model = sptm.GibbsLda(corpus, num_topics=3, id2word=dictionary, \
+				alpha=0.3, iterations=100, workers=workers)
+		_check_counts(model)
+		assert model.word_topics.sum() == 90 * 20
+		groups = _planted_groups(model, dictionary)
+		assert all(len(g) == 1 for g in groups)
+		assert set.union(*groups) == set(['t0', 't1', 't2'])
+
+		for doc in (0, 1, 2):
+			dist = dict(model.get_document_topics(corpus[doc]))
+			best = max(dist, key=dist.get)
+			assert groups[best] == set(['t%d' % doc])
+			assert abs(sum(dist.values()) - 1) < 1e-6
+		assert len(list(model.get_document_topics(corpus[:4]))) == 4
+
+def test_gibbs_update_doctopics():
+	"""GibbsLda.update() resumes on added documents, and write_doctopics()
+	appends their rows to the ones written before"""
+	directory = tempfile.mkdtemp()
+	try:
+		texts = _planted_texts(60)
+		dictionary = corpora.Dictionary(texts)
+		corpus = [dictionary.doc2bow(t) for t in texts]
+		model = sptm.GibbsLda(corpus[:40], num_topics=3, \
+				id2word=dictionary, alpha=0.3, iterations=30)
+		path = os.path.join(directory, 'doctopics.txt')
+		model.write_doctopics(path)
+		before = model.doc_topics()
+
+		model.update(corpus[40:], iterations=10)
+		assert len(model.lengths) == len(model.doc_topic_counts) == 60
+		assert len(model.topics) == 60 * 20
+		_check_counts(model)
+		model.write_doctopics(path, first=40)
+
+		matrix = sptm.load_doctopics(path, cache=False)
+		assert matrix.shape == (60, 3)
+		assert np.allclose(matrix[:40], before, atol=1e-6)
+		assert np.allclose(matrix[40:], model.doc_topics()[40:], atol=1e-6)
+		with io.open(path, 'r', encoding='utf8') as F:
+			assert [int(line.split('\t')[0]) for line in F] == \
+					list(range(60))
+	finally:
+		shutil.rmtree(directory)
+
+def test_lda_cluster():
+	"""A cluster of 2 local workers trains the topics LdaModel trains in
+	batch mode from the same seed, and refuses what it does not support
+
+	Workers start the inference of their documents from their own random
+	state, so topics match up to a small difference, and may come out in
+	another order.
+	"""
+	from gensim.models.ldamodel import LdaModel
+	texts = _planted_texts(60)
+	dictionary = corpora.Dictionary(texts)
+	corpus = [dictionary.doc2bow(t) for t in texts]
+	expected = LdaModel(corpus=corpus, num_topics=3, id2word=dictionary, \
+			chunksize=10, passes=20, update_every=0, random_state=1)
+
+	lda = LdaModel(num_topics=3, id2word=dictionary, chunksize=10, \
+			random_state=1)
+	cluster = sptm.LdaCluster(2)
+	try:
+		assert cluster.scatter(corpus, 10) == 60
+		cluster.train(lda, passes=20)
+		try:
+			cluster.train(LdaModel(num_topics=3, id2word=dictionary, \
+					eta='auto'))
+			assert False, 'eta=auto accepted'
+		except Exception as e:
+			assert 'eta=auto' in str(e)
+	finally:
+		cluster.close()
+	diff = np.abs(lda.get_topics()[:, None] - \
+			expected.get_topics()[None]).max(axis=2)
+	assert sorted(diff.argmin(axis=1)) == [0, 1, 2]
+	assert diff.min(axis=1).max() < 1e-2
+
+	for authkey in (None, b''):
+		try:
+			sptm.distributed.serve(('127.0.0.1', 0), authkey)
+			assert False, 'served without an authkey'
+		except Exception as e:
+			assert 'authkey' in str(e)
+	try:
+		sptm.LdaCluster(1, [('127.0.0.1', 1)])
+		assert False, 'remote workers without an authkey'
+	except Exception as e:
+		assert 'authkey' in str(e)
+
+def _count_lines(path):
+	"""Number of lines of a file"""
+	with io.open(path, 'r', encoding='utf8') as F:
+		return sum(1 for line in F)
+
+def test_model_update():
+	"""update() grows the dictionary and the model with it, appends one
+	doctopics row per new row and leaves a streamed corpus file as it was"""
+	directory = tempfile.mkdtemp()
+	try:
+		rows = [[str(i)] + t for i, t in enumerate(_planted_texts(40))]
+		new_rows = [[str(40 + i), 'fresh%d' % (i % 3)] + t for i, t in \
+				enumerate(_planted_texts(7, seed=1))]
+		doctopics = os.path.join(directory, 'doctopics.txt')
+
+		for stream in (False, True):
+			model = sptm.ModelVanilla(rows)
+			corpus_path = os.path.join(directory, 'corpus_%d.mm' % stream)
+			model.fit(stream=stream, corpus_path=corpus_path)
+			model.params(num_topics=3, passes=2, update_every=0)
+			model.train()
+			num_terms = len(model.id2word)
+			if stream:
+				with open(corpus_path, 'rb') as F:
+					written = F.read()
+			io.open(doctopics, 'w').close()
+
+			model.update(new_rows, doctopics_path=doctopics)
+			assert len(model.id2word) == num_terms + 3
+			assert model.lda_model.num_terms == len(model.id2word)
+			assert model.lda_model.get_topics().shape == (3, num_terms + 3)
+			assert len(model.corpus) == 47
+			assert list(model.corpus)[40:] == [model.id2word.doc2bow( \
+					row[1:]) for row in new_rows]
+			assert _count_lines(doctopics) == len(new_rows)
+			if stream:
+				with open(corpus_path, 'rb') as F:
+					assert F.read() == written
+
+		model = sptm.Model(None, rows)
+		model.fit()
+		model.params(num_topics=3, iterations=20, workers=1, \
+				backend='gibbs')
+		model.train()
+		model.lda_model_mallet.write_doctopics(doctopics)
+		num_terms = len(model.id2word)
+		model.update(new_rows, iterations=5, doctopics_path=doctopics)
+		assert len(model.id2word) == num_terms + 3
+		assert model.lda_model_mallet.num_terms == len(model.id2word)
+		assert _count_lines(doctopics) == 40 + len(new_rows)
+	finally:
+		shutil.rmtree(directory)
+
+def test_stream_fit_vocabulary():
+	"""A tokens file read in memory or streamed gives the same tokens,
+	dictionary and corpus"""
+	directory = tempfile.mkdtemp()
+	try:
+		path = os.path.join(directory, 'tokens.csv')
+		sptm.Corpus(TEST_DATA).process_stream(path, tokenizer='simple')
+		for cls, args in ((sptm.Model, (None,)), (sptm.ModelVanilla, ())):
+			listed = cls(*args, input_path=path)
+			listed.fit()
+			streamed = cls(*args, input_path=path, stream=True)
+			streamed.fit(stream=True, \
+					corpus_path=os.path.join(directory, 'corpus.mm'))
+			assert [list(t) for t in streamed.tokens] == listed.tokens
+			assert not [t for t in listed.id2word.token2id if '\n' in t]
+			assert streamed.id2word.token2id == listed.id2word.token2id
+			assert list(streamed.corpus) == listed.corpus
+	finally:
+		shutil.rmtree(directory)
+
+def test_cooccurrence_coherence():
+	"""CooccurrenceCache c_v is gensim's, windows sliding over texts shorter
+	and longer than them, with tokens out of the dictionary and texts
+	without any top word"""
+	from gensim.models.ldamodel import LdaModel
+	from gensim.models.coherencemodel import CoherenceModel
+	state = np.random.RandomState(2)
+	texts = [t[:state.randint(1, 21)] for t in _planted_texts(60)]
+	texts += [['rare%d' % i, 'other'] * 3 for i in range(5)]
+	dictionary = corpora.Dictionary(texts)
+	dictionary.filter_tokens(bad_ids=[dictionary.token2id['rare0']])
+	corpus = [dictionary.doc2bow(t) for t in texts]
+	lda = LdaModel(corpus=corpus, num_topics=3, id2word=dictionary, \
+			passes=5, random_state=0)
+	for window_size, processes in ((4, 1), (7, 2), (110, 2)):
+		cache = sptm.CooccurrenceCache(texts, dictionary, window_size, \
+				processes=processes, chunksize=16)
+		for topn in (5, 10):
+			expected = CoherenceModel(model=lda, texts=texts, \
+					dictionary=dictionary, coherence='c_v', topn=topn, \
+					window_size=window_size).get_coherence()
+			assert abs(cache.coherence(lda, topn) - expected) < 1e-9
+
+def test_deduplicator():
+	"""Exact and near duplicates collapse into their first row, near
+	duplicate groups are transitive, and expand() maps back every row"""
+	rows = [['0', 'room', 'clean'], ['0', 'staff', 'rude'], \
+			['1', 'room', 'clean'], ['2', 'food', 'cold'], \
+			['2', 'room', 'clean'], ['3', 'staff', 'rude']]
+	dedup = sptm.Deduplicator().fit(rows)
+	assert dedup.tokens == [rows[0], rows[1], rows[3]]
+	assert dedup.weights.tolist() == [3, 2, 1]
+	assert dedup.mapping.tolist() == [0, 1, 0, 2, 0, 1]
+	expanded = dedup.expand([row[1:] for row in dedup.tokens])
+	assert [[row[0]] + list(t) for row, t in zip(rows, expanded)] == rows
+	doc_topic = np.arange(6.).reshape(3, 2)
+	assert dedup.expand(doc_topic).shape == (6, 2)
+	assert np.array_equal(dedup.expand(doc_topic)[4], doc_topic[0])
+
+	# b is close to a and c to b, c is not close to a
+	a = ['a%d' % i for i in range(40)]
+	b = a[:38] + ['b0', 'b1']
+	c = b[2:] + ['c0', 'c1']
+	other = ['o%d' % i for i in range(40)]
+	rows = [['0'] + other, ['1'] + a, ['2'] + b, ['3'] + c, ['4'] + b]
+	dedup = sptm.Deduplicator(near=True, threshold=0.85, num_perm=512, \
+			bands=128)
+	sig = dedup.signatures([a, b, c])
+	assert np.mean(sig[0] == sig[1]) >= 0.85
+	assert np.mean(sig[1] == sig[2]) >= 0.85
+	assert np.mean(sig[0] == sig[2]) < 0.85
+	dedup.fit(rows)
+	assert dedup.tokens == [rows[0], rows[1]]
+	assert dedup.weights.tolist() == [1, 4]
+	assert dedup.mapping.tolist() == [0, 1, 1, 1, 1]
+	assert dedup.expand(['0', '1']).tolist() == ['0', '1', '1', '1', '1']
+	assert sptm.Deduplicator(near=True).fit(rows[:1]).tokens == rows[:1]
+
+def test_model_bundle():
+	"""Bundles of Model and ModelVanilla load back as saved, verify()
+	catches a changed byte and a partial bundle is never loaded"""
+	directory = tempfile.mkdtemp()
+	try:
+		rows = [[str(i)] + t for i, t in enumerate(_planted_texts(30))]
+		model = sptm.Model(None, rows)
+		model.fit()
+		model.params(num_topics=3, iterations=20, workers=1, \
+				backend='gibbs')
+		model.train()
+		vanilla = sptm.ModelVanilla(rows)
+		vanilla.fit()
+		vanilla.params(num_topics=3, passes=2)
+		vanilla.train()
+
+		for trained, name in ((model, 'lda_model_mallet'), \
+				(vanilla, 'lda_model')):
+			path = os.path.join(directory, type(trained).__name__)
+			trained.save(path, bundle=True)
+			lda = getattr(trained, name)
+			loaded = type(trained)(None)
+			loaded.load(path)
+			bundle = getattr(loaded, name)
+			assert isinstance(bundle, sptm.ModelBundle)
+			assert np.allclose(bundle.get_topics(), lda.get_topics())
+			assert bundle.doc_topic.shape == (30, 3)
+			assert np.allclose(bundle.doc_topic.sum(axis=1), 1, atol=1e-5)
+			assert bundle.id2word.token2id == trained.id2word.token2id
+			assert bundle.params['num_topics'] == 3
+			assert bundle.manifest['num_docs'] == 30
+			assert len(loaded.topics(3, 5)) == 3
+			sptm.ModelBundle.load(path, verify=True)
+
+		# Flip a byte of the document topics
+		path = os.path.join(directory, 'Model')
+		location = os.path.join(path, 'doc_topic.npy')
+		with open(location, 'r+b') as F:
+			F.seek(-1, os.SEEK_END)
+			byte = F.read(1)
+			F.seek(-1, os.SEEK_END)
+			F.write(bytes([byte[0] ^ 1]))
+		for load in (lambda: sptm.ModelBundle.load(path, verify=True), \
+				lambda: sptm.ModelBundle.load(path).verify()):
+			try:
+				load()
+				assert False, 'changed byte not caught'
+			except IOError as e:
+				assert 'doc_topic.npy' in str(e)
+
+		# Bundle of a crashed save
+		path = os.path.join(directory, 'crashed')
+		shutil.copytree(os.path.join(directory, 'ModelVanilla'), \
+				path + '.partial')
+		for load in (sptm.ModelBundle.load, sptm.ModelVanilla(None).load):
+			try:
+				load(path)
+				assert False, 'partial bundle loaded'
+			except IOError:
+				pass
+		vanilla.save(path, bundle=True)
+		assert not os.path.exists(path + '.partial')
+		sptm.ModelBundle.load(path, verify=True)
+	finally:
+		shutil.rmtree(directory)
+
+class _Records(logging.Handler):
+	"""Logging handler keeping the messages logged"""
+
+	def __init__(self):
+		logging.Handler.__init__(self)
+		self.messages = []
+
+	def emit(self, record):
+		self.messages.append(record.getMessage())
+
+def test_vanilla_backends():
+	"""ModelVanilla trains with the backend asked for, bounds the job
+	queue of the multicore backend and logs the throughput of each"""
+	from gensim.models.ldamodel import LdaModel
+	import gensim.models.ldamulticore as ldamulticore
+	rows = [[str(i)] + t for i, t in enumerate(_planted_texts(40))]
+	model = sptm.ModelVanilla(rows)
+	model.fit()
+
+	queue = ldamulticore.Queue
+	sizes = []
+	others = []
+	def spy(maxsize=0):
+		if threading.current_thread() is not threading.main_thread():
+			others.append(maxsize)
+		else:
+			sizes.append(maxsize)
+			if maxsize:
+				# Queue of another thread during the training
+				thread = threading.Thread(target=ldamulticore.Queue, \
+						kwargs={'maxsize': 8})
+				thread.start()
+				thread.join()
+		return queue(maxsize=maxsize)
+	records = _Records()
+	logging.getLogger().addHandler(records)
+	ldamulticore.Queue = spy
+	try:
+		for backend, cls in (('single', LdaModel), \
+				('multicore', ldamulticore.LdaMulticore), \
+				('cluster', LdaModel)):
+			for queue_depth in ((None, 1) if backend == 'multicore' \
+					else (None,)):
+				del sizes[:]
+				model.params(num_topics=3, passes=2, backend=backend, \
+						workers=2, queue_depth=queue_depth)
+				model.train()
+				assert isinstance(model.lda_model, cls)
+				if backend == 'multicore':
+					assert sizes == [queue_depth or 4, 0]
+				assert ldamulticore.Queue is spy
+				assert model.throughput[backend] > 0
+	finally:
+		ldamulticore.Queue = queue
+		logging.getLogger().removeHandler(records)
+	assert others == [8, 8]
+	assert sorted(model.throughput) == ['cluster', 'multicore', 'single']
+	for backend in model.throughput:
+		assert [m for m in records.messages if m.startswith('%s ' \
+				'backend: 40 documents x 2 passes' % backend) and \
+				'docs/sec' in m]
+
+	for kwargs in ({'backend': 'gpu'}, {'queue_depth': 0}, \
+			{'backend': 'multicore', 'alpha': 'auto'}, \
+			{'backend': 'cluster', 'distributed': True}):
+		try:
+			model.params(**kwargs)
+			assert False, 'params %s accepted' % kwargs
+		except Exception as e:
+			assert 'accepted' not in str(e)
+
+# Output of Mallet's train-topics, progress lines among the others
+MALLET_OUTPUT = u"""Mallet LDA: 3 topics, 2 topic bits, 11 topic mask
+Data loaded.
+max tokens: 20
+total tokens: 1200
+<10> LL/token: -8.12345
+[beta: 0.01]
+<20> LL/token: -7.8
+<30> LL/token: -7.5E-1
+0\t0.5\troom clean staff
+Total time: 1 seconds
+"""
+
+def test_telemetry():
+	"""Sinks write parseable records, the Mallet progress lines are parsed
+	and every backend reports the perplexity of its log likelihood"""
+	directory = tempfile.mkdtemp()
+	try:
+		assert [sptm.telemetry.mallet_progress(line) for line in \
+				MALLET_OUTPUT.splitlines() if sptm.telemetry. \
+				mallet_progress(line)] == [(10, -8.12345), (20, -7.8), \
+				(30, -0.75)]
+		records = []
+		telemetry = sptm.Telemetry([records.append])
+		telemetry.start('mallet', 3, num_tokens=1200)
+		path = os.path.join(directory, 'mallet.txt')
+		with io.open(path, 'w', encoding='utf8') as F:
+			F.write(MALLET_OUTPUT)
+		sptm.telemetry.run_mallet('cat %s' % path, telemetry)
+		assert [(r['iteration'], r['log_likelihood']) for r in records] \
+				== [(10, -8.12345), (20, -7.8), (30, -0.75)]
+		assert all(r['tokens_per_sec'] >= 0 for r in records)
+
+		jsonl = os.path.join(directory, 'train.jsonl')
+		prom = os.path.join(directory, 'train.prom')
+		rows = [[str(i)] + t for i, t in enumerate(_planted_texts(30))]
+		vanilla = sptm.ModelVanilla(rows)
+		vanilla.fit()
+		vanilla.params(num_topics=3, passes=3)
+		vanilla.set_telemetry([sptm.JsonLinesSink(jsonl), \
+				sptm.PrometheusTextSink(prom), records.append], 10)
+		vanilla.train()
+		model = sptm.Model(None, rows)
+		model.fit()
+		model.params(num_topics=3, iterations=20, workers=1, \
+				backend='gibbs')
+		model.set_telemetry([records.append])
+		model.train()
+
+		assert [(r['backend'], r['iteration']) for r in records[3:]] == \
+				[('single', 1), ('single', 2), ('single', 3), \
+				('gibbs', 10), ('gibbs', 20)]
+		for record in records:
+			assert abs(record['perplexity'] - \
+					math.exp(-record['log_likelihood'])) < 1e-6 * \
+					record['perplexity']
+
+		with io.open(jsonl, 'r', encoding='utf8') as F:
+			written = [json.loads(line) for line in F]
+		assert [r['iteration'] for r in written] == [1, 2, 3]
+		assert written[-1]['perplexity'] == records[5]['perplexity']
+		with io.open(prom, 'r', encoding='utf8') as F:
+			lines = F.read().splitlines()
+		sample = re.compile(r'^(sptm_train_\w+)\{backend="single",' \
+				r'num_topics="3"\} (\S+)$')
+		values = dict()
+		for line in lines:
+			if line.startswith('# TYPE '):
+				assert line.endswith(' gauge')
+				continue
+			name, value = sample.match(line).groups()
+			values[name] = float(value)
+		assert values['sptm_train_iteration'] == 3
+		assert values['sptm_train_perplexity'] == records[5]['perplexity']
+		assert 'sptm_train_backend' not in values
+	finally:
+		shutil.rmtree(directory)
+
+def test_optimum_topic():
+	"""Sweeps score the same with one or several processes, and halving
+	rounds train fewer candidates each time, for longer"""
+	rows = [[str(i)] + t for i, t in enumerate(_planted_texts(30))]
+	model = sptm.Model(None, rows)
+	model.fit()
+	model.params(num_topics=3, iterations=9, workers=1, backend='gibbs')
+
+	for halving in (False, True):
+		serial = model.optimum_topic(2, 11, 1, processes=1, \
+				halving=halving)
+		assert model.optimum_topic(2, 11, 1, processes=2, \
+				halving=halving) == serial
+		assert [r['num_topics'] for r in serial] == list(range(2, 11))
+	assert set(r['budget'] for r in serial) == set([1 / 9., 1 / 3., 1.])
+
+	trained = []
+	candidate = model._candidate
+	def record(num_topics, iterations, workers):
+		trained.append((num_topics, iterations))
+		return candidate(num_topics, iterations, workers)
+	model._candidate = record
+	results = dict((r['num_topics'], r) for r in \
+			model.optimum_topic(2, 11, 1, processes=1, halving=True))
+	rounds = [[k for k, units in trained if units == u] for u in (1, 3, 9)]
+	assert [len(r) for r in rounds] == [9, 3, 1]
+	assert len(trained) == 13
+	# Survivors of a round are its best candidates, and go on alone
+	first = [k for k, units in trained[:9]]
+	assert set(rounds[1]) <= set(first)
+	assert set(rounds[2]) <= set(rounds[1])
+	assert all(results[k]['budget'] == 1 / 3. for k in rounds[1] \
+			if k not in rounds[2])
+	assert results[rounds[2][0]]['budget'] == 1.
+
+	model.params(num_topics=3, iterations=2, workers=1, backend='gibbs')
+	try:
+		model.optimum_topic(2, 11, 1, halving=True)
+		assert False, 'budget of 2 iterations halved'
+	except Exception as e:
+		assert 'cannot be halved' in str(e)
+
 if __name__ == '__main__':
 
 	# Parse command-line arguments
@@ -116,3 +1078,31 @@ if __name__ == '__main__':
 
 	# Display the topic distribution
 	print(inference.infer(["There was a lot of noise"], 2, 1))
+
+	"""
+	Test equivalence of the streaming and parallel paths:
+	"""
+	test_process_stream_tokenizers()
+	test_token_filter()
+	test_token_store()
+	test_process_parallel()
+	test_process_parallel_empty_rows()
+	test_process_stream_resume()
+	test_hashed_mallet_topics()
+	test_sparse_doctopics_width()
+	test_conditional_paths()
+	test_gibbs_planted_topics()
+	test_gibbs_update_doctopics()
+	test_lda_cluster()
+	test_model_update()
+	test_stream_fit_vocabulary()
+	test_cooccurrence_coherence()
+	test_deduplicator()
+	test_model_bundle()
+	test_vanilla_backends()
+	test_telemetry()
+	test_optimum_topic()
+	test_token_cache()
+	test_corpus_mallet_reuse()
+	test_compact_corpus()
+	test_custom_tokens_order()